@@ -11,4 +11,5 @@
 ) = range(200, 204)
 (WAIT_FOR_EMAIL_CODE,WAIT_FOR_2FA_CONFIRM) = range(1000, 1002)
 (ADMIN_ADD_2FA_ASK, ADMIN_ADD_EMAIL, ADMIN_ADD_EMAIL_PASSWORD,ADMIN_EDIT_EMAIL_CHOOSE_FIELD ) = range(300, 304)
-ADMIN_BROADCAST_MESSAGE = 3000
\ No newline at end of file
+ADMIN_BROADCAST_MESSAGE = 3000
+ADMIN_USER_SEARCH = 3100
\ No newline at end of file
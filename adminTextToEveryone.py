@@ -1,18 +1,19 @@
 import asyncio
+import time
 
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Update
+from telegram.constants import MessageLimit
 from telegram.ext import CallbackContext, CallbackQueryHandler, MessageHandler, ConversationHandler, CommandHandler, filters
-from utils import get_all_user_ids, show_registration_error, is_admin, main_menu_keyboard, check_user_is_approved_and_admin
+from utils import show_registration_error, is_admin, main_menu_keyboard, check_user_is_approved_and_admin
 from States import ADMIN_BROADCAST_MESSAGE
-import traceback
+from broadcastJobs import broadcast_jobs, media_item, message_fits
+from config import BROADCAST_ALBUM_WAIT_SECONDS
 import logging
-import html
-import asyncio
 
 
 
 async def admin_broadcast_start(update: Update, context: CallbackContext):
-    allowed = await check_user_is_approved_and_admin(update)
+    allowed = await check_user_is_approved_and_admin(update, context)
     if not allowed:
         return ConversationHandler.END
 
@@ -27,7 +28,8 @@ async def admin_broadcast_start(update: Update, context: CallbackContext):
         print(f"Ошибка при удалении сообщения: {e}")
 
     await query.message.chat.send_message(
-        text="Введите сообщение для рассылки:",
+        text="Отправьте сообщение для рассылки: текст, фото, видео, документ или альбом.\n"
+             "Подпись к файлам станет текстом рассылки.",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     return ADMIN_BROADCAST_MESSAGE
@@ -56,56 +58,112 @@ async def admin_broadcast_cancel_callback(update: Update, context: CallbackConte
 
 
 
-async def admin_broadcast_send(update: Update, context: CallbackContext):
-    message_text = update.message.text
-    admin_id = update.effective_user.id
-    user_ids = [uid for uid in get_all_user_ids() if uid != admin_id]
-    logging.info(f"Отправка рассылки пользователям: {user_ids}")
+class AlbumCollector:
+    """
+    Альбом приходит отдельными сообщениями с общим media_group_id.
+    Файлы собираются, пока новые части приходят чаще, чем раз в wait секунд;
+    future альбома получает все его сообщения по порядку.
+    """
+
+    def __init__(self, wait=BROADCAST_ALBUM_WAIT_SECONDS):
+        self.wait = wait
+        self._albums = {}
+
+    def add(self, message) -> asyncio.Future:
+        album = self._albums.get(message.media_group_id)
+        if album is None:
+            loop = asyncio.get_running_loop()
+            album = self._albums[message.media_group_id] = {
+                "messages": [], "last_seen": 0.0, "done": loop.create_future()
+            }
+            loop.create_task(self._complete_later(message.media_group_id))
+        album["messages"].append(message)
+        album["last_seen"] = time.monotonic()
+        return album["done"]
+
+    async def _complete_later(self, media_group_id):
+        while True:
+            delay = self._albums[media_group_id]["last_seen"] + self.wait - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        album = self._albums.pop(media_group_id)
+        album["done"].set_result(sorted(album["messages"], key=lambda m: m.message_id))
+
+
+album_collector = AlbumCollector()
+
+
+class _AlbumPart(filters.MessageFilter):
+    # Остальные части альбома, пока первая ждёт их в admin_broadcast_media. Часть может
+    # прийти раньше, чем задача первой начнёт выполняться, — тогда альбом начинает она
+    def filter(self, message):
+        return bool(message.media_group_id)
+
+
+BROADCAST_MEDIA = filters.PHOTO | filters.VIDEO | filters.Document.ALL
 
-    try:
-        await update.message.delete()
-    except Exception as e:
-        logging.warning(f"Ошибка при удалении сообщения админа: {e}")
 
-    async def send_message(user_id):
+async def start_broadcast(context: CallbackContext, admin_id, messages, text=None, media=None) -> bool:
+    if not message_fits(text, media):
+        limit = MessageLimit.CAPTION_LENGTH if media else MessageLimit.MAX_TEXT_LENGTH
+        await context.bot.send_message(
+            chat_id=admin_id,
+            text=f"❌ Слишком длинный текст рассылки: вместе с подсказкой о меню не больше {limit} символов.\n"
+                 f"Отправьте сообщение для рассылки ещё раз.",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="cancel_broadcast")]])
+        )
+        return False
+
+    for message in messages:
         try:
-            full_message = (
-                f"{html.escape(message_text)}\n\n"
-                f"📋 Чтобы открыть меню, нажмите или введите команду /start"
-            )
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=full_message,
-                parse_mode="HTML"
-            )
-            logging.info(f"✅ Сообщение успешно отправлено пользователю {user_id}")
-            return True
+            await message.delete()
         except Exception as e:
-            logging.error(f"❌ Не отправлено пользователю {user_id}: {e}")
-            logging.error(traceback.format_exc())
-            return False
-
-    tasks = [send_message(uid) for uid in user_ids]
-    results = await asyncio.gather(*tasks)
-
-    count_success = sum(results)
-    count_fail = len(results) - count_success
-
-    result_message = (
-        f"✅ Рассылка завершена.\n"
-        f"Отправлено успешно: {count_success} пользователям.\n"
-        f"Не отправлено: {count_fail} пользователям.\n\n"
-        f"📋 Главное меню:\n"
-        f"Если меню не появилось — введите /start"
-    )
+            logging.warning(f"Ошибка при удалении сообщения админа: {e}")
 
-    await context.bot.send_message(
-        chat_id=admin_id,
-        text=result_message,
-        reply_markup=main_menu_keyboard(admin_id)
-    )
+    # Рассылка сохраняется в БД и идёт в фоне; прогресс — в отдельном сообщении админу
+    await broadcast_jobs.create(context.application, admin_id, text, media)
+    return True
 
-    return ConversationHandler.END
+
+async def admin_broadcast_send(update: Update, context: CallbackContext):
+    started = await start_broadcast(context, update.effective_user.id, [update.message], text=update.message.text)
+    return ConversationHandler.END if started else ADMIN_BROADCAST_MESSAGE
+
+
+async def admin_broadcast_media(update: Update, context: CallbackContext):
+    # Хендлер неблокирующий: пока он ждёт остальные части альбома, диалог в состоянии WAITING
+    # и эти части принимает admin_broadcast_album_part
+    message = update.message
+    admin_id = update.effective_user.id
+
+    messages = [message]
+    if message.media_group_id:
+        messages = await album_collector.add(message)
+    caption = next((m.caption for m in messages if m.caption), None)
+    media = [media_item(m) for m in messages]
+    started = await start_broadcast(context, admin_id, messages, text=caption, media=media)
+    # Слишком длинная подпись — остаёмся в диалоге и ждём сообщение заново
+    return ConversationHandler.END if started else ADMIN_BROADCAST_MESSAGE
+
+
+async def admin_broadcast_album_part(update: Update, context: CallbackContext):
+    album_collector.add(update.message)
+
+
+async def admin_broadcast_unsupported(update: Update, context: CallbackContext):
+    message = update.message
+    # На альбом из неподдерживаемых файлов отвечаем один раз
+    if message.media_group_id:
+        if context.user_data.get("broadcast_rejected_album") == message.media_group_id:
+            return ADMIN_BROADCAST_MESSAGE
+        context.user_data["broadcast_rejected_album"] = message.media_group_id
+    await message.reply_text(
+        "❌ Такое сообщение нельзя разослать: поддерживаются текст, фото, видео, документы и альбомы из них.\n"
+        "Отправьте сообщение для рассылки ещё раз.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="cancel_broadcast")]])
+    )
+    return ADMIN_BROADCAST_MESSAGE
 
 
 broadcast_conv = ConversationHandler(
@@ -115,11 +173,16 @@ broadcast_conv = ConversationHandler(
     states={
         ADMIN_BROADCAST_MESSAGE: [
             MessageHandler(filters.TEXT & ~filters.COMMAND, admin_broadcast_send),
-            CallbackQueryHandler(admin_broadcast_cancel_callback, pattern="^cancel_broadcast$")
+            MessageHandler(BROADCAST_MEDIA, admin_broadcast_media, block=False),
+            CallbackQueryHandler(admin_broadcast_cancel_callback, pattern="^cancel_broadcast$"),
+            MessageHandler(~filters.COMMAND, admin_broadcast_unsupported),
+        ],
+        ConversationHandler.WAITING: [
+            MessageHandler(BROADCAST_MEDIA & _AlbumPart(), admin_broadcast_album_part),
         ],
     },
     fallbacks=[
         CommandHandler("cancel", admin_broadcast_cancel_callback)
     ],
     allow_reentry=True
-)
\ No newline at end of file
+)
@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict, namedtuple
+
+from config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+
+UserAccess = namedtuple("UserAccess", ["is_approved", "is_admin"])
+
+
+class AuthCache:
+    """
+    LRU-кэш прав доступа telegram_id -> UserAccess с ограниченным временем жизни.
+    Хендлеры проверяют права без запроса к БД; при подтверждении, отклонении,
+    удалении и регистрации пользователя запись сразу обновляется или сбрасывается.
+    """
+
+    def __init__(self, max_size=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, telegram_id) -> UserAccess | None:
+        entry = self._entries.get(telegram_id)
+        if entry is None or entry[1] <= time.monotonic():
+            self._entries.pop(telegram_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, telegram_id, is_approved: bool, is_admin: bool) -> UserAccess:
+        access = UserAccess(bool(is_approved), bool(is_admin))
+        self._entries[telegram_id] = (access, time.monotonic() + self.ttl)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return access
+
+    def invalidate(self, telegram_id):
+        self._entries.pop(telegram_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+
+auth_cache = AuthCache()
@@ -0,0 +1,119 @@
+"""
+Бенчмарк поиска кода Steam Guard по локальному корпусу .eml.
+
+Письма корпуса отдаются через CorpusMailbox в FirstMailCodeReader._scan_messages —
+тот же путь, что при чтении настоящего ящика: заголовки и BODYSTRUCTURE, затем
+одна текстовая часть, поиск кода и имени аккаунта. Сетевой обмен не измеряется.
+Запуск из корня репозитория:
+
+    python benchmarks/bench_code_extraction.py [--corpus DIR] [--rounds N]
+"""
+import argparse
+import email
+import logging
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# config требует эти переменные при импорте; бенчмарк не обращается ни к БД, ни к Telegram
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("DATABASE_URL", "postgresql://bench@localhost/bench")
+
+from benchmarks.corpusMailbox import CORPUS_DIR, CorpusMailbox, load_corpus  # noqa: E402
+from getCodeFromMail import FirstMailCodeReader  # noqa: E402
+from mailSessions import MailboxSession  # noqa: E402
+
+
+def legacy_extract(raw: bytes):
+    """Прежняя логика FirstMailCodeReader: только text/plain и английская фраза."""
+    msg = email.message_from_bytes(raw)
+    if "Steam" not in str(msg.get("Subject", "")):
+        return None
+    parts = msg.walk() if msg.is_multipart() else [msg]
+    for part in parts:
+        if part.get_content_type() != "text/plain":
+            continue
+        body = part.get_payload(decode=True).decode(errors="ignore")
+        if "It looks like you are trying to log in from a new device.".lower() not in body.lower():
+            continue
+        match = re.search(r"Steam Guard code.*?([A-Z0-9]{5})", body, re.IGNORECASE)
+        if match:
+            return match.group(1)
+        fallback = re.search(r'\b[A-Z0-9]{5}\b', body)
+        if fallback:
+            return fallback.group(0)
+    return None
+
+
+class ProductionPath:
+    """Разбор одного письма кодом FirstMailCodeReader: возвращает (код, логин аккаунта)."""
+
+    def __init__(self, samples):
+        self.mailbox = CorpusMailbox(samples)
+        self.logins = {sample.expected_account for sample in samples if sample.expected_account}
+        self.reader = FirstMailCodeReader("bench@corpus", "bench")
+
+    def extract(self, sample):
+        # Новая сессия на каждое письмо: иначе письмо уже отмечено разобранным и пропускается
+        session = MailboxSession("bench@corpus", "bench", "corpus", 993)
+        codes = self.reader._scan_messages(
+            self.mailbox, session, [sample.uid], self.logins, "Steam", None, set()
+        )
+        for login, code in codes.items():
+            return code, login
+        for code, _, _, login in session.pending_codes.values():
+            return code, login
+        return None, None
+
+
+def run(name, extract, samples, rounds):
+    correct = missed = false_positives = wrong_account = 0
+    for sample in samples:
+        code, account = extract(sample)
+        if code == sample.expected_code:
+            correct += 1
+            if code and account is not None and account != sample.expected_account:
+                wrong_account += 1
+        elif sample.expected_code is None or (code and code != sample.expected_code):
+            false_positives += 1
+        else:
+            missed += 1
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for sample in samples:
+            extract(sample)
+    elapsed = time.perf_counter() - started
+
+    total = len(samples)
+    negatives = sum(1 for sample in samples if sample.expected_code is None) or 1
+    print(
+        f"{name:<10} {total * rounds / elapsed:>10.0f} msg/s   "
+        f"верно {correct}/{total}   пропущено {missed}   "
+        f"ложных {false_positives} ({false_positives / negatives:.0%} от писем без кода)   "
+        f"чужой аккаунт {wrong_account}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--corpus", default=CORPUS_DIR)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    # config включает INFO-логи, а они стоят дороже самого разбора письма
+    logging.disable(logging.INFO)
+    samples = load_corpus(args.corpus)
+    if not samples:
+        print(f"В {args.corpus} нет .eml файлов")
+        return
+    print(f"Корпус: {len(samples)} писем, {args.rounds} проходов\n")
+    # Прежний код не определял аккаунт письма
+    run("legacy", lambda sample: (legacy_extract(sample.raw), None), samples, args.rounds)
+    run("production", ProductionPath(samples).extract, samples, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
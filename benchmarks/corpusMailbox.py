@@ -0,0 +1,101 @@
+"""
+Корпус .eml как IMAP-ящик: письма отдаются тем же набором FETCH-ответов
+(заголовки, BODYSTRUCTURE, BODY[секция]), что и у настоящего сервера, поэтому
+поиск кода проходит через FirstMailCodeReader._scan_messages без изменений.
+
+Заголовки писем корпуса:
+    X-Expected-Code     — ожидаемый код ("none" — кода в письме нет);
+    X-Expected-Account  — логин аккаунта, к которому относится код.
+"""
+import email
+import os
+from collections import namedtuple
+
+from imapclient.response_types import BodyData
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+HEADER_KEY = b"BODY[HEADER.FIELDS (SUBJECT DATE FROM MESSAGE-ID)]"
+HEADER_NAMES = (b"subject", b"date", b"from", b"message-id")
+
+Sample = namedtuple("Sample", "uid name raw expected_code expected_account")
+
+
+def _expected(msg, header):
+    value = str(msg.get(header, "none")).strip()
+    return None if value.lower() == "none" else value
+
+
+def load_corpus(path=CORPUS_DIR):
+    samples = []
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".eml"):
+            continue
+        with open(os.path.join(path, name), "rb") as f:
+            raw = f.read()
+        msg = email.message_from_bytes(raw)
+        samples.append(Sample(len(samples) + 1, name, raw,
+                              _expected(msg, "X-Expected-Code"), _expected(msg, "X-Expected-Account")))
+    return samples
+
+
+def _header_fields(raw: bytes) -> bytes:
+    """Только запрошенные поля заголовка, как в ответе BODY[HEADER.FIELDS (...)]."""
+    head = raw.replace(b"\r\n", b"\n").split(b"\n\n", 1)[0]
+    lines, keep = [], False
+    for line in head.split(b"\n"):
+        if line[:1] not in (b" ", b"\t"):
+            keep = line.split(b":", 1)[0].strip().lower() in HEADER_NAMES
+        if keep:
+            lines.append(line)
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def _body_structure(part):
+    if part.is_multipart():
+        return BodyData(([_body_structure(sub) for sub in part.get_payload()], part.get_content_subtype().encode()))
+    params = ()
+    charset = part.get_param("charset")
+    if charset:
+        params = (b"charset", str(charset).encode())
+    encoding = str(part.get("Content-Transfer-Encoding", "7bit")).strip().lower()
+    return BodyData((part.get_content_maintype().encode(), part.get_content_subtype().encode(),
+                     params, None, None, encoding.encode(), len(_raw_payload(part))))
+
+
+def _raw_payload(part) -> bytes:
+    # Тело части как на сервере: без декодирования base64/quoted-printable
+    return part.get_payload().encode("utf-8", "surrogateescape")
+
+
+def _section(msg, section):
+    part = msg
+    for index in section.split("."):
+        if part.is_multipart():
+            part = part.get_payload()[int(index) - 1]
+    return part
+
+
+class CorpusMailbox:
+    """Минимальный IMAPClient для FirstMailCodeReader: fetch заголовков, структуры и секций."""
+
+    def __init__(self, samples):
+        self.messages = {sample.uid: email.message_from_bytes(sample.raw) for sample in samples}
+        self.headers = {sample.uid: _header_fields(sample.raw) for sample in samples}
+        self.structures = {uid: _body_structure(msg) for uid, msg in self.messages.items()}
+
+    def fetch(self, uids, items):
+        response = {}
+        for uid in uids:
+            if uid not in self.messages:
+                continue
+            data = {}
+            for item in items:
+                if item.startswith("BODY.PEEK[HEADER"):
+                    data[HEADER_KEY] = self.headers[uid]
+                elif item == "BODYSTRUCTURE":
+                    data[b"BODYSTRUCTURE"] = self.structures[uid]
+                elif item.startswith("BODY.PEEK["):
+                    section = item[len("BODY.PEEK["):-1]
+                    data[f"BODY[{section}]".encode()] = _raw_payload(_section(self.messages[uid], section))
+            response[uid] = data
+        return response
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from config import BROADCAST_RATE, BROADCAST_MAX_CONCURRENCY, BROADCAST_MAX_ATTEMPTS, \
+    BROADCAST_PER_CHAT_INTERVAL, BROADCAST_PROGRESS_SECONDS
+
+
+class TokenBucket:
+    """
+    Общий лимит отправки бота: rate сообщений в секунду без всплесков.
+    pause() останавливает всех отправителей — так Telegram требует при RetryAfter.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class ChatPacer:
+    """Не чаще одного сообщения в interval секунд в один чат."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._last_send = {}
+
+    async def wait(self, chat_id):
+        last = self._last_send.get(chat_id)
+        if last is not None:
+            delay = last + self.interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def sent(self, chat_id):
+        self._last_send[chat_id] = time.monotonic()
+
+
+class BroadcastProgress:
+    def __init__(self, total, sent=0, failed=0):
+        # sent/failed больше нуля — рассылка продолжается после перезапуска
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.retried = 0
+        self.started = time.monotonic()
+        self._sent_before = sent
+        self.finished = False
+
+    @property
+    def remaining(self):
+        return max(self.total - self.sent - self.failed, 0)
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.sent - self._sent_before) / elapsed if elapsed > 0 else 0.0
+
+    def text(self):
+        title = "✅ Рассылка завершена." if self.finished else "📤 Идёт рассылка..."
+        return (
+            f"{title}\n"
+            f"Отправлено: {self.sent}\n"
+            f"Не отправлено: {self.failed}\n"
+            f"Осталось: {self.remaining}\n"
+            f"Скорость: {self.rate:.1f} сообщ./с"
+        )
+
+
+class BroadcastEngine:
+    """
+    Рассылка с общим лимитом скорости бота (token bucket), паузой между
+    сообщениями в один чат и ограничением одновременных запросов.
+    При RetryAfter вся рассылка ждёт указанное время, а сообщение возвращается
+    в очередь; при сетевых ошибках — тоже, не больше max_attempts попыток.
+    """
+
+    def __init__(self, rate=BROADCAST_RATE, max_concurrency=BROADCAST_MAX_CONCURRENCY,
+                 max_attempts=BROADCAST_MAX_ATTEMPTS, per_chat_interval=BROADCAST_PER_CHAT_INTERVAL,
+                 progress_seconds=BROADCAST_PROGRESS_SECONDS):
+        # Один bucket на все рассылки: лимит Telegram общий для бота
+        self.bucket = TokenBucket(rate)
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.per_chat_interval = per_chat_interval
+        self.progress_seconds = progress_seconds
+
+    async def run(self, recipients, send, total, on_progress=None, on_result=None,
+                  progress=None, weight=1) -> BroadcastProgress:
+        """
+        Отправляет send(chat_id) каждому получателю из recipients (обычный или async-итератор).
+        on_progress(progress) вызывается раз в progress_seconds и по окончании,
+        on_result(chat_id, status) — по итогу для каждого получателя: sent, failed или blocked.
+        weight — сколько сообщений лимита стоит одна отправка (альбом — по числу файлов).
+        """
+        progress = progress or BroadcastProgress(total)
+        pacer = ChatPacer(self.per_chat_interval)
+        queue = asyncio.Queue()
+        # Очередь не больше нескольких сообщений на отправителя: получатели читаются по мере отправки
+        slots = asyncio.Semaphore(self.max_concurrency * 2)
+
+        async def worker():
+            while True:
+                chat_id, attempt = await queue.get()
+                try:
+                    status = await self._deliver(send, chat_id, attempt, pacer, progress, weight)
+                    if status is None:
+                        queue.put_nowait((chat_id, attempt + 1))
+                    else:
+                        slots.release()
+                        if on_result:
+                            on_result(chat_id, status)
+                finally:
+                    queue.task_done()
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(self.progress_seconds)
+                await self._report(on_progress, progress)
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.max_concurrency)]
+        progress_task = asyncio.create_task(reporter()) if on_progress else None
+        try:
+            if hasattr(recipients, "__aiter__"):
+                async for chat_id in recipients:
+                    await slots.acquire()
+                    queue.put_nowait((chat_id, 1))
+            else:
+                for chat_id in recipients:
+                    await slots.acquire()
+                    queue.put_nowait((chat_id, 1))
+            await queue.join()
+        finally:
+            for task in workers + ([progress_task] if progress_task else []):
+                task.cancel()
+            await asyncio.gather(*workers, *([progress_task] if progress_task else []), return_exceptions=True)
+
+        progress.finished = True
+        await self._report(on_progress, progress)
+        logging.info(
+            f"[BroadcastEngine] Рассылка завершена: отправлено {progress.sent}, не отправлено {progress.failed}, "
+            f"повторов {progress.retried}, {progress.rate:.1f} сообщ./с"
+        )
+        return progress
+
+    async def _deliver(self, send, chat_id, attempt, pacer, progress, weight=1):
+        """Одна попытка отправки. Возвращает итог (sent, failed, blocked) или None — вернуть в очередь."""
+        await pacer.wait(chat_id)
+        for _ in range(weight):
+            await self.bucket.acquire()
+        try:
+            pacer.sent(chat_id)
+            await send(chat_id)
+            progress.sent += 1
+            return "sent"
+        except RetryAfter as e:
+            self.bucket.pause(e.retry_after)
+            logging.warning(f"[BroadcastEngine] RetryAfter {e.retry_after} с, чат {chat_id} (попытка {attempt})")
+            error = e
+        except Forbidden as e:
+            # Бот заблокирован пользователем — повтор не поможет
+            logging.warning(f"[BroadcastEngine] Чат {chat_id} заблокировал бота: {e}")
+            progress.failed += 1
+            return "blocked"
+        except BadRequest as e:
+            logging.warning(f"[BroadcastEngine] Не отправлено в чат {chat_id}: {e}")
+            progress.failed += 1
+            return "failed"
+        except NetworkError as e:
+            logging.warning(f"[BroadcastEngine] Сетевая ошибка, чат {chat_id} (попытка {attempt}): {e}")
+            error = e
+        except Exception as e:
+            logging.error(f"[BroadcastEngine] Ошибка отправки в чат {chat_id}: {e}", exc_info=True)
+            progress.failed += 1
+            return "failed"
+
+        if attempt >= self.max_attempts:
+            logging.error(f"[BroadcastEngine] Чат {chat_id}: попытки исчерпаны ({error})")
+            progress.failed += 1
+            return "failed"
+        progress.retried += 1
+        return None
+
+    @staticmethod
+    async def _report(on_progress, progress):
+        if not on_progress:
+            return
+        try:
+            await on_progress(progress)
+        except Exception as e:
+            logging.warning(f"[BroadcastEngine] Не удалось обновить прогресс рассылки: {e}")
+
+
+broadcast_engine = BroadcastEngine()
@@ -0,0 +1,214 @@
+import asyncio
+import html
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import exists, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from telegram import InputMediaDocument, InputMediaPhoto, InputMediaVideo
+from telegram.constants import MessageLimit
+
+from config import AsyncSessionLocal, BROADCAST_STREAM_BATCH
+from broadcastEngine import broadcast_engine, BroadcastProgress
+from models import BroadcastDelivery, BroadcastJob, User
+from utils import main_menu_keyboard
+
+BROADCAST_FOOTER = "📋 Чтобы открыть меню, нажмите или введите команду /start"
+
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+
+def media_item(message):
+    """Файл из сообщения админа: file_id уже загружен в Telegram и переиспользуется для всех получателей."""
+    if message.photo:
+        return {"type": "photo", "file_id": message.photo[-1].file_id}
+    if message.video:
+        return {"type": "video", "file_id": message.video.file_id}
+    if message.document:
+        return {"type": "document", "file_id": message.document.file_id}
+    return None
+
+
+def compose_message(text):
+    return f"{html.escape(text)}\n\n{BROADCAST_FOOTER}" if text else BROADCAST_FOOTER
+
+
+def message_fits(text, media=None) -> bool:
+    """Уместится ли текст рассылки с подвалом в сообщение или подпись к файлам."""
+    limit = MessageLimit.CAPTION_LENGTH if media else MessageLimit.MAX_TEXT_LENGTH
+    return len(text or "") + len(BROADCAST_FOOTER) + 2 <= limit
+
+
+def make_sender(bot, text, media=None):
+    """send(chat_id) для рассылки: текст, один файл или альбом, файлы — по сохранённым file_id."""
+    caption = compose_message(text)
+    if not media:
+        async def send(chat_id):
+            await bot.send_message(chat_id=chat_id, text=caption, parse_mode="HTML")
+    elif len(media) == 1:
+        item = media[0]
+        send_file = {"photo": bot.send_photo, "video": bot.send_video, "document": bot.send_document}[item["type"]]
+
+        async def send(chat_id):
+            await send_file(chat_id, item["file_id"], caption=caption, parse_mode="HTML")
+    else:
+        # Подпись альбома — у первого файла
+        album = [
+            INPUT_MEDIA[item["type"]](item["file_id"], caption=caption if i == 0 else None, parse_mode="HTML")
+            for i, item in enumerate(media)
+        ]
+
+        async def send(chat_id):
+            await bot.send_media_group(chat_id, album)
+    return send
+
+
+def recipients_query(admin_id, job_id=None):
+    """Получатели рассылки: подтверждённые и не заблокировавшие бота; с job_id — кому итог ещё не записан."""
+    query = select(User.telegram_id).where(User.is_approved, ~User.is_blocked, User.telegram_id != admin_id)
+    if job_id is not None:
+        query = query.where(
+            ~exists().where(BroadcastDelivery.job_id == job_id, BroadcastDelivery.user_id == User.telegram_id)
+        )
+    return query.order_by(User.telegram_id)
+
+
+class BroadcastJobRunner:
+    """
+    Рассылки, переживающие перезапуск бота.
+    Рассылка хранится в broadcast_jobs, итог по каждому получателю — в broadcast_deliveries.
+    Получатели читаются из users курсором на стороне сервера, итоги пишутся пачками
+    при каждом обновлении прогресса. После перезапуска незавершённые рассылки продолжаются
+    с тех, кому итог ещё не записан (сообщения последних секунд перед падением могут прийти дважды).
+    Заблокировавшие бота пользователи помечаются users.is_blocked и дальше пропускаются.
+    """
+
+    def __init__(self, engine=broadcast_engine):
+        self.engine = engine
+        self._tasks = {}
+
+    async def create(self, application, admin_id, text, media=None) -> int:
+        async with AsyncSessionLocal() as session:
+            total = await session.scalar(
+                select(func.count()).select_from(recipients_query(admin_id).subquery())
+            )
+            # Одно сообщение с прогрессом, которое обновляется по ходу рассылки
+            progress_message = await application.bot.send_message(
+                chat_id=admin_id, text=BroadcastProgress(total).text()
+            )
+            job = BroadcastJob(
+                admin_id=admin_id, message_text=text or "", media=media, status="running",
+                total=total, sent=0, failed=0,
+                progress_message_id=progress_message.message_id
+            )
+            session.add(job)
+            await session.commit()
+        logging.info(f"[BroadcastJobs] Рассылка #{job.id} создана, получателей: {total}")
+        self._start(application, job.id)
+        return job.id
+
+    async def resume(self, application):
+        """Продолжает рассылки, прерванные перезапуском."""
+        async with AsyncSessionLocal() as session:
+            job_ids = (await session.scalars(
+                select(BroadcastJob.id).where(BroadcastJob.status == "running")
+            )).all()
+        for job_id in job_ids:
+            logging.info(f"[BroadcastJobs] Продолжаем рассылку #{job_id}")
+            self._start(application, job_id)
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _start(self, application, job_id):
+        # Не application.create_task: остановка бота не должна ждать конца рассылки
+        task = asyncio.get_running_loop().create_task(self._run(application, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _run(self, application, job_id):
+        bot = application.bot
+        async with AsyncSessionLocal() as session:
+            job = await session.get(BroadcastJob, job_id)
+        if job is None:
+            return
+        progress = BroadcastProgress(job.total, job.sent, job.failed)
+        send = make_sender(bot, job.message_text, job.media)
+        results = []
+
+        async def show_progress(progress):
+            await self._flush(job_id, results, progress)
+            if job.progress_message_id:
+                await bot.edit_message_text(
+                    progress.text(), chat_id=job.admin_id, message_id=job.progress_message_id
+                )
+
+        try:
+            async with AsyncSessionLocal() as stream_session:
+                recipients = await stream_session.stream_scalars(
+                    recipients_query(job.admin_id, job_id).execution_options(yield_per=BROADCAST_STREAM_BATCH)
+                )
+                await self.engine.run(
+                    recipients, send, job.total, on_progress=show_progress,
+                    on_result=lambda chat_id, status: results.append((chat_id, status)),
+                    progress=progress, weight=len(job.media or []) or 1
+                )
+        except Exception as e:
+            logging.error(f"[BroadcastJobs] Рассылка #{job_id} прервана: {e}", exc_info=True)
+        finally:
+            # Остановка или ошибка: сохраняем итоги, рассылка продолжится при запуске.
+            # Итоги остаются и тогда, когда не удалось записать последнюю пачку.
+            if results or not progress.finished:
+                try:
+                    await self._flush(job_id, results, progress)
+                except Exception as e:
+                    logging.error(f"[BroadcastJobs] Не удалось сохранить итоги рассылки #{job_id}: {e}")
+        if not progress.finished:
+            return
+
+        result_message = (
+            f"✅ Рассылка завершена.\n"
+            f"Отправлено успешно: {progress.sent} пользователям.\n"
+            f"Не отправлено: {progress.failed} пользователям.\n\n"
+            f"📋 Главное меню:\n"
+            f"Если меню не появилось — введите /start"
+        )
+        await bot.send_message(
+            chat_id=job.admin_id,
+            text=result_message,
+            reply_markup=main_menu_keyboard(job.admin_id)
+        )
+
+    @staticmethod
+    async def _flush(job_id, results, progress):
+        """Записывает накопленные итоги доставки, помечает заблокировавших бота и обновляет счётчики."""
+        batch = results[:]
+        del results[:]
+        now = datetime.now(timezone.utc)
+        values = {"sent": progress.sent, "failed": progress.failed}
+        if progress.finished:
+            values.update(status="finished", finished_at=now)
+        try:
+            async with AsyncSessionLocal() as session:
+                if batch:
+                    await session.execute(insert(BroadcastDelivery).on_conflict_do_nothing(), [
+                        {"job_id": job_id, "user_id": chat_id, "status": status, "delivered_at": now}
+                        for chat_id, status in batch
+                    ])
+                    blocked = [chat_id for chat_id, status in batch if status == "blocked"]
+                    if blocked:
+                        await session.execute(
+                            update(User).where(User.telegram_id.in_(blocked)).values(is_blocked=True)
+                        )
+                await session.execute(update(BroadcastJob).where(BroadcastJob.id == job_id).values(**values))
+                await session.commit()
+        except Exception:
+            # Не записали — попробуем со следующей пачкой
+            results[:0] = batch
+            raise
+
+
+broadcast_jobs = BroadcastJobRunner()
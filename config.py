@@ -2,6 +2,7 @@ import os
 import sys
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import sessionmaker
 from apscheduler.schedulers.background import BackgroundScheduler
 import logging
@@ -17,10 +18,82 @@ ADMIN_IDS = set()
 if os.getenv("ADMIN_IDS"):
     ADMIN_IDS = set(map(int, filter(None, os.getenv("ADMIN_IDS").split(","))))
 
+# Получение обновлений: polling (по умолчанию) или webhook на HTTP-порту процесса.
+# Для webhook нужны публичный адрес и секрет, который Telegram присылает в каждом запросе.
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+PORT = int(os.getenv("PORT", "8000"))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+if BOT_MODE not in ("polling", "webhook"):
+    print(f"Ошибка: BOT_MODE должен быть polling или webhook, а не {BOT_MODE}")
+    sys.exit(1)
+if BOT_MODE == "webhook" and not (WEBHOOK_URL and WEBHOOK_SECRET):
+    print("Ошибка: для BOT_MODE=webhook в файле .env нужны WEBHOOK_URL и WEBHOOK_SECRET")
+    sys.exit(1)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Синхронный движок остаётся для фоновых задач APScheduler (они работают в потоках)
 engine = create_engine(DATABASE_URL)
 Session = sessionmaker(bind=engine)
 
+
+def make_async_database_url(url: str) -> str:
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+
+# Хендлеры бота работают с БД асинхронно (asyncpg) и не блокируют event loop
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or make_async_database_url(DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+async_engine = create_async_engine(ASYNC_DATABASE_URL, pool_size=DB_POOL_SIZE, pool_pre_ping=True)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+# Параллельная обработка апдейтов разных пользователей: одновременно выполняются не больше
+# MAX_CONCURRENT_UPDATES (держим в пределах пула соединений БД), принятыми в обработку —
+# вместе с ждущими своей очереди — не больше UPDATES_IN_FLIGHT
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "16"))
+UPDATES_IN_FLIGHT = int(os.getenv("UPDATES_IN_FLIGHT", "1024"))
+# Предупреждение в лог, если один апдейт выполнил больше запросов к БД
+DB_STATEMENTS_WARN_THRESHOLD = int(os.getenv("DB_STATEMENTS_WARN_THRESHOLD", "20"))
+
+# Пул потоков для блокирующих IMAP-запросов (чтение кодов Steam Guard)
+IMAP_MAX_WORKERS = int(os.getenv("IMAP_MAX_WORKERS", "8"))
+# Отдельный пул для ожидания писем через IDLE: поток занят до таймаута ожидания.
+# Если все потоки IDLE заняты, ящик опрашивается по таймеру.
+IMAP_IDLE_WORKERS = int(os.getenv("IMAP_IDLE_WORKERS", "16"))
+IMAP_TIMEOUT = int(os.getenv("IMAP_TIMEOUT", "20"))
+# Постоянные IMAP-сессии: NOOP раз в IMAP_KEEPALIVE_SECONDS, закрытие после IMAP_SESSION_IDLE_TTL простоя
+IMAP_KEEPALIVE_SECONDS = int(os.getenv("IMAP_KEEPALIVE_SECONDS", "60"))
+IMAP_SESSION_IDLE_TTL = int(os.getenv("IMAP_SESSION_IDLE_TTL", "900"))
+# Сессия, открытая заранее при выборе аккаунта, закрывается, если код так и не запросили
+IMAP_PREWARM_TTL = int(os.getenv("IMAP_PREWARM_TTL", "120"))
+# Фоновый сервис ожидания кодов: лимит одновременных опросов ящиков и время ожидания кода
+MAIL_WATCHER_MAX_POLLS = int(os.getenv("MAIL_WATCHER_MAX_POLLS", "4"))
+# Предохранитель IMAP-провайдера: сколько ошибок подряд до паузы и длительность паузы
+MAIL_BREAKER_FAILURE_THRESHOLD = int(os.getenv("MAIL_BREAKER_FAILURE_THRESHOLD", "5"))
+MAIL_BREAKER_RESET_SECONDS = int(os.getenv("MAIL_BREAKER_RESET_SECONDS", "60"))
+CODE_WAIT_TIMEOUT_SECONDS = int(os.getenv("CODE_WAIT_TIMEOUT_SECONDS", "300"))
+# Кэш прав доступа пользователей (подтверждён/админ): размер и время жизни записи
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "300"))
+# Аккаунтов и пользователей на одной странице списков (сообщение Telegram — не больше 4096 символов)
+ACCOUNTS_PAGE_SIZE = int(os.getenv("ACCOUNTS_PAGE_SIZE", "8"))
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "15"))
+# Рассылка: общий лимит Telegram ~30 сообщений в секунду (берём с запасом), пауза между
+# сообщениями в один чат, одновременные запросы, попытки при RetryAfter/сетевых ошибках
+# и частота обновления сообщения с прогрессом
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1"))
+BROADCAST_MAX_CONCURRENCY = int(os.getenv("BROADCAST_MAX_CONCURRENCY", "10"))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+BROADCAST_PROGRESS_SECONDS = float(os.getenv("BROADCAST_PROGRESS_SECONDS", "3"))
+# Сколько получателей за раз читает серверный курсор рассылки
+BROADCAST_STREAM_BATCH = int(os.getenv("BROADCAST_STREAM_BATCH", "500"))
+# Альбом приходит отдельными сообщениями: ждём остальные файлы после последнего полученного
+BROADCAST_ALBUM_WAIT_SECONDS = float(os.getenv("BROADCAST_ALBUM_WAIT_SECONDS", "1.5"))
+
 scheduler = BackgroundScheduler()
 scheduler.start()
 
@@ -36,4 +109,5 @@ logging.getLogger().setLevel(logging.INFO)
 logging.getLogger("telegram").setLevel(logging.WARNING)
 logging.getLogger("asyncio").setLevel(logging.WARNING)
 logging.getLogger("sqlalchemy").setLevel(logging.WARNING)
-logging.getLogger("urllib3").setLevel(logging.WARNING)
\ No newline at end of file
+logging.getLogger("urllib3").setLevel(logging.WARNING)
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
\ No newline at end of file
@@ -0,0 +1,19 @@
+import logging
+import os
+
+from alembic import command
+from alembic.config import Config
+
+from config import DATABASE_URL
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def upgrade_database():
+    """Применяет недостающие миграции перед запуском бота."""
+    alembic_cfg = Config(os.path.join(BASE_DIR, "alembic.ini"))
+    alembic_cfg.set_main_option("script_location", os.path.join(BASE_DIR, "migrations"))
+    alembic_cfg.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
+    alembic_cfg.attributes["configure_logger"] = False
+    command.upgrade(alembic_cfg, "head")
+    logging.info("Схема БД обновлена до последней миграции")
@@ -1,52 +1,195 @@
-import imaplib
+import asyncio
+import base64
+import functools
 import email
-import re
+import email.utils
+import quopri
+from concurrent.futures import ThreadPoolExecutor
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
 from datetime import datetime, timezone
 import logging
 
+from imapclient.exceptions import IMAPClientAbortError
+
+from config import IMAP_MAX_WORKERS, IMAP_IDLE_WORKERS
+from mailSessions import mail_sessions
+from steamCodeExtractor import steam_code_extractor
+
+# Общий ограниченный пул: не больше IMAP_MAX_WORKERS одновременных IMAP-операций
+_imap_executor = ThreadPoolExecutor(max_workers=IMAP_MAX_WORKERS, thread_name_prefix="imap")
+# IDLE держит поток до таймаута, поэтому у него свой пул и не больше IMAP_IDLE_WORKERS ожиданий:
+# ожидание писем не задерживает поиск кодов и открытие сессий
+_idle_executor = ThreadPoolExecutor(max_workers=IMAP_IDLE_WORKERS, thread_name_prefix="imap-idle")
+_idle_slots = asyncio.Semaphore(IMAP_IDLE_WORKERS)
+
+DEFAULT_IMAP_SERVER = "imap.firstmail.ltd"
+STEAM_SENDER = "steampowered.com"
+HEADER_FIELDS = "BODY.PEEK[HEADER.FIELDS (SUBJECT DATE FROM MESSAGE-ID)]"
+HEADER_FETCH_BATCH = 20
+
+# compat32 не разбирает каждый заголовок в объект: при policy.default это была основная часть времени разбора письма
+_header_parser = BytesHeaderParser()
+
+
+def _decode_header(value) -> str:
+    value = str(value or "")
+    if "=?" not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except (LookupError, ValueError):
+        return value
+
+
+def _pick_fetch_item(item, prefix: bytes):
+    """Ответ на BODY.PEEK[...] приходит под ключом BODY[...], точный вид ключа зависит от сервера."""
+    for key, value in item.items():
+        if key.upper().startswith(prefix):
+            return value
+    return None
+
+
+def _find_text_part(structure, subtype: bytes, prefix=""):
+    """Ищет в BODYSTRUCTURE первую text/<subtype> часть: (номер секции, кодировка, charset)."""
+    if structure.is_multipart:
+        for index, part in enumerate(structure[0], start=1):
+            found = _find_text_part(part, subtype, f"{prefix}{index}.")
+            if found:
+                return found
+        return None
+
+    content_type = (structure[0] or b"").lower(), (structure[1] or b"").lower()
+    if content_type != (b"text", subtype):
+        return None
+
+    charset = "utf-8"
+    params = structure[2] or ()
+    for key, value in zip(params[::2], params[1::2]):
+        if key.lower() == b"charset":
+            charset = value.decode(errors="ignore")
+    encoding = (structure[5] or b"7bit").lower()
+    return (prefix.rstrip(".") or "1"), encoding, charset
+
+
+def _decode_part(payload: bytes, encoding: bytes, charset: str) -> str:
+    if encoding == b"base64":
+        payload = base64.b64decode(payload)
+    elif encoding == b"quoted-printable":
+        payload = quopri.decodestring(payload)
+    try:
+        return payload.decode(charset, errors="ignore")
+    except LookupError:
+        return payload.decode(errors="ignore")
+
 
 class FirstMailCodeReader:
-    def __init__(self, login, password, imap_server="imap.firstmail.ltd", imap_port=993):
+    def __init__(self, login, password, imap_server=DEFAULT_IMAP_SERVER, imap_port=993,
+                 sender_filter=STEAM_SENDER):
         self.login = login
         self.password = password
         self.imap_server = imap_server
         self.imap_port = imap_port
+        self.sender_filter = sender_filter
+
+    def _session(self):
+        return mail_sessions.get(self.login, self.password, self.imap_server, self.imap_port)
 
     def fetch_latest_code(self, subject_filter="Steam", since_dt: datetime = None):
-        with imaplib.IMAP4_SSL(self.imap_server, self.imap_port) as mail:
-            mail.login(self.login, self.password)
-            mail.select("inbox")
-
-            if since_dt:
-                since_str = since_dt.strftime("%d-%b-%Y")
-                typ, data = mail.search(None, f'(SINCE {since_str})')
-                logging.info(f"[FirstMailCodeReader] Поиск писем начиная с {since_str}")
-            else:
-                typ, data = mail.search(None, 'ALL')
-                logging.info("[FirstMailCodeReader] Поиск всех писем")
-
-            if typ != 'OK':
-                logging.warning("[FirstMailCodeReader] Ошибка при выполнении поиска писем (IMAP)")
-                return None
+        """Последний код в ящике, для какого бы аккаунта он ни был (ящик одного аккаунта)."""
+        return self.fetch_latest_codes(None, subject_filter, since_dt).get(None)
 
-            uids = data[0].split()
-            if not uids:
-                logging.info("[FirstMailCodeReader] Письма не найдены")
-                return None
+    def fetch_latest_codes(self, account_logins, subject_filter="Steam", since_dt: datetime = None,
+                           default_login=None) -> dict:
+        """
+        Последние коды для аккаунтов из account_logins: {логин в нижнем регистре: код}.
+        Письмо относится к аккаунту, имя которого в нём упомянуто, — в общем ящике
+        арендатор получает код только своего аккаунта. default_login — аккаунт письма,
+        в котором имя не найдено (ящик одного аккаунта). account_logins=None — любой код, ключ None.
+        """
+        session = self._session()
+        logins = None if account_logins is None else {login.lower() for login in account_logins}
+        default_login = default_login.lower() if default_login else None
+        return session.run(
+            lambda client: self._fetch_latest_codes(client, session, logins, subject_filter, since_dt, default_login)
+        )
+
+    def seed_cursor(self, uid_validity, last_uid):
+        self._session().seed_cursor(uid_validity, last_uid)
 
-            for num in reversed(uids):
-                typ, msg_data = mail.fetch(num, '(RFC822)')
-                raw_msg = msg_data[0][1]
-                msg = email.message_from_bytes(raw_msg)
+    def prewarm(self):
+        self._session().warm()
 
-                subject = msg.get("Subject", "")
-                if subject_filter not in subject:
+    def get_cursor(self):
+        return self._session().get_cursor()
+
+    def wait_for_new_mail(self, timeout):
+        return self._session().wait_for_new_mail(timeout)
+
+    def _fetch_latest_codes(self, client, session, logins, subject_filter, since_dt, default_login=None):
+        # Фильтрация по теме, отправителю и дате выполняется на стороне сервера
+        criteria = []
+        last_uid = session.valid_last_uid()
+        if last_uid:
+            # Курсор: смотрим только письма, пришедшие после последнего обработанного
+            criteria += ["UID", f"{last_uid + 1}:*"]
+        if since_dt:
+            criteria += ["SINCE", since_dt.date()]
+        if subject_filter:
+            criteria += ["SUBJECT", subject_filter]
+        if self.sender_filter:
+            criteria += ["FROM", self.sender_filter]
+        uids = client.search(criteria or "ALL")
+        if last_uid:
+            # "n:*" всегда включает последнее письмо, даже если его UID меньше n
+            uids = [uid for uid in uids if uid > last_uid]
+        logging.info(f"[FirstMailCodeReader] Поиск писем по критериям {criteria or 'ALL'}: найдено {len(uids)}")
+
+        codes = {}
+        if uids:
+            processed = set()
+            codes = self._scan_messages(client, session, sorted(uids, reverse=True), logins, subject_filter,
+                                        since_dt, processed, default_login)
+            # Курсор двигаем только за письма, которые действительно разобраны:
+            # письмо с ошибкой или не дошедшее до проверки найдётся при следующем поиске
+            unprocessed = [uid for uid in uids if uid not in processed]
+            session.advance_cursor(min(unprocessed) - 1 if unprocessed else max(uids))
+        else:
+            logging.info("[FirstMailCodeReader] Новых писем не найдено")
+
+        # Коды из уже разобранных писем, которые пришли, когда этот аккаунт ещё никто не ждал
+        for login in (logins or set()) - codes.keys():
+            code = session.take_pending_code(login, since_dt)
+            if code:
+                logging.info(f"[FirstMailCodeReader] Найден отложенный код для аккаунта {login}: {code}")
+                codes[login] = code
+        return codes
+
+    def _scan_messages(self, client, session, uids, logins, subject_filter, since_dt, processed, default_login=None):
+        codes = {}
+        # Сначала только заголовки и структура — пачками, от новых писем к старым
+        for start in range(0, len(uids), HEADER_FETCH_BATCH):
+            batch = uids[start:start + HEADER_FETCH_BATCH]
+            headers = client.fetch(batch, [HEADER_FIELDS, "BODYSTRUCTURE"])
+
+            for uid in batch:
+                item = headers.get(uid)
+                if not item:
+                    processed.add(uid)
+                    continue
+                msg = _header_parser.parsebytes(
+                    _pick_fetch_item(item, b"BODY[HEADER") or b""
+                )
+
+                processed.add(uid)
+                subject = _decode_header(msg.get("Subject"))
+                if subject_filter and subject_filter not in subject:
                     logging.debug(f"[FirstMailCodeReader] Пропущено письмо с темой: {subject}")
                     continue
 
                 date_str = msg.get("Date")
                 try:
-                    msg_date = email.utils.parsedate_to_datetime(date_str)
+                    msg_date = email.utils.parsedate_to_datetime(str(date_str))
                     logging.debug(f"[FirstMailCodeReader] Проверяется дата письма: {msg_date}")
                 except Exception as e:
                     logging.warning(f"[FirstMailCodeReader] Не удалось разобрать дату '{date_str}': {e}")
@@ -58,42 +201,125 @@ class FirstMailCodeReader:
                     logging.debug(f"[FirstMailCodeReader] Письмо старше чем since_dt ({since_dt}), пропущено")
                     continue
 
+                message_id = str(msg.get("Message-ID", "")).strip()
+                if message_id and session.is_seen(message_id):
+                    logging.debug(f"[FirstMailCodeReader] Письмо {message_id} уже разобрано, пропущено")
+                    continue
+
+                # Тело скачиваем только для прошедших фильтр писем и только одну текстовую часть
                 try:
-                    if msg.is_multipart():
-                        for part in msg.walk():
-                            if part.get_content_type() == "text/plain":
-                                body = part.get_payload(decode=True).decode(errors="ignore")
-                                if self.is_steam_verification_email(body):
-                                    code = self.extract_code(body)
-                                    if code:
-                                        logging.info(f"[FirstMailCodeReader] Найден код: {code}")
-                                        return code
-                    else:
-                        body = msg.get_payload(decode=True).decode(errors="ignore")
-                        if self.is_steam_verification_email(body):
-                            code = self.extract_code(body)
-                            if code:
-                                logging.info(f"[FirstMailCodeReader] Найден код: {code}")
-                                return code
+                    text = self._extract_from_message(client, uid, item.get(b"BODYSTRUCTURE"))
+                    code = steam_code_extractor.extract_from_text(text) if text else None
+                    if message_id:
+                        session.mark_seen(message_id)
+                    if code and logins is None:
+                        logging.info(f"[FirstMailCodeReader] Найден код: {code}")
+                        return {None: code}
+                    login = None
+                    if code:
+                        login = steam_code_extractor.find_account(text, logins) or default_login
+                    if code and login not in logins:
+                        # Код аккаунта, который сейчас никто не ждёт: откладываем, курсор идёт дальше
+                        session.remember_code(message_id or uid, code, msg_date_utc, text, login)
+                        logging.info(f"[FirstMailCodeReader] Код из письма {uid} отложен: аккаунт не ожидается")
+                        continue
+                    if code and login not in codes:
+                        # Письма идут от новых к старым: первый найденный код аккаунта — последний
+                        logging.info(f"[FirstMailCodeReader] Найден код для аккаунта {login}: {code}")
+                        codes[login] = code
+                        if codes.keys() >= logins:
+                            return codes
+                except (IMAPClientAbortError, OSError):
+                    # Обрыв соединения: сессия переподключится и повторит поиск с тем же курсором
+                    raise
                 except Exception as e:
-                    logging.error(f"[FirstMailCodeReader] Ошибка при обработке тела письма: {e}")
+                    processed.discard(uid)
+                    logging.error(f"[FirstMailCodeReader] Ошибка при обработке тела письма {uid}: {e}")
+
+        return codes
 
+    def _extract_from_message(self, client, uid, structure):
+        """Текст письма для поиска кода и имени аккаунта."""
+        # text/plain предпочтительнее; письма только с HTML разбираем по HTML-части
+        for subtype in (b"plain", b"html"):
+            part = _find_text_part(structure, subtype) if structure else None
+            if part is None:
+                continue
+            section, encoding, charset = part
+            data = client.fetch([uid], [f"BODY.PEEK[{section}]"]).get(uid)
+            if not data:
+                return None
+            payload = _decode_part(_pick_fetch_item(data, b"BODY[") or b"", encoding, charset)
+            return steam_code_extractor.part_text(payload, subtype.decode())
+        logging.debug(f"[FirstMailCodeReader] В письме {uid} нет текстовой части")
         return None
 
     def is_steam_verification_email(self, body: str) -> bool:
         """
         Проверяет, является ли письмо уведомлением Steam о входе с нового устройства.
         """
-        expected_phrase = "It looks like you are trying to log in from a new device."
-        if expected_phrase.lower() in body.lower():
-            logging.debug("[FirstMailCodeReader] Письмо соответствует шаблону проверки входа Steam.")
-            return True
-        logging.debug("[FirstMailCodeReader] Письмо не содержит ключевой фразы входа Steam.")
-        return False
+        return steam_code_extractor.is_verification_text(body)
 
     def extract_code(self, text: str) -> str | None:
-        match = re.search(r"Steam Guard code.*?([A-Z0-9]{5})", text, re.IGNORECASE)
-        if match:
-            return match.group(1)
-        fallback = re.search(r'\b[A-Z0-9]{5}\b', text)
-        return fallback.group(0) if fallback else None
+        return steam_code_extractor.extract_from_text(text)
+
+
+class AsyncFirstMailCodeReader:
+    """
+    Асинхронная обёртка над FirstMailCodeReader.
+    Блокирующие IMAP-запросы выполняются в ограниченном пуле потоков,
+    поэтому ожидание кода не останавливает обработку остальных пользователей.
+    """
+
+    def __init__(self, login, password, imap_server=DEFAULT_IMAP_SERVER, imap_port=993,
+                 sender_filter=STEAM_SENDER, cursor=None):
+        self._reader = FirstMailCodeReader(login, password, imap_server, imap_port, sender_filter)
+        if cursor:
+            self._reader.seed_cursor(*cursor)
+
+    @property
+    def imap_server(self):
+        return self._reader.imap_server
+
+    @property
+    def cursor(self):
+        """Текущий курсор ящика: (UIDVALIDITY, последний обработанный UID)."""
+        return self._reader.get_cursor()
+
+    async def fetch_latest_code(self, subject_filter="Steam", since_dt: datetime = None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _imap_executor,
+            functools.partial(self._reader.fetch_latest_code, subject_filter, since_dt)
+        )
+
+    async def fetch_latest_codes(self, account_logins, subject_filter="Steam", since_dt: datetime = None,
+                                 default_login=None) -> dict:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _imap_executor,
+            functools.partial(self._reader.fetch_latest_codes, account_logins, subject_filter, since_dt, default_login)
+        )
+
+    async def prewarm(self):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(_imap_executor, self._reader.prewarm)
+
+    async def wait_for_new_mail(self, timeout):
+        """
+        Ждёт новое письмо через IMAP IDLE. Если сервер не поддерживает IDLE
+        или все потоки IDLE заняты, просто спит timeout секунд, как обычный опрос.
+        """
+        if _idle_slots.locked():
+            await asyncio.sleep(timeout)
+            return False
+        loop = asyncio.get_running_loop()
+        async with _idle_slots:
+            has_new_mail = await loop.run_in_executor(
+                _idle_executor,
+                functools.partial(self._reader.wait_for_new_mail, timeout)
+            )
+        if has_new_mail is None:
+            await asyncio.sleep(timeout)
+            return False
+        return has_new_mail
@@ -0,0 +1,113 @@
+import logging
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from config import Session, ACCOUNTS_PAGE_SIZE
+from models import Account, Rental
+from pagination import Page, make_page, slice_page, sort_key
+
+AccountRecord = namedtuple("AccountRecord", ["id", "mmr", "behavior", "calibration", "status", "renter_id"])
+
+
+class InventoryIndex:
+    """
+    Индекс аккаунтов в памяти процесса для пользовательских списков.
+    Компактные записи упорядочены по (MMR, ID) — все вместе и отдельно для каждого статуса.
+    Загружается при запуске и обновляется сразу после каждой фиксации в БД:
+    аренда, возврат, автоматический возврат, добавление, изменение, удаление.
+    Рассчитан на один процесс бота; обращаются к нему и хендлеры, и поток APScheduler.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+        self._ordered = []
+        self._by_status = {}
+        self._by_renter = {}
+
+    def load(self):
+        with Session() as session:
+            rows = session.execute(
+                select(Account.id, Account.mmr, Account.behavior, Account.calibration, Account.status, Rental.user_id)
+                .outerjoin(Rental, (Rental.account_id == Account.id) & Rental.ended_at.is_(None))
+            ).all()
+        with self._lock:
+            self._records.clear()
+            self._ordered.clear()
+            self._by_status.clear()
+            self._by_renter.clear()
+            for row in rows:
+                self._insert(AccountRecord(*row))
+        logging.info(f"[Inventory] Загружено аккаунтов: {len(rows)}")
+
+    def _insert(self, record):
+        self._records[record.id] = record
+        key = sort_key(record.mmr, record.id)
+        insort(self._ordered, key)
+        insort(self._by_status.setdefault(record.status, []), key)
+        if record.renter_id is not None:
+            self._by_renter[record.renter_id] = record.id
+
+    def _remove(self, account_id):
+        record = self._records.pop(account_id, None)
+        if record is None:
+            return None
+        key = sort_key(record.mmr, record.id)
+        for keys in (self._ordered, self._by_status.get(record.status, [])):
+            index = bisect_left(keys, key)
+            if index < len(keys) and keys[index] == key:
+                del keys[index]
+        if record.renter_id is not None and self._by_renter.get(record.renter_id) == record.id:
+            del self._by_renter[record.renter_id]
+        return record
+
+    def upsert(self, account: Account):
+        """Добавленный или изменённый админом аккаунт."""
+        with self._lock:
+            previous = self._remove(account.id)
+            self._insert(AccountRecord(
+                account.id, account.mmr, account.behavior, account.calibration, account.status,
+                previous.renter_id if previous else None
+            ))
+
+    def mark_rented(self, account_id, user_id):
+        with self._lock:
+            record = self._remove(account_id)
+            if record:
+                self._insert(record._replace(status="rented", renter_id=user_id))
+
+    def mark_free(self, account_id, mmr=None, behavior=None):
+        with self._lock:
+            record = self._remove(account_id)
+            if record:
+                self._insert(record._replace(
+                    status="free", renter_id=None,
+                    mmr=record.mmr if mmr is None else mmr,
+                    behavior=record.behavior if behavior is None else behavior,
+                ))
+
+    def remove(self, account_id):
+        with self._lock:
+            self._remove(account_id)
+
+    def page(self, status=None, cursor=None, backward=False, page_size=ACCOUNTS_PAGE_SIZE) -> Page:
+        """Страница записей с тем же курсором, что и keyset-запрос fetch_accounts_page."""
+        with self._lock:
+            keys = self._ordered if status is None else self._by_status.get(status, [])
+            start, end, has_more = slice_page(keys, cursor, backward, page_size)
+            if start == end and cursor is not None:
+                # Записи страницы успели сменить статус — показываем начало списка
+                cursor, backward = None, False
+                start, end, has_more = slice_page(keys, page_size=page_size)
+            items = [self._records[account_id] for _, account_id in keys[start:end]]
+        return make_page(items, cursor, backward, has_more)
+
+    def rented_by(self, user_id):
+        with self._lock:
+            return self._by_renter.get(user_id)
+
+
+inventory = InventoryIndex()
@@ -0,0 +1,124 @@
+import logging
+import random
+import time
+
+from config import MAIL_BREAKER_FAILURE_THRESHOLD, MAIL_BREAKER_RESET_SECONDS
+
+
+class PollSchedule:
+    """
+    Расписание опроса ящика: первые попытки часто (код обычно приходит
+    в первые секунды), дальше экспоненциальная задержка со случайным разбросом.
+    """
+
+    def __init__(self, fast_delays=(2, 3, 5), base_delay=5.0, factor=1.6, max_delay=30.0, jitter=0.25):
+        self.fast_delays = fast_delays
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def next_delay(self, attempt: int) -> float:
+        if attempt < len(self.fast_delays):
+            return self.fast_delays[attempt]
+        delay = min(self.base_delay * self.factor ** (attempt - len(self.fast_delays) + 1), self.max_delay)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для IMAP-провайдера.
+    После MAIL_BREAKER_FAILURE_THRESHOLD ошибок подряд запросы не выполняются
+    MAIL_BREAKER_RESET_SECONDS секунд, затем пропускается одна пробная попытка;
+    остальные запросы отклоняются, пока проба не завершится успехом или ошибкой.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=MAIL_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=MAIL_BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.probe_started = None
+        self.consecutive_failures = 0
+        # Счётчики для админов
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.last_latency = None
+        self.last_error = None
+
+    def allow_request(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            # Проба, не вернувшая результат за reset_timeout (задачу отменили), уступает место новой
+            if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+                self.rejected += 1
+                return False
+            self.probe_started = now
+            logging.info(f"[CircuitBreaker] {self.name}: пробная попытка после паузы")
+        return True
+
+    def is_probing(self) -> bool:
+        return self.state == self.HALF_OPEN and self.probe_started is not None
+
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self, latency: float):
+        self.successes += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        self.consecutive_failures = 0
+        self.probe_started = None
+        if self.state != self.CLOSED:
+            logging.info(f"[CircuitBreaker] {self.name}: провайдер снова доступен")
+        self.state = self.CLOSED
+
+    def record_failure(self, latency: float, error: Exception):
+        self.failures += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        self.last_error = f"{type(error).__name__}: {error}"
+        self.consecutive_failures += 1
+        self.probe_started = None
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning(f"[CircuitBreaker] {self.name}: провайдер недоступен, запросы приостановлены")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    @property
+    def average_latency(self):
+        calls = self.successes + self.failures
+        return self.total_latency / calls if calls else None
+
+
+class ProviderHealth:
+    """Предохранители и счётчики по каждому IMAP-серверу."""
+
+    def __init__(self):
+        self._breakers = {}
+
+    def get(self, imap_server) -> CircuitBreaker:
+        breaker = self._breakers.get(imap_server)
+        if breaker is None:
+            breaker = self._breakers[imap_server] = CircuitBreaker(imap_server)
+        return breaker
+
+    def all(self):
+        return list(self._breakers.values())
+
+
+provider_health = ProviderHealth()
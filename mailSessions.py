@@ -0,0 +1,282 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientAbortError, IMAPClientError
+
+from config import IMAP_TIMEOUT, IMAP_KEEPALIVE_SECONDS, IMAP_SESSION_IDLE_TTL, IMAP_PREWARM_TTL
+from steamCodeExtractor import steam_code_extractor
+
+SEEN_MESSAGE_IDS_LIMIT = 500
+PENDING_CODES_LIMIT = 50
+
+
+class MailboxSession:
+    """
+    Одно постоянное авторизованное IMAP-подключение к ящику.
+    Все операции выполняются под блокировкой: IMAP-соединение не допускает
+    параллельных команд.
+    """
+
+    def __init__(self, login, password, imap_server, imap_port):
+        self.login = login
+        self.password = password
+        self.imap_server = imap_server
+        self.imap_port = imap_port
+        self.lock = threading.Lock()
+        self.client = None
+        self.last_used = time.monotonic()
+        self.last_activity = 0.0
+        # Сессия открыта заранее и ещё ни разу не использовалась для чтения кода
+        self.prewarmed = False
+        # Курсор ящика: UIDVALIDITY папки и последний обработанный UID
+        self.cursor_lock = threading.Lock()
+        self.uid_validity = None
+        self.cursor_validity = None
+        self.last_uid = None
+        self.seen_message_ids = OrderedDict()
+        # Коды, которые пока никто не ждёт: письмо -> (код, дата, текст, логин или None).
+        # Курсор уходит дальше, а код достаётся арендатору, который начнёт ждать позже
+        self.pending_codes = OrderedDict()
+
+    def _connect(self):
+        logging.info(f"[MailboxSession] Подключение к {self.imap_server} для {self.login}")
+        client = IMAPClient(self.imap_server, port=self.imap_port, ssl=True, timeout=IMAP_TIMEOUT)
+        try:
+            client.login(self.login, self.password)
+            folder_info = client.select_folder("INBOX", readonly=True)
+        except Exception:
+            self._safe_logout(client)
+            raise
+        self.client = client
+        self._apply_uid_validity(folder_info.get(b"UIDVALIDITY"))
+        self.last_activity = time.monotonic()
+
+    @staticmethod
+    def _safe_logout(client):
+        try:
+            client.logout()
+        except Exception:
+            try:
+                client.shutdown()
+            except Exception:
+                pass
+
+    def _apply_uid_validity(self, uid_validity):
+        with self.cursor_lock:
+            self.uid_validity = uid_validity
+            if self.cursor_validity is not None and self.cursor_validity != uid_validity:
+                logging.info(f"[MailboxSession] UIDVALIDITY ящика {self.login} изменился, курсор сброшен")
+                self.last_uid = None
+                self.seen_message_ids.clear()
+            self.cursor_validity = uid_validity
+
+    def seed_cursor(self, uid_validity, last_uid):
+        """Подставляет сохранённый в БД курсор, если он новее текущего."""
+        if uid_validity is None or last_uid is None:
+            return
+        with self.cursor_lock:
+            if self.uid_validity is not None and self.uid_validity != uid_validity:
+                return
+            if self.cursor_validity == uid_validity and (self.last_uid or 0) >= last_uid:
+                return
+            self.cursor_validity = uid_validity
+            self.last_uid = last_uid
+
+    def get_cursor(self):
+        with self.cursor_lock:
+            return self.cursor_validity, self.last_uid
+
+    def valid_last_uid(self):
+        with self.cursor_lock:
+            if self.uid_validity is None or self.cursor_validity != self.uid_validity:
+                return None
+            return self.last_uid
+
+    def advance_cursor(self, uid):
+        with self.cursor_lock:
+            if self.last_uid is None or uid > self.last_uid:
+                self.last_uid = uid
+
+    def is_seen(self, message_id):
+        with self.cursor_lock:
+            return message_id in self.seen_message_ids
+
+    def mark_seen(self, message_id):
+        with self.cursor_lock:
+            self.seen_message_ids[message_id] = True
+            self.seen_message_ids.move_to_end(message_id)
+            while len(self.seen_message_ids) > SEEN_MESSAGE_IDS_LIMIT:
+                self.seen_message_ids.popitem(last=False)
+
+    def remember_code(self, key, code, msg_date, text, login=None):
+        with self.cursor_lock:
+            self.pending_codes[key] = (code, msg_date, text, login)
+            self.pending_codes.move_to_end(key)
+            while len(self.pending_codes) > PENDING_CODES_LIMIT:
+                self.pending_codes.popitem(last=False)
+
+    def take_pending_code(self, login, since_dt=None):
+        """Самый новый отложенный код из письма, где упомянут login и которое пришло не раньше since_dt."""
+        with self.cursor_lock:
+            found = None
+            for key, (code, msg_date, text, code_login) in self.pending_codes.items():
+                if since_dt and msg_date < since_dt:
+                    continue
+                if found is not None and msg_date < found[2]:
+                    continue
+                if code_login == login or steam_code_extractor.find_account(text, [login]):
+                    found = key, code, msg_date
+            if found is None:
+                return None
+            del self.pending_codes[found[0]]
+            return found[1]
+
+    def _drop(self):
+        if self.client is not None:
+            self._safe_logout(self.client)
+            self.client = None
+
+    def _ensure(self):
+        if self.client is None:
+            self._connect()
+            return
+        # NOOP одновременно проверяет соединение и заставляет сервер
+        # сообщить о новых письмах перед поиском
+        self.client.noop()
+        self.last_activity = time.monotonic()
+
+    def run(self, operation):
+        """
+        Выполняет operation(client) на живом соединении.
+        При обрыве соединения переподключается один раз.
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            self.prewarmed = False
+            for attempt in range(2):
+                try:
+                    self._ensure()
+                    result = operation(self.client)
+                    self.last_activity = time.monotonic()
+                    return result
+                except (IMAPClientAbortError, OSError) as e:
+                    logging.warning(f"[MailboxSession] Соединение {self.login} прервано: {e}")
+                    self._drop()
+                    if attempt:
+                        raise
+                except IMAPClientError:
+                    self._drop()
+                    raise
+
+    def wait_for_new_mail(self, timeout):
+        """
+        Ждёт новое письмо через IMAP IDLE не дольше timeout секунд.
+        Возвращает True, если сервер сообщил о новом письме, False по таймауту
+        и None, если сервер не поддерживает IDLE.
+        """
+        with self.lock:
+            self.last_used = time.monotonic()
+            self.prewarmed = False
+            try:
+                self._ensure()
+                if not self.client.has_capability("IDLE"):
+                    return None
+                self.client.idle()
+                try:
+                    responses = self.client.idle_check(timeout=timeout)
+                finally:
+                    self.client.idle_done()
+                self.last_activity = time.monotonic()
+            except (IMAPClientAbortError, OSError) as e:
+                logging.warning(f"[MailboxSession] IDLE для {self.login} прерван: {e}")
+                self._drop()
+                return False
+
+        has_new_mail = any(
+            len(resp) > 1 and resp[1] in (b"EXISTS", b"RECENT") for resp in responses
+        )
+        if has_new_mail:
+            logging.info(f"[MailboxSession] Новое письмо в ящике {self.login}")
+        return has_new_mail
+
+    def warm(self):
+        """Открывает соединение заранее: TLS, логин и SELECT (заодно узнаём UIDVALIDITY)."""
+        with self.lock:
+            if self.client is not None:
+                return
+            self._connect()
+            self.prewarmed = True
+            self.last_used = time.monotonic()
+
+    def keepalive(self):
+        """Отправляет NOOP, если соединение давно простаивает. Не ждёт занятую сессию."""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.client is None:
+                return
+            if time.monotonic() - self.last_activity < IMAP_KEEPALIVE_SECONDS:
+                return
+            try:
+                self.client.noop()
+                self.last_activity = time.monotonic()
+            except Exception as e:
+                logging.warning(f"[MailboxSession] Keep-alive для {self.login} не удался: {e}")
+                self._drop()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        with self.lock:
+            self._drop()
+
+
+class MailboxSessionManager:
+    """Хранит по одной IMAP-сессии на каждый логин почты."""
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, login, password, imap_server, imap_port) -> MailboxSession:
+        key = (imap_server, login)
+        stale = None
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or session.password != password or session.imap_port != imap_port:
+                stale = session
+                session = MailboxSession(login, password, imap_server, imap_port)
+                self._sessions[key] = session
+        if stale is not None:
+            stale.close()
+        return session
+
+    def keepalive(self):
+        """Периодическая задача: NOOP для живых сессий и закрытие давно неиспользуемых."""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.items())
+        for key, session in sessions:
+            # Заранее открытая, но так и не пригодившаяся сессия живёт недолго
+            ttl = IMAP_PREWARM_TTL if session.prewarmed else IMAP_SESSION_IDLE_TTL
+            if now - session.last_used > ttl:
+                with self._lock:
+                    if self._sessions.get(key) is session:
+                        del self._sessions[key]
+                logging.info(f"[MailboxSessionManager] Закрываю неиспользуемую сессию {session.login}")
+                session.close()
+            else:
+                session.keepalive()
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+mail_sessions = MailboxSessionManager()
@@ -0,0 +1,339 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from imapclient.exceptions import LoginError
+from sqlalchemy import func, select
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import AsyncSessionLocal, MAIL_WATCHER_MAX_POLLS, CODE_WAIT_TIMEOUT_SECONDS
+from getCodeFromMail import AsyncFirstMailCodeReader, DEFAULT_IMAP_SERVER
+from mailHealth import PollSchedule, provider_health
+from models import Account, AccountLog, Email, MailCursor, Rental
+from utils import main_menu_keyboard
+
+
+async def load_mail_cursor(email_id):
+    if not email_id:
+        return None
+    async with AsyncSessionLocal() as session:
+        cursor = await session.get(MailCursor, email_id)
+        if cursor and cursor.uid_validity is not None and cursor.last_uid is not None:
+            return cursor.uid_validity, cursor.last_uid
+    return None
+
+
+async def save_mail_cursor(email_id, uid_validity, last_uid):
+    if not email_id or uid_validity is None or last_uid is None:
+        return
+    async with AsyncSessionLocal() as session:
+        cursor = await session.get(MailCursor, email_id)
+        if cursor is None:
+            cursor = MailCursor(email_id=email_id)
+            session.add(cursor)
+        cursor.uid_validity = uid_validity
+        cursor.last_uid = last_uid
+        cursor.updated_at = datetime.now(timezone.utc)
+        await session.commit()
+
+
+async def load_mailbox_logins(email_login):
+    """Логины всех аккаунтов, которым принадлежит ящик (общий ящик — несколько)."""
+    async with AsyncSessionLocal() as session:
+        return (await session.scalars(
+            select(Account.login).join(Email, Email.accountfk == Account.id)
+            .where(func.lower(Email.login) == email_login.lower())
+        )).all()
+
+
+async def is_rental_active(rental_id) -> bool:
+    async with AsyncSessionLocal() as session:
+        rental = await session.get(Rental, rental_id)
+        return rental is not None and rental.ended_at is None
+
+
+async def add_account_log(user_id, account_id, action, action_date):
+    async with AsyncSessionLocal() as session:
+        session.add(AccountLog(
+            user_id=user_id,
+            account_id=account_id,
+            action=action,
+            action_date=action_date
+        ))
+        await session.commit()
+
+
+class CodeWaiter:
+    """Запрос арендатора: «жду код для аккаунта X, начиная с момента T»."""
+
+    def __init__(self, user_id, chat_id, message_id, account_id, rental_id, account_login, account_password,
+                 rented_at, since_dt, timeout=CODE_WAIT_TIMEOUT_SECONDS):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.account_id = account_id
+        self.rental_id = rental_id
+        self.account_login = account_login
+        self.account_password = account_password
+        self.rented_at = rented_at
+        self.since_dt = since_dt
+        self.deadline = datetime.now(timezone.utc) + timedelta(seconds=timeout)
+
+
+class MailboxWatcher:
+    """
+    Фоновый сервис доставки кодов Steam Guard.
+    Хендлеры только регистрируют ожидание и сразу завершаются; на каждый
+    ящик работает одна задача опроса, общее число одновременных опросов ограничено.
+    """
+
+    def __init__(self, max_concurrent_polls=MAIL_WATCHER_MAX_POLLS, schedule=None):
+        self.schedule = schedule or PollSchedule()
+        self._semaphore = asyncio.Semaphore(max_concurrent_polls)
+        self._waiters = {}
+        self._mailboxes = {}
+        self._tasks = {}
+        self._attempts = {}
+        self._loop = None
+        self.application = None
+
+    def start(self, application):
+        self.application = application
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    def provider_available(imap_server=DEFAULT_IMAP_SERVER) -> bool:
+        return not provider_health.get(imap_server).is_open()
+
+    def register(self, waiter: CodeWaiter, email_id, email_login, email_password):
+        # У пользователя одно ожидание, у аккаунта — один ожидающий (текущий арендатор)
+        self.cancel(waiter.user_id)
+        self.cancel_account(waiter.account_id)
+        self._loop = asyncio.get_running_loop()
+        key = email_login.lower()
+        self._mailboxes[key] = (email_id, email_login, email_password)
+        self._waiters.setdefault(key, {})[waiter.account_id] = waiter
+        # Новый ожидающий — снова частые первые опросы
+        self._attempts[key] = 0
+        logging.info(f"[MailboxWatcher] Пользователь {waiter.user_id} ждёт код для аккаунта {waiter.account_id} ({email_login})")
+
+        if key not in self._tasks:
+            # Не application.create_task: Application.stop() ждёт такие задачи, а ожидание кода длится минутами
+            self._tasks[key] = self._loop.create_task(self._watch(key))
+
+    def prewarm(self, email_id, email_login, email_password):
+        """
+        Открывает IMAP-сессию и подгружает курсор ящика, пока пользователь
+        выбирает длительность аренды, чтобы к запросу кода соединение было готово.
+        """
+        if not self.provider_available() or email_login.lower() in self._tasks:
+            return
+        self.application.create_task(self._prewarm(email_id, email_login, email_password))
+
+    async def _prewarm(self, email_id, email_login, email_password):
+        try:
+            cursor = await load_mail_cursor(email_id)
+            reader = AsyncFirstMailCodeReader(email_login, email_password, cursor=cursor)
+            await reader.prewarm()
+            logging.info(f"[MailboxWatcher] Сессия {email_login} открыта заранее")
+        except Exception as e:
+            logging.warning(f"[MailboxWatcher] Не удалось заранее открыть почту {email_login}: {e}")
+
+    def cancel(self, user_id) -> bool:
+        for waiters in self._waiters.values():
+            for waiter in list(waiters.values()):
+                if waiter.user_id == user_id:
+                    waiters.pop(waiter.account_id, None)
+                    logging.info(f"[MailboxWatcher] Ожидание кода пользователем {user_id} отменено")
+                    return True
+        return False
+
+    def cancel_account(self, account_id) -> bool:
+        for waiters in self._waiters.values():
+            waiter = waiters.pop(account_id, None)
+            if waiter:
+                logging.info(f"[MailboxWatcher] Ожидание кода для аккаунта {account_id} "
+                             f"(пользователь {waiter.user_id}) отменено")
+                return True
+        return False
+
+    def cancel_accounts_threadsafe(self, account_ids):
+        """Отмена ожиданий из потока планировщика (автоматический возврат аренды)."""
+        if self._loop is None or self._loop.is_closed():
+            return
+        for account_id in account_ids:
+            self._loop.call_soon_threadsafe(self.cancel_account, account_id)
+
+    def pending_count(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    async def _watch(self, key):
+        email_id, email_login, email_password = self._mailboxes[key]
+        try:
+            saved_cursor = await load_mail_cursor(email_id)
+        except Exception as e:
+            logging.warning(f"[MailboxWatcher] Не удалось загрузить курсор ящика {email_login}: {e}")
+            saved_cursor = None
+        try:
+            mailbox_logins = await load_mailbox_logins(email_login)
+        except Exception as e:
+            logging.warning(f"[MailboxWatcher] Не удалось загрузить аккаунты ящика {email_login}: {e}")
+            mailbox_logins = []
+        # Ящик одного аккаунта: письмо без имени аккаунта тоже относится к нему
+        default_login = mailbox_logins[0] if len(mailbox_logins) == 1 else None
+        reader = AsyncFirstMailCodeReader(email_login, email_password, cursor=saved_cursor)
+        breaker = provider_health.get(reader.imap_server)
+        try:
+            while self._waiters.get(key):
+                waiters = self._waiters[key]
+                since_dt = min(w.since_dt for w in waiters.values())
+
+                if not breaker.allow_request():
+                    if breaker.is_probing():
+                        # Провайдер проверяет пробный запрос другого ящика — ждём его результата,
+                        # но истёкшие ожидания завершаем вовремя
+                        await self._expire_waiters(waiters)
+                        await asyncio.sleep(self.schedule.next_delay(0))
+                        continue
+                    # Провайдер недоступен: не ждём таймаута, сразу сообщаем арендаторам
+                    for waiter in list(waiters.values()):
+                        waiters.pop(waiter.account_id, None)
+                        await self._deliver_failure(waiter, "⚠️ Почтовый сервис сейчас недоступен.")
+                    continue
+
+                codes = {}
+                async with self._semaphore:
+                    started = time.monotonic()
+                    try:
+                        codes = await reader.fetch_latest_codes(
+                            {w.account_login for w in waiters.values()}, since_dt=since_dt,
+                            default_login=default_login
+                        )
+                        breaker.record_success(time.monotonic() - started)
+                    except LoginError as e:
+                        # Сервер ответил — провайдер доступен, дело в данных ящика
+                        breaker.record_success(time.monotonic() - started)
+                        logging.error(f"[MailboxWatcher] Не удалось войти в почту {email_login}: {e}")
+                        for waiter in list(waiters.values()):
+                            waiters.pop(waiter.account_id, None)
+                            await self._deliver_failure(waiter, "⚠️ Не удалось войти в почту аккаунта.")
+                        continue
+                    except Exception as e:
+                        breaker.record_failure(time.monotonic() - started, e)
+                        logging.error(f"[MailboxWatcher] Ошибка чтения почты {email_login}: {e}")
+
+                if reader.cursor != saved_cursor:
+                    try:
+                        await save_mail_cursor(email_id, *reader.cursor)
+                        saved_cursor = reader.cursor
+                    except Exception as e:
+                        # Курсор запишем при следующем опросе
+                        logging.warning(f"[MailboxWatcher] Не удалось сохранить курсор ящика {email_login}: {e}")
+
+                # Ящик может быть общим: код получает только арендатор аккаунта из письма
+                for waiter in [w for w in waiters.values() if w.account_login.lower() in codes]:
+                    waiters.pop(waiter.account_id, None)
+                    # Аренда могла закончиться, пока шёл опрос: код получает только текущий арендатор
+                    if await self._rental_active(waiter):
+                        await self._deliver_code(waiter, codes[waiter.account_login.lower()])
+                    else:
+                        await self._deliver_failure(waiter, "⚠️ Аренда аккаунта уже завершена.")
+
+                await self._expire_waiters(waiters)
+
+                if waiters:
+                    attempt = self._attempts.get(key, 0)
+                    self._attempts[key] = attempt + 1
+                    delay = self.schedule.next_delay(attempt)
+                    try:
+                        # Через IMAP IDLE возвращается сразу после прихода нового письма
+                        await reader.wait_for_new_mail(delay)
+                    except Exception as e:
+                        logging.warning(f"[MailboxWatcher] Ожидание новых писем {email_login} прервано: {e}")
+                        await asyncio.sleep(delay)
+        except Exception as e:
+            logging.error(f"[MailboxWatcher] Ожидание кода в ящике {email_login} прервано: {e}", exc_info=True)
+        finally:
+            self._tasks.pop(key, None)
+            self._attempts.pop(key, None)
+            self._mailboxes.pop(key, None)
+            # Ошибка или остановка бота: оставшимся арендаторам сообщаем, что кода не будет
+            for waiter in list(self._waiters.pop(key, {}).values()):
+                await self._deliver_failure(waiter, "⚠️ Не удалось получить код Steam.")
+
+    async def _expire_waiters(self, waiters):
+        now = datetime.now(timezone.utc)
+        for waiter in [w for w in waiters.values() if w.deadline <= now]:
+            waiters.pop(waiter.account_id, None)
+            await self._deliver_failure(
+                waiter, f"⚠️ Не удалось получить код Steam в течение {CODE_WAIT_TIMEOUT_SECONDS // 60} минут."
+            )
+
+    async def _edit(self, waiter, text, **kwargs):
+        try:
+            await self.application.bot.edit_message_text(
+                text, chat_id=waiter.chat_id, message_id=waiter.message_id, **kwargs
+            )
+        except Exception as e:
+            logging.warning(f"[MailboxWatcher] Не удалось обновить сообщение {waiter.user_id}: {e}")
+            await self.application.bot.send_message(waiter.chat_id, text, **kwargs)
+
+    async def _deliver_code(self, waiter, code):
+        logging.info(f"[MailboxWatcher] Код для аккаунта {waiter.account_id} доставлен пользователю {waiter.user_id}")
+        try:
+            await self._edit(
+                waiter,
+                f"✅ Аккаунт успешно арендован!\n"
+                f"👤 Логин: `{waiter.account_login}`\n"
+                f"🔐 Пароль: `{waiter.account_password}`\n\n"
+                f"📩 Код Steam: `{code}`\n"
+                f"🆔 Аккаунт ID: {waiter.account_id}",
+                parse_mode="Markdown",
+                reply_markup=main_menu_keyboard(waiter.user_id)
+            )
+        except Exception as e:
+            logging.error(f"[MailboxWatcher] Ошибка отправки кода пользователю {waiter.user_id}: {e}")
+        await self._log_rental(waiter, 'Арендован (с 2FA)')
+
+    async def _deliver_failure(self, waiter, reason):
+        logging.info(f"[MailboxWatcher] Код для аккаунта {waiter.account_id} не получен: {reason}")
+        try:
+            await self._edit(
+                waiter,
+                f"{reason}\nПопробуйте позже.",
+                reply_markup=main_menu_keyboard(waiter.user_id)
+            )
+        except Exception as e:
+            logging.error(f"[MailboxWatcher] Ошибка уведомления пользователя {waiter.user_id}: {e}")
+        await self._log_rental(waiter, 'Арендован (Ошибка получения кода с почты)')
+
+    @staticmethod
+    async def _rental_active(waiter) -> bool:
+        try:
+            return await is_rental_active(waiter.rental_id)
+        except Exception as e:
+            # Не удалось проверить — код не отдаём
+            logging.error(f"[MailboxWatcher] Не удалось проверить аренду аккаунта {waiter.account_id}: {e}")
+            return False
+
+    @staticmethod
+    async def _log_rental(waiter, action):
+        try:
+            await add_account_log(waiter.user_id, waiter.account_id, action, waiter.rented_at)
+        except Exception as e:
+            logging.error(f"[MailboxWatcher] Не удалось записать лог аккаунта {waiter.account_id}: {e}")
+
+
+def code_wait_cancel_markup():
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("🚫 Отменить аренду", callback_data="cancel_code_wait")]
+    ])
+
+
+mail_watcher = MailboxWatcher()
@@ -1,7 +1,8 @@
 
 import asyncio
 
-from sqlalchemy import except_, desc
+from sqlalchemy import except_, select
+from sqlalchemy.orm import joinedload, selectinload
 from telegram.constants import ParseMode
 
 from States import (
@@ -12,13 +13,26 @@ from States import (
     RETURN_CONFIRM_UPDATE, RETURN_SELECT_FIELDS, RETURN_INPUT_MMR,
     RETURN_INPUT_BEHAVIOR,WAIT_FOR_EMAIL_CODE,WAIT_FOR_2FA_CONFIRM,
     ADMIN_ADD_2FA_ASK,ADMIN_ADD_EMAIL,ADMIN_ADD_EMAIL_PASSWORD,
+    ADMIN_USER_SEARCH,
 )
-from getCodeFromMail import FirstMailCodeReader
-
-from models import Account, User, AccountLog, Email
-from config import TOKEN, Session, scheduler, ADMIN_IDS
+from mailWatcher import mail_watcher, CodeWaiter, code_wait_cancel_markup
+from mailHealth import provider_health
+from steamGuard import generate_steam_guard_code, is_valid_shared_secret, seconds_until_next_code
+
+from models import Account, User, AccountLog, Email, Rental
+from config import TOKEN, scheduler, ADMIN_IDS, IMAP_KEEPALIVE_SECONDS, IMAP_PREWARM_TTL, \
+    CODE_WAIT_TIMEOUT_SECONDS, USERS_PAGE_SIZE, UPDATES_IN_FLIGHT
+from mailSessions import mail_sessions
+from unitOfWork import register_unit_of_work, load_db_user
+from dbMigrations import upgrade_database
+from rentalExpiry import rental_expiry
+from inventory import inventory
+from rentals import claim_account, end_rentals, get_active_rental, has_active_rental, active_rentals_by_account
+from authCache import auth_cache
+from pagination import fetch_accounts_page, fetch_users_page, search_users, page_buttons, page_callback, \
+    page_pattern, parse_page_callback
 from utils import is_admin, format_datetime, show_registration_error, main_menu_keyboard, \
-    check_user_is_approved_and_admin
+    check_user_is_approved_and_admin, get_user_access
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup
 )
@@ -29,8 +43,12 @@ from telegram.ext import (
     CallbackQueryHandler
 )
 from datetime import datetime, timedelta, timezone
+import html
 import logging
 from adminTextToEveryone import broadcast_conv
+from broadcastJobs import broadcast_jobs
+from webServer import WebServer
+from orderedApplication import OrderedApplication
 
 
 def format_duration(minutes: int) -> str:
@@ -70,343 +88,327 @@ async def notify_admins_new_user(session, new_user: User, app: Application):
 async def start(update: Update, context: CallbackContext):
     user = update.effective_user
     user_id = user.id
-    session = Session()
-    try:
-        # Если это callback_query (например, из кнопки), ответим и удалим сообщение
-        if update.callback_query:
-            await update.callback_query.answer()
-            try:
-                await update.callback_query.message.delete()
-            except Exception:
-                pass
-        # Если это обычное сообщение, можно попытаться удалить (если нужно)
-        elif update.message:
-            try:
-                await update.message.delete()
-            except Exception:
-                pass
-
-        existing_user = session.query(User).filter_by(telegram_id=user_id).first()
-
-        if existing_user:
-            if existing_user.is_approved:
-                role = "Админ" if is_admin(user_id) else "Пользователь"
-                await update.effective_chat.send_message(
-                    f"Привет, {role}! Этот бот позволяет арендовать Steam аккаунты с Dota 2 MMR.",
-                    reply_markup=main_menu_keyboard(user_id)
-                )
-            else:
-                await update.effective_chat.send_message(
-                    "Ваш аккаунт ещё не подтверждён админом. Пожалуйста, подождите."
-                )
-            return ConversationHandler.END
+    session = context.db_session
+    # Если это callback_query (например, из кнопки), ответим и удалим сообщение
+    if update.callback_query:
+        await update.callback_query.answer()
+        try:
+            await update.callback_query.message.delete()
+        except Exception:
+            pass
+    # Если это обычное сообщение, можно попытаться удалить (если нужно)
+    elif update.message:
+        try:
+            await update.message.delete()
+        except Exception:
+            pass
+
+    existing_user = await load_db_user(update, context)
+
+    if existing_user:
+        auth_cache.put(user_id, existing_user.is_approved, is_admin(user_id))
+        if existing_user.is_blocked:
+            # Пользователь снова написал боту — значит, разблокировал; рассылки снова доходят
+            existing_user.is_blocked = False
+        if existing_user.is_approved:
+            role = "Админ" if is_admin(user_id) else "Пользователь"
+            await update.effective_chat.send_message(
+                f"Привет, {role}! Этот бот позволяет арендовать Steam аккаунты с Dota 2 MMR.",
+                reply_markup=main_menu_keyboard(user_id)
+            )
         else:
-            is_approved = is_admin(user_id)
-            new_user = User(
-                telegram_id=user_id,
-                username=user.username,
-                first_name=user.first_name,
-                last_name=user.last_name,
-                is_approved=is_approved,
-                registered_at=datetime.now(timezone.utc)
+            await update.effective_chat.send_message(
+                "Ваш аккаунт ещё не подтверждён админом. Пожалуйста, подождите."
             )
-            session.add(new_user)
-            session.commit()
-
-            if is_approved:
-                await update.effective_chat.send_message(
-                    "Привет, Админ! Этот бот позволяет арендовать Steam аккаунты с Dota 2 MMR.",
-                    reply_markup=main_menu_keyboard(user_id)
-                )
-            else:
-                await update.effective_chat.send_message(
-                    "Спасибо за регистрацию! Ваш аккаунт ожидает подтверждения админом. Пожалуйста, дождитесь подтверждения."
-                )
-                await notify_admins_new_user(session, new_user, context.application)
-            return ConversationHandler.END
-    finally:
-        session.close()
+        return ConversationHandler.END
+    else:
+        is_approved = is_admin(user_id)
+        new_user = User(
+            telegram_id=user_id,
+            username=user.username,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            is_approved=is_approved,
+            registered_at=datetime.now(timezone.utc)
+        )
+        session.add(new_user)
+        await session.commit()
+        context.db_user = new_user
+        auth_cache.put(user_id, is_approved, is_approved)
+
+        if is_approved:
+            await update.effective_chat.send_message(
+                "Привет, Админ! Этот бот позволяет арендовать Steam аккаунты с Dota 2 MMR.",
+                reply_markup=main_menu_keyboard(user_id)
+            )
+        else:
+            await update.effective_chat.send_message(
+                "Спасибо за регистрацию! Ваш аккаунт ожидает подтверждения админом. Пожалуйста, дождитесь подтверждения."
+            )
+            await notify_admins_new_user(session, new_user, context.application)
+        return ConversationHandler.END
 
 
 async def list_accounts(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    session = Session()
-    try:
-        user_obj = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user_obj:
-            return await show_registration_error(update, "❌ Вы не зарегистрированы.")
-        if not user_obj.is_approved:
-            return await show_registration_error(update, "⏳ Ваш аккаунт ещё не подтверждён админом.")
-
-        accounts = session.query(Account).order_by(desc(Account.mmr)).all()
-        text = ""
-
-        if is_admin(user_id):
-            text = "🛠 *Все аккаунты (админ):*\n\n"
-            for acc in accounts:
-                email_obj = session.query(Email).filter_by(accountfk=acc.id).first()
-                email_info = ""
-                if email_obj:
-                    email_info = (
-                        f"📧 *Почта:* `{email_obj.login}`\n"
-                        f"🔑 *Пароль почты:* `{email_obj.password}`\n"
-                        f"🛡 *2FA:* Да\n"
-                    )
-
-                rent_info = ""
-                if acc.status == "rented" and acc.rented_at and acc.rent_duration:
-                    rent_end = acc.rented_at + timedelta(minutes=acc.rent_duration)
-                    duration_str = format_duration(acc.rent_duration)
-                    rent_info = (
-                        f"⏰ *Взято:* {format_datetime(acc.rented_at)}\n"
-                        f"⏳ *Длительность аренды:* {duration_str}\n"
-                        f"📅 *Вернуть до:* {format_datetime(rent_end)}\n"
-                        f"👤 *Арендатор Telegram ID:* `{acc.renter_id or '—'}`\n"
-                    )
-                calibrated_str = "✅ Да" if acc.calibration else "❌ Нет"
-
-                text += (
-                    f"🆔 *ID:* `{acc.id}`\n"
-                    f"🎯 *Откалиброван:* {calibrated_str}\n"
-                    f"📈 *MMR:* {acc.mmr}\n"
-                    f"🧠 *Поведение:* {acc.behavior or '—'}\n"
-                    f"🔒 *Статус:* {acc.status.capitalize()}\n"
-                    f"👤 *Логин аккаунта:* `{acc.login}`\n"
-                    f"🔐 *Пароль аккаунта:* `{acc.password}`\n"
-                    f"{email_info}"
-                    f"{rent_info}"
-                    + ("─" * 30) + "\n\n"
+    session = context.db_session
+    access = await get_user_access(update, context)
+    if not access:
+        return await show_registration_error(update, "❌ Вы не зарегистрированы.")
+    if not access.is_approved:
+        return await show_registration_error(update, "⏳ Ваш аккаунт ещё не подтверждён админом.")
+
+    text = ""
+    cursor, backward = parse_page_callback(update.callback_query.data if update.callback_query else None)
+
+    if is_admin(user_id):
+        text = "🛠 *Все аккаунты (админ):*\n\n"
+        # Страница аккаунтов с почтами и арендами — три запроса на страницу
+        page = await fetch_accounts_page(session, cursor, backward, options=(selectinload(Account.emails),))
+        active_rentals = await active_rentals_by_account(session, [acc.id for acc in page.items])
+        for acc in page.items:
+            email_obj = acc.emails[0] if acc.emails else None
+            email_info = ""
+            if email_obj:
+                email_info = (
+                    f"📧 *Почта:* `{email_obj.login}`\n"
+                    f"🔑 *Пароль почты:* `{email_obj.password}`\n"
+                    f"🛡 *2FA:* Да\n"
                 )
-        else:
-            text = "🎮 *Доступные аккаунты:*\n\n"
-            for acc in accounts:
-                status_emoji = "✅" if acc.status == "free" else "⛔"
-                calibrated_str = "✅ Да" if acc.calibration else "❌ Нет"
-
-                text += (
-                    f"🆔 *ID:* `{acc.id}`\n"
-                    f"📈 *MMR:* {acc.mmr}\n"
-                    f"🧠 *Поведение:* {acc.behavior or '—'}\n"
-                    f"🎯 *Откалиброван:* {calibrated_str}\n"
-                    f"🔒 *Статус:* {status_emoji} {acc.status.capitalize()}\n"
-                    + ("─" * 25) + "\n\n"
+
+            rent_info = ""
+            rental = active_rentals.get(acc.id)
+            if rental:
+                rent_info = (
+                    f"⏰ *Взято:* {format_datetime(rental.started_at)}\n"
+                    f"⏳ *Длительность аренды:* {format_duration(rental.duration_minutes)}\n"
+                    f"📅 *Вернуть до:* {format_datetime(rental.ends_at)}\n"
+                    f"👤 *Арендатор Telegram ID:* `{rental.user_id}`\n"
                 )
+            calibrated_str = "✅ Да" if acc.calibration else "❌ Нет"
 
-        if not text.strip():
-            text = "❌ Нет аккаунтов."
+            text += (
+                f"🆔 *ID:* `{acc.id}`\n"
+                f"🎯 *Откалиброван:* {calibrated_str}\n"
+                f"📈 *MMR:* {acc.mmr}\n"
+                f"🧠 *Поведение:* {acc.behavior or '—'}\n"
+                f"🔒 *Статус:* {acc.status.capitalize()}\n"
+                f"👤 *Логин аккаунта:* `{acc.login}`\n"
+                f"🔐 *Пароль аккаунта:* `{acc.password}`\n"
+                f"{email_info}"
+                f"{rent_info}"
+                + ("─" * 30) + "\n\n"
+            )
+    else:
+        text = "🎮 *Доступные аккаунты:*\n\n"
+        # Пользовательский список строится из индекса в памяти, без запроса к БД
+        page = inventory.page(cursor=cursor, backward=backward)
+        for acc in page.items:
+            status_emoji = "✅" if acc.status == "free" else "⛔"
+            calibrated_str = "✅ Да" if acc.calibration else "❌ Нет"
 
-        if update.message:
-            await update.message.reply_text(text, reply_markup=main_menu_keyboard(user_id), parse_mode="Markdown")
-        elif update.callback_query:
-            current_text = update.callback_query.message.text or ""
-            current_markup = update.callback_query.message.reply_markup
-            new_markup = main_menu_keyboard(user_id)
-
-            def markup_equals(m1, m2):
-                if m1 is None and m2 is None:
-                    return True
-                if m1 is None or m2 is None:
-                    return False
-                kb1 = getattr(m1, 'inline_keyboard', None)
-                kb2 = getattr(m2, 'inline_keyboard', None)
-                return kb1 == kb2
-
-            if current_text == text and markup_equals(current_markup, new_markup):
-                await update.callback_query.answer()  # "погасить" спиннер
-                return
-            else:
-                await update.callback_query.edit_message_text(text, reply_markup=new_markup, parse_mode="Markdown")
-    finally:
-        session.close()
+            text += (
+                f"🆔 *ID:* `{acc.id}`\n"
+                f"📈 *MMR:* {acc.mmr}\n"
+                f"🧠 *Поведение:* {acc.behavior or '—'}\n"
+                f"🎯 *Откалиброван:* {calibrated_str}\n"
+                f"🔒 *Статус:* {status_emoji} {acc.status.capitalize()}\n"
+                + ("─" * 25) + "\n\n"
+            )
+
+    if not page.items:
+        text = "❌ Нет аккаунтов."
+
+    new_markup = InlineKeyboardMarkup(
+        page_buttons("list", page) + list(main_menu_keyboard(user_id).inline_keyboard)
+    )
+    if update.message:
+        await update.message.reply_text(text, reply_markup=new_markup, parse_mode="Markdown")
+    elif update.callback_query:
+        current_text = update.callback_query.message.text or ""
+        current_markup = update.callback_query.message.reply_markup
+
+        def markup_equals(m1, m2):
+            if m1 is None and m2 is None:
+                return True
+            if m1 is None or m2 is None:
+                return False
+            kb1 = getattr(m1, 'inline_keyboard', None)
+            kb2 = getattr(m2, 'inline_keyboard', None)
+            return kb1 == kb2
+
+        if current_text == text and markup_equals(current_markup, new_markup):
+            await update.callback_query.answer()  # "погасить" спиннер
+            return
+        else:
+            await update.callback_query.edit_message_text(text, reply_markup=new_markup, parse_mode="Markdown")
 
 
 async def my(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    session = Session()
-    try:
-        user_obj = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user_obj:
-            return await show_registration_error(update, "❌ Вы не зарегистрированы.")
-        if not user_obj.is_approved:
-            return await show_registration_error(update, "⏳ Ваш аккаунт ещё не подтверждён админом.")
-
-        accounts = session.query(Account).filter_by(renter_id=user_id, status="rented").all()
-        if accounts:
-            text = "📋 *Ваши арендованные аккаунты:*\n\n"
-            for acc in accounts:
-                rent_end = acc.rented_at + timedelta(minutes=acc.rent_duration) if acc.rented_at and acc.rent_duration else None
-                duration_str = format_duration(acc.rent_duration) if acc.rent_duration else "—"
-                rent_start_str = format_datetime(acc.rented_at) if acc.rented_at else "—"
-                rent_end_str = format_datetime(rent_end) if rent_end else "—"
-                calibrated_str = "✅ Да" if acc.calibration else "❌ Нет"
-                behavior_str = acc.behavior or "—"
-
-                # Получаем почту из связанной таблицы emails
-                email_obj = session.query(Email).filter_by(accountfk=acc.id).first()
-                email_info = ""
-                if email_obj and is_admin(user_id):
-                    email_info = (
-                        f"📧 *Почта:* `{email_obj.login}`\n"
-                        f"🔑 *Пароль почты:* `{email_obj.password}`\n"
-                        f"🛡 *2FA:* Да\n"
-                    )
-
-                text += (
-                    f"🆔 *ID:* `{acc.id}`\n"
-                    f"🎯 *Откалиброван:* {calibrated_str}\n"
-                    f"📈 *MMR:* {acc.mmr}\n"
-                    f"🧠 *Поведение:* {behavior_str}\n"
-                    f"🔑 *Логин аккаунта:* `{acc.login}`\n"
-                    f"🔒 *Пароль аккаунта:* `{acc.password}`\n"
-                    f"{email_info}"
-                    f"⏰ *Взято:* {rent_start_str}\n"
-                    f"⏳ *Длительность аренды:* {duration_str}\n"
-                    f"🕒 *Вернуть до:* {rent_end_str}\n"
+    session = context.db_session
+    access = await get_user_access(update, context)
+    if not access:
+        return await show_registration_error(update, "❌ Вы не зарегистрированы.")
+    if not access.is_approved:
+        return await show_registration_error(update, "⏳ Ваш аккаунт ещё не подтверждён админом.")
+
+    rentals = (await session.scalars(
+        select(Rental).options(joinedload(Rental.account).selectinload(Account.emails))
+        .where(Rental.user_id == user_id, Rental.ended_at.is_(None))
+    )).all()
+    if rentals:
+        text = "📋 *Ваши арендованные аккаунты:*\n\n"
+        for rental in rentals:
+            acc = rental.account
+            duration_str = format_duration(rental.duration_minutes)
+            rent_start_str = format_datetime(rental.started_at)
+            rent_end_str = format_datetime(rental.ends_at)
+            calibrated_str = "✅ Да" if acc.calibration else "❌ Нет"
+            behavior_str = acc.behavior or "—"
+
+            email_obj = acc.emails[0] if acc.emails else None
+            email_info = ""
+            if email_obj and is_admin(user_id):
+                email_info = (
+                    f"📧 *Почта:* `{email_obj.login}`\n"
+                    f"🔑 *Пароль почты:* `{email_obj.password}`\n"
+                    f"🛡 *2FA:* Да\n"
                 )
-                if is_admin(user_id):
-                    text += f"👤 *Арендатор Telegram ID:* `{acc.renter_id}`\n"
 
-                text += "\n" + ("─" * 30) + "\n\n"
-        else:
-            text = "❌ У вас нет арендованных аккаунтов."
+            text += (
+                f"🆔 *ID:* `{acc.id}`\n"
+                f"🎯 *Откалиброван:* {calibrated_str}\n"
+                f"📈 *MMR:* {acc.mmr}\n"
+                f"🧠 *Поведение:* {behavior_str}\n"
+                f"🔑 *Логин аккаунта:* `{acc.login}`\n"
+                f"🔒 *Пароль аккаунта:* `{acc.password}`\n"
+                f"{email_info}"
+                f"⏰ *Взято:* {rent_start_str}\n"
+                f"⏳ *Длительность аренды:* {duration_str}\n"
+                f"🕒 *Вернуть до:* {rent_end_str}\n"
+            )
+            if is_admin(user_id):
+                text += f"👤 *Арендатор Telegram ID:* `{rental.user_id}`\n"
 
-        markup = main_menu_keyboard(user_id)
-        if update.message:
-            await update.message.reply_text(text, reply_markup=markup, parse_mode="Markdown")
-        elif update.callback_query:
-            await update.callback_query.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
-    finally:
-        session.close()
+            text += "\n" + ("─" * 30) + "\n\n"
+    else:
+        text = "❌ У вас нет арендованных аккаунтов."
+
+    markup = main_menu_keyboard(user_id)
+    if update.message:
+        await update.message.reply_text(text, reply_markup=markup, parse_mode="Markdown")
+    elif update.callback_query:
+        await update.callback_query.edit_message_text(text, reply_markup=markup, parse_mode="Markdown")
 
 
 async def whoami(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    session = Session()
-    try:
-        user_obj = session.query(User).filter_by(telegram_id=user_id).first()
-
-        if not user_obj:
-            return await show_registration_error(update, "Вы не зарегистрированы.")
-        if not user_obj.is_approved:
-            return await show_registration_error(update, "Ваш аккаунт ещё не подтверждён админом.")
-
-        role = "Админ" if is_admin(user_id) else "Пользователь"
-        username = f"@{user_obj.username}" if user_obj.username else "(нет)"
-        first_name = user_obj.first_name if user_obj.first_name else "(нет)"
-        last_name = user_obj.last_name if user_obj.last_name else ""
-
-        text = (
-            f"👤 *Информация о пользователе:*\n\n"
-            f"🆔 *ID:* `{user_obj.telegram_id}`\n"
-            f"🔗 *Username:* {username}\n"
-            f"📛 *Имя:* {first_name} {last_name}\n"
-            f"🎭 *Роль:* {role}"
-        )
+    session = context.db_session
+    user_obj = await load_db_user(update, context)
+
+    if not user_obj:
+        return await show_registration_error(update, "Вы не зарегистрированы.")
+    if not user_obj.is_approved:
+        return await show_registration_error(update, "Ваш аккаунт ещё не подтверждён админом.")
+
+    role = "Админ" if is_admin(user_id) else "Пользователь"
+    username = f"@{user_obj.username}" if user_obj.username else "(нет)"
+    first_name = user_obj.first_name if user_obj.first_name else "(нет)"
+    last_name = user_obj.last_name if user_obj.last_name else ""
+
+    text = (
+        f"👤 *Информация о пользователе:*\n\n"
+        f"🆔 *ID:* `{user_obj.telegram_id}`\n"
+        f"🔗 *Username:* {username}\n"
+        f"📛 *Имя:* {first_name} {last_name}\n"
+        f"🎭 *Роль:* {role}"
+    )
 
-        if update.message:
-            await update.message.reply_text(text, reply_markup=main_menu_keyboard(user_id), parse_mode="Markdown")
-        elif update.callback_query:
-            await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard(user_id), parse_mode="Markdown")
-    finally:
-        session.close()
+    if update.message:
+        await update.message.reply_text(text, reply_markup=main_menu_keyboard(user_id), parse_mode="Markdown")
+    elif update.callback_query:
+        await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard(user_id), parse_mode="Markdown")
 
 
 
 async def rent_start(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    session = Session()
 
     def format_calibrated(calibration):
         return "✅ Да" if calibration else "❌ Нет"
 
-    try:
-        user_obj = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user_obj:
-            await show_registration_error(update, "❌ Вы не зарегистрированы.")
-            return ConversationHandler.END
-        if not user_obj.is_approved:
-            await show_registration_error(update, "⏳ Ваш аккаунт ещё не подтверждён админом.")
-            return ConversationHandler.END
-
-        rented_acc = session.query(Account).filter_by(renter_id=user_id, status="rented").first()
-        if rented_acc:
-            text = f"⚠️ У вас уже есть арендованный аккаунт ID {rented_acc.id}. Сначала верните его."
-            if update.callback_query:
-                await update.callback_query.answer(text, show_alert=True)
-                await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard(user_id))
-            else:
-                await update.message.reply_text(text, reply_markup=main_menu_keyboard(user_id))
-            return ConversationHandler.END
-
-        free_accounts = session.query(Account).filter_by(status="free").all()
-        if not free_accounts:
-            msg = "Свободных аккаунтов нет."
-            if update.callback_query:
-                await update.callback_query.answer(msg, show_alert=True)
-            else:
-                await update.message.reply_text(msg, reply_markup=main_menu_keyboard(user_id))
-            return ConversationHandler.END
-        free_accounts.sort(key=lambda acc: acc.mmr if acc.mmr else 0, reverse=True)
-
-
-        parts = []
-        for acc in free_accounts:
-            calibrated = format_calibrated(acc.calibration)
-            behavior = acc.behavior if acc.behavior is not None else "—"
-            mmr = acc.mmr if acc.mmr is not None else "—"
-            status = acc.status or "—"
-
-            part = (
-                f"🆔 <b>ID:</b> {acc.id}\n"
-                f"🎯 <b>Откалиброван:</b> {calibrated}\n"
-                f"📈 <b>MMR:</b> {mmr}\n"
-                f"🧠 <b>Поведение:</b> {behavior}\n"
-                f"🔒 <b>Статус:</b> {status}\n"
-                "──────────────────────────────"
-            )
-            parts.append(part)
-
-        max_len = 4000
-        messages = []
-        current_msg = ""
-        for part in parts:
-            if len(current_msg) + len(part) + 2 > max_len:
-                messages.append(current_msg)
-                current_msg = part + "\n\n"
-            else:
-                current_msg += part + "\n\n"
-        if current_msg:
-            messages.append(current_msg)
-
-        buttons = []
-        row = []
-        for acc in free_accounts:
-            btn = InlineKeyboardButton(f"ID {acc.id}", callback_data=f"rent_acc_{acc.id}")
-            row.append(btn)
-            if len(row) == 3:
-                buttons.append(row)
-                row = []
-        if row:
-            buttons.append(row)
+    access = await get_user_access(update, context)
+    if not access:
+        await show_registration_error(update, "❌ Вы не зарегистрированы.")
+        return ConversationHandler.END
+    if not access.is_approved:
+        await show_registration_error(update, "⏳ Ваш аккаунт ещё не подтверждён админом.")
+        return ConversationHandler.END
 
-        buttons.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_rent")])
-        reply_markup = InlineKeyboardMarkup(buttons)
+    rented_account_id = inventory.rented_by(user_id)
+    if rented_account_id:
+        text = f"⚠️ У вас уже есть арендованный аккаунт ID {rented_account_id}. Сначала верните его."
+        if update.callback_query:
+            await update.callback_query.answer(text, show_alert=True)
+            await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard(user_id))
+        else:
+            await update.message.reply_text(text, reply_markup=main_menu_keyboard(user_id))
+        return ConversationHandler.END
 
+    cursor, backward = parse_page_callback(update.callback_query.data if update.callback_query else None)
+    page = inventory.page("free", cursor, backward)
+    if not page.items:
+        msg = "Свободных аккаунтов нет."
         if update.callback_query:
-            await update.callback_query.answer()
-            await update.callback_query.edit_message_text(
-                messages[0], reply_markup=reply_markup, parse_mode="HTML"
-            )
+            await update.callback_query.answer(msg, show_alert=True)
         else:
-            await update.message.reply_text(messages[0], reply_markup=reply_markup, parse_mode="HTML")
+            await update.message.reply_text(msg, reply_markup=main_menu_keyboard(user_id))
+        return ConversationHandler.END
 
-        for msg_text in messages[1:]:
-            await context.bot.send_message(chat_id=user_id, text=msg_text, parse_mode="HTML")
+    parts = []
+    for acc in page.items:
+        calibrated = format_calibrated(acc.calibration)
+        behavior = acc.behavior if acc.behavior is not None else "—"
+        mmr = acc.mmr if acc.mmr is not None else "—"
+        status = acc.status or "—"
 
-        return USER_RENT_SELECT_ACCOUNT
+        part = (
+            f"🆔 <b>ID:</b> {acc.id}\n"
+            f"🎯 <b>Откалиброван:</b> {calibrated}\n"
+            f"📈 <b>MMR:</b> {mmr}\n"
+            f"🧠 <b>Поведение:</b> {behavior}\n"
+            f"🔒 <b>Статус:</b> {status}\n"
+            "──────────────────────────────"
+        )
+        parts.append(part)
+    text = "\n\n".join(parts)
+
+    buttons = []
+    row = []
+    for acc in page.items:
+        btn = InlineKeyboardButton(f"ID {acc.id}", callback_data=f"rent_acc_{acc.id}")
+        row.append(btn)
+        if len(row) == 3:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+
+    buttons += page_buttons("rent", page)
+    buttons.append([InlineKeyboardButton("❌ Отмена", callback_data="cancel_rent")])
+    reply_markup = InlineKeyboardMarkup(buttons)
+
+    if update.callback_query:
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(
+            text, reply_markup=reply_markup, parse_mode="HTML"
+        )
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup, parse_mode="HTML")
+
+    return USER_RENT_SELECT_ACCOUNT
 
-    finally:
-        session.close()
 
 async def cancel_rent(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -430,6 +432,16 @@ async def rent_select_account(update: Update, context: CallbackContext):
         return USER_RENT_SELECT_ACCOUNT
     acc_id = int(data.split("_")[-1])
     context.user_data['rent_acc_id'] = acc_id
+
+    # Пока пользователь выбирает длительность, заранее открываем почту аккаунта
+    # (аккаунтам с shared_secret почта для кода не нужна)
+    email_entry = await context.db_session.scalar(
+        select(Email).join(Email.account).where(
+            Email.accountfk == acc_id, Account.steam_shared_secret.is_(None)
+        ).limit(1)
+    )
+    if email_entry and email_entry.login and email_entry.password:
+        mail_watcher.prewarm(email_entry.id, email_entry.login, email_entry.password)
     buttons = [
         [InlineKeyboardButton("60 минут", callback_data="rent_dur_60")],
         [InlineKeyboardButton("120 минут", callback_data="rent_dur_120")],
@@ -454,104 +466,143 @@ async def rent_select_duration(update: Update, context: CallbackContext):
     acc_id = context.user_data.get('rent_acc_id')
     user_id = query.from_user.id
 
-    session = Session()
-    try:
-        acc = session.query(Account).get(acc_id)
-        if not acc or acc.status != "free":
+    session = context.db_session
+    # Аккаунт, почта и проверка «нет другой аренды» — одним атомарным запросом
+    acc = await claim_account(session, acc_id, user_id, duration)
+    if not acc:
+        if await has_active_rental(session, user_id):
+            await query.answer("У вас уже есть арендованный аккаунт.", show_alert=True)
+        else:
             await query.answer("Аккаунт уже арендован.", show_alert=True)
-            return ConversationHandler.END
+        return ConversationHandler.END
+    rental_expiry.schedule(acc.id, acc.ends_at)
+    inventory.mark_rented(acc.id, user_id)
 
-        already_rented = session.query(Account).filter_by(renter_id=user_id, status="rented").first()
-        if already_rented:
-            await query.answer("У вас уже есть арендованный аккаунт.", show_alert=True)
-            return ConversationHandler.END
+    if acc.steam_shared_secret:
+        # Код Steam Guard генерируется локально из shared_secret — без почты и сети
+        code = generate_steam_guard_code(acc.steam_shared_secret)
+        session.add(AccountLog(
+            user_id=user_id,
+            account_id=acc.id,
+            action='Арендован (Steam Guard TOTP)',
+            action_date=acc.started_at
+        ))
+        await session.commit()
+        await query.edit_message_text(
+            steam_guard_code_text(acc, code),
+            parse_mode="Markdown",
+            reply_markup=steam_guard_keyboard(user_id)
+        )
+        return ConversationHandler.END
 
-        email_entry = session.query(Email).filter_by(accountfk=acc.id).first()
+    if acc.email_id:
+        # Сохраняем данные почты для дальнейшего ожидания кода
+        context.user_data["pending_rent"] = {
+            "acc_id": acc.id,
+            "rental_id": acc.rental_id,
+            "duration": duration,
+            "email_id": acc.email_id,
+            "email_login": acc.email_login,
+            "email_password": acc.email_password,
+            "started_at": acc.started_at
+        }
+        context.user_data["code_wait_start"] = datetime.now(timezone.utc)
 
-        # Сразу меняем статус и сохраняем
-        acc.status = "rented"
-        acc.renter_id = user_id
-        acc.rented_at = datetime.now(timezone.utc)
-        acc.rent_duration = duration
+        buttons = [
+            [InlineKeyboardButton("✅ Код требуется", callback_data="confirm_2fa_yes")],
+            [InlineKeyboardButton("❌ Код не требуется", callback_data="confirm_2fa_no")]
+        ]
+        await query.edit_message_text(
+            f"👤 Логин: `{acc.login}`\n"
+            f"🔐 Пароль: `{acc.password}`\n\n"
+            "📩 Требуется ли код Steam Guard для входа?\n"
+            "✏️ Пожалуйста, подтвердите.",
+            parse_mode="Markdown",
+            reply_markup=InlineKeyboardMarkup(buttons)
+        )
+        return WAIT_FOR_2FA_CONFIRM
+    else:
+        message_text = (
+            f"👤 Логин: `{acc.login}`\n🔐 Пароль: `{acc.password}`\n\n"
+            "⚠️ Для этого аккаунта не настроена двухфакторная аутентификация — код подтверждения не придёт.\n"
+            "✅ Аккаунт успешно арендован."
+        )
+        session.add(AccountLog(
+            user_id=user_id,
+            account_id=acc.id,
+            action='Арендован (без 2FA)',
+            action_date=acc.started_at
+        ))
+        await session.commit()
+        await query.edit_message_text(
+            message_text,
+            parse_mode="Markdown",
+            reply_markup=main_menu_keyboard(user_id)
+        )
+        return ConversationHandler.END
 
+def steam_guard_code_text(acc: Account, code: str) -> str:
+    return (
+        f"✅ Аккаунт успешно арендован!\n"
+        f"👤 Логин: `{acc.login}`\n"
+        f"🔐 Пароль: `{acc.password}`\n\n"
+        f"📩 Код Steam Guard: `{code}`\n"
+        f"⏱ Код действует ещё {seconds_until_next_code()} с. Если не успели — нажмите «Новый код».\n"
+        f"🆔 Аккаунт ID: {acc.id}"
+    )
 
-        session.commit()
 
-        if email_entry:
-            # Сохраняем данные почты для дальнейшего ожидания кода
-            context.user_data["pending_rent"] = {
-                "acc_id": acc.id,
-                "duration": duration,
-                "email_login": email_entry.login,
-                "email_password": email_entry.password
-            }
-            context.user_data["code_wait_start"] = datetime.now(timezone.utc)
+def steam_guard_keyboard(user_id) -> InlineKeyboardMarkup:
+    buttons = [[InlineKeyboardButton("🔄 Новый код Steam Guard", callback_data="steam_guard_code")]]
+    buttons += list(main_menu_keyboard(user_id).inline_keyboard)
+    return InlineKeyboardMarkup(buttons)
+
+
+async def steam_guard_refresh(update: Update, context: CallbackContext):
+    query = update.callback_query
+    user_id = query.from_user.id
+    session = context.db_session
+    rental = await get_active_rental(session, user_id)
+    acc = rental.account if rental else None
+    if not acc or not acc.steam_shared_secret:
+        await query.answer("У вас нет аренды с Steam Guard.", show_alert=True)
+        return
+    await query.answer()
+    await query.edit_message_text(
+        steam_guard_code_text(acc, generate_steam_guard_code(acc.steam_shared_secret)),
+        parse_mode="Markdown",
+        reply_markup=steam_guard_keyboard(user_id)
+    )
 
-            buttons = [
-                [InlineKeyboardButton("✅ Код требуется", callback_data="confirm_2fa_yes")],
-                [InlineKeyboardButton("❌ Код не требуется", callback_data="confirm_2fa_no")]
-            ]
-            await query.edit_message_text(
-                f"👤 Логин: `{acc.login}`\n"
-                f"🔐 Пароль: `{acc.password}`\n\n"
-                "📩 Требуется ли код Steam Guard для входа?\n"
-                "✏️ Пожалуйста, подтвердите.",
-                parse_mode="Markdown",
-                reply_markup=InlineKeyboardMarkup(buttons)
-            )
-            return WAIT_FOR_2FA_CONFIRM
-        else:
-            message_text = (
-                f"👤 Логин: `{acc.login}`\n🔐 Пароль: `{acc.password}`\n\n"
-                "⚠️ Для этого аккаунта не настроена двухфакторная аутентификация — код подтверждения не придёт.\n"
-                "✅ Аккаунт успешно арендован."
-            )
-            session.add(AccountLog(
-                user_id=user_id,
-                account_id=acc.id,
-                action='Арендован (без 2FA)',
-                action_date=acc.rented_at
-            ))
-            session.commit()
-            await query.edit_message_text(
-                message_text,
-                parse_mode="Markdown",
-                reply_markup=main_menu_keyboard(user_id)
-            )
-            return ConversationHandler.END
-    finally:
-        session.close()
 
 async def confirm_2fa_handler(update: Update, context: CallbackContext):
     query = update.callback_query
     data = query.data
-    session = Session()
-    try:
-        acc_id = context.user_data.get('rent_acc_id')
-        user_id = query.from_user.id
-        acc = session.query(Account).filter_by(id=acc_id).first()
-        if data == "confirm_2fa_yes":
-            await query.answer("Ожидаем код с почты...")
-            return await wait_for_code_and_confirm(update, context)
-
-        elif data == "confirm_2fa_no":
-            await query.answer("Аренда завершена без кода.")
-            session.add(AccountLog(
-                user_id=user_id,
-                account_id=acc_id,
-                action='Арендован (без 2FA)',
-                action_date=acc.rented_at
-            ))
-            session.commit()
-            context.user_data.clear()
-            await query.edit_message_text("Вы в главном меню.", reply_markup=main_menu_keyboard(user_id))
-            return ConversationHandler.END
+    session = context.db_session
+    acc_id = context.user_data.get('rent_acc_id')
+    user_id = query.from_user.id
+    pending_rent = context.user_data.get("pending_rent") or {}
+    if data == "confirm_2fa_yes":
+        await query.answer("Ожидаем код с почты...")
+        return await wait_for_code_and_confirm(update, context)
+
+    elif data == "confirm_2fa_no":
+        await query.answer("Аренда завершена без кода.")
+        session.add(AccountLog(
+            user_id=user_id,
+            account_id=acc_id,
+            action='Арендован (без 2FA)',
+            action_date=pending_rent.get("started_at") or datetime.now(timezone.utc)
+        ))
+        await session.commit()
+        context.user_data.clear()
+        await query.edit_message_text("Вы в главном меню.", reply_markup=main_menu_keyboard(user_id))
+        return ConversationHandler.END
+
+    else:
+        await query.answer()
+        return WAIT_FOR_2FA_CONFIRM
 
-        else:
-            await query.answer()
-            return WAIT_FOR_2FA_CONFIRM
-    finally:
-        session.close()
 
 async def wait_for_code_and_confirm(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -571,114 +622,133 @@ async def wait_for_code_and_confirm(update: Update, context: CallbackContext):
         await query.edit_message_text("Ошибка: получения кода с почты.", reply_markup=main_menu_keyboard(user_id))
         return ConversationHandler.END
 
-    session = Session()
-    acc = session.query(Account).filter_by(id=acc_id).first()
-    session.close()
+    session = context.db_session
+    acc = await session.get(Account, acc_id)
     if not acc:
         await query.edit_message_text("Ошибка: аккаунт не найден.", reply_markup=main_menu_keyboard(user_id))
         return ConversationHandler.END
 
-    total_attempts = 30
-    wait_seconds = 10
-
-    cancel_markup = InlineKeyboardMarkup([
-        [InlineKeyboardButton("🚫 Отменить аренду", callback_data="cancel_rent")]
-    ])
+    if not mail_watcher.provider_available():
+        # Почтовый провайдер недоступен — сообщаем сразу, а не через 5 минут ожидания
+        await query.edit_message_text(
+            f"👤 Логин: `{acc.login}`\n"
+            f"🔐 Пароль: `{acc.password}`\n\n"
+            "⚠️ Почтовый сервис сейчас недоступен, код Steam Guard получить не удастся.\n"
+            "Попробуйте позже.",
+            parse_mode="Markdown",
+            reply_markup=main_menu_keyboard(user_id)
+        )
+        session.add(AccountLog(
+            user_id=user_id,
+            account_id=acc.id,
+            action='Арендован (Почтовый сервис недоступен)',
+            action_date=data["started_at"]
+        ))
+        context.user_data.clear()
+        return ConversationHandler.END
 
-    reader = FirstMailCodeReader(email_login, email_password)
+    since_dt = context.user_data.get("code_wait_start")
+    if since_dt:
+        since_dt = since_dt - timedelta(minutes=5)
 
     await query.edit_message_text(
         f"👤 Логин: `{acc.login}`\n"
         f"🔐 Пароль: `{acc.password}`\n\n"
-        f"📥 Начинаю поиск кода Steam Guard...\n"
-        f"⏳ Максимальное время ожидания: {total_attempts * wait_seconds // 60} мин.",
+        f"📥 Ожидаю код Steam Guard — он придёт в это сообщение.\n"
+        f"⏳ Максимальное время ожидания: {CODE_WAIT_TIMEOUT_SECONDS // 60} мин.",
         parse_mode="Markdown",
-        reply_markup=cancel_markup
+        reply_markup=code_wait_cancel_markup()
     )
-    await asyncio.sleep(2)
-    for attempt in range(total_attempts):
-        since_dt = context.user_data.get("code_wait_start")
-        if since_dt:
-            since_dt = since_dt - timedelta(minutes=5)
-
-        code = reader.fetch_latest_code(since_dt=since_dt)
-        if code:
-            # Обновляем статус аккаунта в базе
-            await query.edit_message_text(
-                f"✅ Аккаунт успешно арендован!\n"
-                f"👤 Логин: `{acc.login}`\n"
-                f"🔐 Пароль: `{acc.password}`\n\n"
-                f"📩 Код Steam: `{code}`\n"
-                f"🆔 Аккаунт ID: {acc.id}",
-                parse_mode="Markdown",
-                reply_markup=main_menu_keyboard(user_id)
-            )
-            session.add(AccountLog(
-                user_id=user_id,
-                account_id=acc.id,
-                action='Арендован (с 2FA)',
-                action_date=acc.rented_at
-            ))
-            context.user_data.clear()
-            return ConversationHandler.END
-
-        else:
-
-            await query.edit_message_text(
-                f"👤 Логин: `{acc.login}`\n"
-                f"🔐 Пароль: `{acc.password}`\n\n"
-                f"📥 Ожидаю код Steam Guard... Попытка {attempt + 1} из {total_attempts}",
-                parse_mode="Markdown",
-                reply_markup=cancel_markup
-            )
-            await asyncio.sleep(wait_seconds)
 
-    # Если код не пришёл
-    await query.edit_message_text(
-        f"⚠️ Не удалось получить код Steam в течение {total_attempts * wait_seconds // 60} минут.\n"
-        "Попробуйте позже.",
-        reply_markup=main_menu_keyboard(user_id)
+    # Код доставит фоновый MailboxWatcher, диалог аренды на этом завершается
+    mail_watcher.register(
+        CodeWaiter(
+            user_id=user_id,
+            chat_id=query.message.chat_id,
+            message_id=query.message.message_id,
+            account_id=acc.id,
+            rental_id=data["rental_id"],
+            account_login=acc.login,
+            account_password=acc.password,
+            rented_at=data["started_at"],
+            since_dt=since_dt
+        ),
+        data.get("email_id"), email_login, email_password
     )
-    session.add(AccountLog(
-        user_id=user_id,
-        account_id=acc.id,
-        action='Арендован (Ошибка получения кода с почты)',
-        action_date=acc.rented_at
-    ))
     context.user_data.clear()
     return ConversationHandler.END
 
 
+async def cancel_code_wait(update: Update, context: CallbackContext):
+    query = update.callback_query
+    user_id = query.from_user.id
+    await query.answer()
+    mail_watcher.cancel(user_id)
+    await query.edit_message_text("Главное меню", reply_markup=main_menu_keyboard(user_id))
+
+
+# --- Админ: состояние почтового провайдера ---
+async def show_mail_health(update: Update, context: CallbackContext):
+    user_id = update.effective_user.id
+    is_valid = await check_user_is_approved_and_admin(update, context)
+    if not is_valid:
+        return ConversationHandler.END
+
+    await update.callback_query.answer()
+    text = "📊 <b>Состояние почтовых серверов:</b>\n\n"
+    breakers = provider_health.all()
+    if not breakers:
+        text += "Запросов к почте ещё не было.\n"
+    state_names = {"closed": "✅ Работает", "open": "⛔ Недоступен", "half_open": "🔄 Проверка"}
+    for breaker in breakers:
+        avg = f"{breaker.average_latency:.2f} с" if breaker.average_latency is not None else "—"
+        last = f"{breaker.last_latency:.2f} с" if breaker.last_latency is not None else "—"
+        text += (
+            f"🌐 <b>{html.escape(breaker.name)}</b>\n"
+            f"   Статус: {state_names.get(breaker.state, breaker.state)}\n"
+            f"   Успешно: {breaker.successes}, ошибок: {breaker.failures} "
+            f"(подряд: {breaker.consecutive_failures}), отклонено: {breaker.rejected}\n"
+            f"   Задержка: средняя {avg}, последняя {last}\n"
+        )
+        if breaker.last_error:
+            text += f"   Последняя ошибка: <code>{html.escape(breaker.last_error)}</code>\n"
+        text += "\n"
+    text += f"⏳ Ожидают код сейчас: {mail_watcher.pending_count()}"
+    hit_rate = f"{auth_cache.hit_rate:.0%}" if auth_cache.hit_rate is not None else "—"
+    text += (
+        f"\n\n🔑 <b>Кэш прав доступа:</b> записей {len(auth_cache)}, "
+        f"попаданий {auth_cache.hits}, промахов {auth_cache.misses} ({hit_rate})"
+    )
 
+    await update.callback_query.edit_message_text(
+        text, reply_markup=main_menu_keyboard(user_id), parse_mode="HTML"
+    )
 
 
 # --- Возврат аккаунта ---
 async def return_account(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    session = Session()
-    try:
-        user = session.query(User).filter_by(telegram_id=user_id).first()
-        if not user or not user.is_approved:
-            return await show_registration_error(update, "Вы не зарегистрированы или не подтверждены.")
-
-        acc = session.query(Account).filter_by(renter_id=user_id, status="rented").first()
-        if not acc:
-            await update.callback_query.answer("У вас нет арендованных аккаунтов.", show_alert=True)
-            return ConversationHandler.END
+    session = context.db_session
+    access = await get_user_access(update, context)
+    if not access or not access.is_approved:
+        return await show_registration_error(update, "Вы не зарегистрированы или не подтверждены.")
+
+    rental = await get_active_rental(session, user_id)
+    if not rental:
+        await update.callback_query.answer("У вас нет арендованных аккаунтов.", show_alert=True)
+        return ConversationHandler.END
 
-        context.user_data["return_acc_id"] = acc.id
+    context.user_data["return_acc_id"] = rental.account_id
 
-        buttons = [
-            [InlineKeyboardButton("Да", callback_data="return_update_yes")],
-            [InlineKeyboardButton("Нет", callback_data="return_update_no")]
-        ]
-        await update.callback_query.edit_message_text(
-            "Вы хотите обновить MMR или Behavior перед возвратом?",
-            reply_markup=InlineKeyboardMarkup(buttons)
-        )
-        return RETURN_CONFIRM_UPDATE
-    finally:
-        session.close()
+    buttons = [
+        [InlineKeyboardButton("Да", callback_data="return_update_yes")],
+        [InlineKeyboardButton("Нет", callback_data="return_update_no")]
+    ]
+    await update.callback_query.edit_message_text(
+        "Вы хотите обновить MMR или Behavior перед возвратом?",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+    return RETURN_CONFIRM_UPDATE
 
 async def return_confirm_handler(update: Update, context: CallbackContext):
     if update.callback_query.data == "return_update_yes":
@@ -718,14 +788,22 @@ async def return_input_behavior(update: Update, context: CallbackContext):
 
 async def finalize_return(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    session = Session()
+    session = context.db_session
     try:
-        acc = session.query(Account).get(context.user_data["return_acc_id"])
-        acc.status = "free"
-        acc.renter_id = None
-        acc.rented_at = None
-        acc.rent_duration = None
+        acc_id = context.user_data["return_acc_id"]
+        released = await end_rentals(session, (Rental.account_id == acc_id) & (Rental.user_id == user_id), "returned")
+        rental_expiry.cancel(acc_id)
+        mail_watcher.cancel_account(acc_id)
+        if not released:
+            # Аренда успела закончиться автоматически
+            text = f"Аренда аккаунта ID {acc_id} уже завершена."
+            if update.message:
+                await update.message.reply_text(text, reply_markup=main_menu_keyboard(user_id))
+            else:
+                await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard(user_id))
+            return ConversationHandler.END
 
+        acc = await session.get(Account, acc_id)
         if "new_mmr" in context.user_data:
             acc.mmr = context.user_data["new_mmr"]
         if "new_behavior" in context.user_data:
@@ -739,7 +817,8 @@ async def finalize_return(update: Update, context: CallbackContext):
             action_date=datetime.now(timezone.utc)
         ))
 
-        session.commit()
+        await session.commit()
+        inventory.mark_free(acc.id, mmr=acc.mmr, behavior=acc.behavior)
 
         text = f"Аккаунт ID {acc.id} успешно возвращён!"
         if update.message:
@@ -747,7 +826,6 @@ async def finalize_return(update: Update, context: CallbackContext):
         else:
             await update.callback_query.edit_message_text(text, reply_markup=main_menu_keyboard(user_id))
     finally:
-        session.close()
         context.user_data.clear()
     return ConversationHandler.END
 
@@ -768,44 +846,48 @@ async def return_select_fields(update: Update, context: CallbackContext):
 
 
 # --- Админ: Показать новых пользователей ---
-async def show_pending_users_handler(update: Update, context: CallbackContext):
+async def show_pending_users_handler(update: Update, context: CallbackContext, answer=True):
     user_id = update.effective_user.id
-    is_valid = await check_user_is_approved_and_admin(update)
+    is_valid = await check_user_is_approved_and_admin(update, context)
     if not is_valid:
         return ConversationHandler.END
-    session = Session()
-    try:
-        pending_users = session.query(User).filter_by(is_approved=False).all()
-
-        if not pending_users:
-            text = "🟢 <b>Нет новых пользователей, ожидающих подтверждения.</b>"
-            await update.callback_query.edit_message_text(
-                text, reply_markup=main_menu_keyboard(user_id), parse_mode="HTML"
-            )
-            return
+    if answer:
+        await update.callback_query.answer()
+    session = context.db_session
+    # Постранично, сначала давно ждущие; кнопки — только для пользователей на странице.
+    # Курсор приходит и от листания, и от кнопок действий — тогда показываем ту же страницу
+    cursor, backward = parse_page_callback(update.callback_query.data)
+    page = await fetch_users_page(session, cursor, backward, pending=True)
+    suffix = page_callback(cursor, backward)
+
+    if not page.items:
+        text = "🟢 <b>Нет новых пользователей, ожидающих подтверждения.</b>"
+        await update.callback_query.edit_message_text(
+            text, reply_markup=main_menu_keyboard(user_id), parse_mode="HTML"
+        )
+        return
 
-        text = "🕓 <b>Новые пользователи, ожидающие подтверждения:</b>\n\n"
-        buttons = []
+    text = "🕓 <b>Новые пользователи, ожидающие подтверждения:</b>\n\n"
+    buttons = []
 
-        for u in pending_users:
-            uname = f"@{u.username}" if u.username else "<i>(нет username)</i>"
-            text += (
-                f"👤 <b>ID:</b> <code>{u.telegram_id}</code>\n"
-                f"   <b>Username:</b> {uname}\n\n"
-            )
-            buttons.append([
-                InlineKeyboardButton("✅ Подтвердить", callback_data=f"approve_user_{u.telegram_id}"),
-                InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_user_{u.telegram_id}"),
-            ])
+    for u in page.items:
+        uname = f"@{html.escape(u.username)}" if u.username else "<i>(нет username)</i>"
+        text += (
+            f"👤 <b>ID:</b> <code>{u.telegram_id}</code>\n"
+            f"   <b>Username:</b> {uname}\n\n"
+        )
+        buttons.append([
+            InlineKeyboardButton("✅ Подтвердить", callback_data=f"approve_user_{u.telegram_id}{suffix}"),
+            InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_user_{u.telegram_id}{suffix}"),
+        ])
 
-        buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")])
+    buttons += page_buttons("users_pending", page)
+    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")])
 
-        await update.callback_query.edit_message_text(
-            text, reply_markup=InlineKeyboardMarkup(buttons), parse_mode="HTML"
-        )
+    await update.callback_query.edit_message_text(
+        text, reply_markup=InlineKeyboardMarkup(buttons), parse_mode="HTML"
+    )
 
-    finally:
-        session.close()
 
 # --- Обработка callback от админских кнопок ---
 async def admin_approve_reject_handler(update: Update, context: CallbackContext):
@@ -813,23 +895,24 @@ async def admin_approve_reject_handler(update: Update, context: CallbackContext)
     user_id = query.from_user.id
     data = query.data
 
-    is_valid = await check_user_is_approved_and_admin(update)
+    is_valid = await check_user_is_approved_and_admin(update, context)
     if not is_valid:
         return ConversationHandler.END
 
-    session = Session()
+    session = context.db_session
     try:
         # --- Подтверждение пользователя ---
         if data.startswith("approve_user_"):
-            target_id = int(data.split("_")[-1])
-            user = session.query(User).filter_by(telegram_id=target_id).first()
+            target_id = int(data.split("_")[2])
+            user = await session.get(User, target_id)
             if user:
                 if user.is_approved:
                     await query.answer("Пользователь уже подтверждён", show_alert=True)
                     return ConversationHandler.END
 
                 user.is_approved = True
-                session.commit()
+                await session.commit()
+                auth_cache.put(target_id, True, is_admin(target_id))
                 await query.answer("Пользователь одобрен")
 
                 try:
@@ -846,14 +929,15 @@ async def admin_approve_reject_handler(update: Update, context: CallbackContext)
 
         # --- Отклонение пользователя ---
         elif data.startswith("reject_user_"):
-            target_id = int(data.split("_")[-1])
-            user = session.query(User).filter_by(telegram_id=target_id).first()
+            target_id = int(data.split("_")[2])
+            user = await session.get(User, target_id)
             if user:
                 if is_admin(target_id):
                     await query.answer("Нельзя отклонить администратора!", show_alert=True)
                     return ConversationHandler.END
                 user.is_approved = False
-                session.commit()
+                await session.commit()
+                auth_cache.invalidate(target_id)
                 await query.answer("Пользователь отклонён")
                 try:
                     await context.application.bot.send_message(
@@ -868,7 +952,7 @@ async def admin_approve_reject_handler(update: Update, context: CallbackContext)
 
         # --- Удаление пользователя ---
         elif data.startswith("delete_user_"):
-            target_id = int(data.split("_")[-1])
+            target_id = int(data.split("_")[2])
 
             if target_id == user_id:
                 await query.answer("Вы не можете удалить самого себя!", show_alert=True)
@@ -878,18 +962,18 @@ async def admin_approve_reject_handler(update: Update, context: CallbackContext)
                 await query.answer("Нельзя удалить другого администратора!", show_alert=True)
                 return ConversationHandler.END
 
-            user = session.query(User).filter_by(telegram_id=target_id).first()
+            user = await session.get(User, target_id)
             if user:
                 # Возвращаем все арендованные аккаунты пользователя в пул
-                rented_accs = session.query(Account).filter_by(renter_id=target_id, status="rented").all()
-                for acc in rented_accs:
-                    acc.status = "free"
-                    acc.renter_id = None
-                    acc.rented_at = None
-                    acc.rent_duration = None
-
-                session.delete(user)
-                session.commit()
+                released = await end_rentals(session, Rental.user_id == target_id, "user_deleted")
+
+                await session.delete(user)
+                await session.commit()
+                auth_cache.invalidate(target_id)
+                mail_watcher.cancel(target_id)
+                for account_id, _ in released:
+                    rental_expiry.cancel(account_id)
+                    inventory.mark_free(account_id)
                 await query.answer("Пользователь удалён и его аккаунты возвращены в пул.")
             else:
                 await query.answer("Пользователь не найден", show_alert=True)
@@ -906,6 +990,7 @@ async def admin_approve_reject_handler(update: Update, context: CallbackContext)
 
         # --- Назад в главное меню ---
         elif data == "admin_back":
+            await query.answer()
             await query.edit_message_text("Главное меню", reply_markup=main_menu_keyboard(user_id))
             return ConversationHandler.END
 
@@ -921,120 +1006,159 @@ async def admin_approve_reject_handler(update: Update, context: CallbackContext)
         logging.error(f"Ошибка в admin_approve_reject_handler: {e}")
         await query.answer("Произошла ошибка. Попробуйте позже.", show_alert=True)
 
-    finally:
-        session.close()
 
-    # После действия показываем обновлённый список новых пользователей
-    if data.startswith(("approve_user_", "reject_user_", "delete_user_")):
-        await show_pending_users_handler(update, context)
+    # После действия показываем обновлённую страницу списка, на которой был админ;
+    # на callback уже ответили выше
+    if data.startswith(("approve_user_", "reject_user_")):
+        await show_pending_users_handler(update, context, answer=False)
+    elif data.startswith("delete_user_"):
+        await show_all_users_handler(update, context, answer=False)
 
 
 # --- Админ: показать всех пользователей ---
-from datetime import datetime
+def users_table(users, page_suffix=""):
+    """Таблица пользователей и кнопки удаления для них (по 3 в ряд); page_suffix — курсор страницы списка."""
+    # Ширина колонок
+    ID_WIDTH = 20
+    USERNAME_WIDTH = 20
+    ROLE_WIDTH = 12
+    DATE_WIDTH = 12
+    STATUS_WIDTH = 4
+
+    header = (
+        f"{'ID'.ljust(ID_WIDTH)}"
+        f"{'Username'.ljust(USERNAME_WIDTH)}"
+        f"{'Роль'.ljust(ROLE_WIDTH)}"
+        f"{'Регистрация'.ljust(DATE_WIDTH)}"
+        f"{'Статус'.rjust(STATUS_WIDTH)}\n"
+    )
+
+    rows = ""
+    for u in users:
+        id_str = str(u.telegram_id).ljust(ID_WIDTH)
+
+        # Если username есть — выводим @username, иначе id
+        uname = f"@{u.username}" if u.username else str(u.telegram_id)
+        if len(uname) > USERNAME_WIDTH - 3:
+            uname = uname[:USERNAME_WIDTH - 3] + "..."
+        uname_str = uname.ljust(USERNAME_WIDTH)
+
+        role = "Админ" if is_admin(u.telegram_id) else "Польз"
+        role_str = role.ljust(ROLE_WIDTH)
+        date_str = u.registered_at.strftime("%d.%m.%Y").ljust(DATE_WIDTH)
+
+        approved = "✅" if u.is_approved else "❌"
+        status_str = approved.rjust(STATUS_WIDTH)
+
+        rows += f"{id_str}{uname_str}{role_str}{date_str}{status_str}\n"
+
+    # Кнопки удаления — username или id, с обрезкой
+    buttons = []
+    row_buttons = []
+    for u in users:
+        btn_name = f"@{u.username}" if u.username else str(u.telegram_id)
+        if len(btn_name) > 20:
+            btn_name = btn_name[:17] + "..."
+        btn = InlineKeyboardButton(
+            f"🗑 {btn_name}",
+            callback_data=f"delete_user_{u.telegram_id}{page_suffix}"
+        )
+        row_buttons.append(btn)
+        if len(row_buttons) == 3:
+            buttons.append(row_buttons)
+            row_buttons = []
+    if row_buttons:
+        buttons.append(row_buttons)
+
+    return f"<pre>{html.escape(header + rows)}</pre>", buttons
+
 
-async def show_all_users_handler(update: Update, context: CallbackContext):
+async def show_all_users_handler(update: Update, context: CallbackContext, answer=True):
     user_id = update.effective_user.id
 
-    is_valid = await check_user_is_approved_and_admin(update)
+    is_valid = await check_user_is_approved_and_admin(update, context)
     if not is_valid:
         return ConversationHandler.END
+    if answer:
+        await update.callback_query.answer()
 
-    session = Session()
-    try:
-        users = session.query(User).all()
-        if not users:
-            text = "📭 <b>Пользователей нет.</b>"
-            await update.callback_query.edit_message_text(
-                text, reply_markup=main_menu_keyboard(user_id), parse_mode="HTML"
-            )
-            return
-
-        users_with_role = []
-        for u in users:
-            role = "Админ" if is_admin(u.telegram_id) else "Польз"
-            users_with_role.append((u, role))
-
-        users_sorted = sorted(
-            users_with_role,
-            key=lambda x: (
-                0 if x[1] == "Админ" else 1,
-                x[0].registered_at if hasattr(x[0], "registered_at") and x[0].registered_at else datetime.min
-            ),
-            reverse=True
+    session = context.db_session
+    # Постранично, сначала новые; кнопки удаления — только для пользователей на странице
+    cursor, backward = parse_page_callback(update.callback_query.data)
+    page = await fetch_users_page(session, cursor, backward)
+    if not page.items:
+        text = "📭 <b>Пользователей нет.</b>"
+        await update.callback_query.edit_message_text(
+            text, reply_markup=main_menu_keyboard(user_id), parse_mode="HTML"
         )
+        return
 
-        # Ширина колонок
-        ID_WIDTH = 20
-        USERNAME_WIDTH = 20
-        ROLE_WIDTH = 12
-        DATE_WIDTH = 12
-        STATUS_WIDTH = 4
-
-        header = (
-            f"{'ID'.ljust(ID_WIDTH)}"
-            f"{'Username'.ljust(USERNAME_WIDTH)}"
-            f"{'Роль'.ljust(ROLE_WIDTH)}"
-            f"{'Регистрация'.ljust(DATE_WIDTH)}"
-            f"{'Статус'.rjust(STATUS_WIDTH)}\n"
-        )
-        header = "<pre>" + header + "</pre>"
+    table, buttons = users_table(page.items, page_callback(cursor, backward))
+    text = f"👥 <b>Список всех пользователей:</b>\n\n{table}"
 
-        rows = ""
-        for u, role in users_sorted:
-            id_str = str(u.telegram_id).ljust(ID_WIDTH)
+    buttons += page_buttons("users_all", page)
+    buttons.append([InlineKeyboardButton("🔍 Поиск", callback_data="users_search")])
+    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")])
 
-            # Если username есть — выводим @username, иначе id
-            uname = f"@{u.username}" if u.username else str(u.telegram_id)
-            if len(uname) > USERNAME_WIDTH - 3:
-                uname = uname[:USERNAME_WIDTH - 3] + "..."
-            uname_str = uname.ljust(USERNAME_WIDTH)
+    await update.callback_query.edit_message_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(buttons),
+        parse_mode="HTML"
+    )
 
-            role_str = role.ljust(ROLE_WIDTH)
-            if hasattr(u, "registered_at") and isinstance(u.registered_at, datetime):
-                date_str = u.registered_at.strftime("%d.%m.%Y").ljust(DATE_WIDTH)
-            else:
-                date_str = "(нет)".ljust(DATE_WIDTH)
-
-            approved = "✅" if u.is_approved else "❌"
-            status_str = approved.rjust(STATUS_WIDTH)
-
-            row = f"{id_str}{uname_str}{role_str}{date_str}{status_str}\n"
-            rows += row
-
-        text = f"👥 <b>Список всех пользователей:</b>\n\n<pre>{header}{rows}</pre>"
-
-        # Кнопки удаления — username или id, с обрезкой
-        buttons = []
-        row_buttons = []
-        for _, (u, _) in enumerate(users_sorted):
-            btn_name = f"@{u.username}" if u.username else str(u.telegram_id)
-            if len(btn_name) > 20:
-                btn_name = btn_name[:17] + "..."
-            btn = InlineKeyboardButton(
-                f"🗑 {btn_name}",
-                callback_data=f"delete_user_{u.telegram_id}"
-            )
-            row_buttons.append(btn)
-            if len(row_buttons) == 3:
-                buttons.append(row_buttons)
-                row_buttons = []
-        if row_buttons:
-            buttons.append(row_buttons)
 
-        buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")])
+# --- Админ: поиск пользователя по username или ID ---
+async def admin_user_search_start(update: Update, context: CallbackContext):
+    is_valid = await check_user_is_approved_and_admin(update, context)
+    if not is_valid:
+        return ConversationHandler.END
+    await update.callback_query.answer()
+    await update.callback_query.edit_message_text(
+        "🔍 Введите Telegram ID или начало username:",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data="show_all_users")]])
+    )
+    return ADMIN_USER_SEARCH
+
 
+async def admin_user_search_handler(update: Update, context: CallbackContext):
+    is_valid = await check_user_is_approved_and_admin(update, context)
+    if not is_valid:
+        return ConversationHandler.END
+
+    users = await search_users(context.db_session, update.message.text)
+    buttons = [
+        [InlineKeyboardButton("🔍 Новый поиск", callback_data="users_search")],
+        [InlineKeyboardButton("⬅️ Назад", callback_data="show_all_users")],
+    ]
+    if not users:
+        await update.message.reply_text("🤷 Пользователи не найдены.", reply_markup=InlineKeyboardMarkup(buttons))
+        return ConversationHandler.END
+
+    table, delete_buttons = users_table(users[:USERS_PAGE_SIZE])
+    text = f"🔍 <b>Найденные пользователи:</b>\n\n{table}"
+    if len(users) > USERS_PAGE_SIZE:
+        text += "\nПоказаны не все совпадения — уточните запрос."
+    await update.message.reply_text(
+        text, reply_markup=InlineKeyboardMarkup(delete_buttons + buttons), parse_mode="HTML"
+    )
+    return ConversationHandler.END
+
+
+async def admin_user_search_cancel(update: Update, context: CallbackContext):
+    if update.callback_query.data == "admin_back":
+        await update.callback_query.answer()
         await update.callback_query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(buttons),
-            parse_mode="HTML"
+            "Главное меню", reply_markup=main_menu_keyboard(update.effective_user.id)
         )
-    finally:
-        session.close()
+    else:
+        await show_all_users_handler(update, context)
+    return ConversationHandler.END
+
 
 # --- Добавление аккаунта (ConversationHandler) ---
 async def admin_add_start(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    is_valid = await check_user_is_approved_and_admin(update)
+    is_valid = await check_user_is_approved_and_admin(update, context)
     if not is_valid:
         return ConversationHandler.END
     await update.callback_query.edit_message_text("Введите логин нового аккаунта:")
@@ -1087,34 +1211,29 @@ async def admin_add_mmr_handler(update: Update, context: CallbackContext):
         await update.message.reply_text("MMR должен быть числом. Попробуйте снова:")
         return ADMIN_ADD_MMR
     mmr = int(mmr_text)
-    session = Session()
-    try:
-        new_acc = Account(
-            login=context.user_data['new_login'],
-            password=context.user_data['new_password'],
-            behavior=context.user_data['new_behavior'],
-            mmr=mmr,
-            calibration= context.user_data['new_calibration'],
-            status="free",
-            rented_at=None,
-            renter_id=None,
-            rent_duration=None
-        )
-        session.add(new_acc)
-        session.commit()
-        context.user_data["created_account_id"] = new_acc.id
-        await update.message.reply_text(
-            f"Аккаунт успешно добавлен:\nID {new_acc.id}, MMR {new_acc.mmr}",
-            reply_markup=main_menu_keyboard(update.effective_user.id)
-        )
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Да", callback_data="2fa_yes"),
-             InlineKeyboardButton("❌ Нет", callback_data="2fa_no")]
-        ])
-        await update.message.reply_text("У аккаунта включена двухфакторная авторизация?", reply_markup=keyboard)
-        return ADMIN_ADD_2FA_ASK
-    finally:
-        session.close()
+    session = context.db_session
+    new_acc = Account(
+        login=context.user_data['new_login'],
+        password=context.user_data['new_password'],
+        behavior=context.user_data['new_behavior'],
+        mmr=mmr,
+        calibration= context.user_data['new_calibration'],
+        status="free"
+    )
+    session.add(new_acc)
+    await session.commit()
+    inventory.upsert(new_acc)
+    context.user_data["created_account_id"] = new_acc.id
+    await update.message.reply_text(
+        f"Аккаунт успешно добавлен:\nID {new_acc.id}, MMR {new_acc.mmr}",
+        reply_markup=main_menu_keyboard(update.effective_user.id)
+    )
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("✅ Да", callback_data="2fa_yes"),
+         InlineKeyboardButton("❌ Нет", callback_data="2fa_no")]
+    ])
+    await update.message.reply_text("У аккаунта включена двухфакторная авторизация?", reply_markup=keyboard)
+    return ADMIN_ADD_2FA_ASK
 
 async def admin_add_ask_2fa_handler(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -1147,15 +1266,12 @@ async def admin_add_email_password_handler(update: Update, context: CallbackCont
         await update.message.reply_text("Ошибка: ID аккаунта не найден.")
         return ConversationHandler.END
 
-    session = Session()
-    try:
-        new_email = Email(login=email_login, password=email_password, accountfk=account_id)
-        session.add(new_email)
-        session.commit()
-        await update.message.reply_text("Почта успешно добавлена к аккаунту.",
-                                        reply_markup=main_menu_keyboard(update.effective_user.id))
-    finally:
-        session.close()
+    session = context.db_session
+    new_email = Email(login=email_login, password=email_password, accountfk=account_id)
+    session.add(new_email)
+    await session.commit()
+    await update.message.reply_text("Почта успешно добавлена к аккаунту.",
+                                    reply_markup=main_menu_keyboard(update.effective_user.id))
 
     return ConversationHandler.END
 
@@ -1167,79 +1283,78 @@ async def admin_add_cancel(update: Update, context: CallbackContext):
 # --- Редактирование аккаунта (ConversationHandler) ---
 async def admin_edit_start(update: Update, context: CallbackContext):
 
-    is_valid = await check_user_is_approved_and_admin(update)
+    is_valid = await check_user_is_approved_and_admin(update, context)
     if not is_valid:
         return ConversationHandler.END
 
-    session = Session()
-    try:
-        # Запрос с сортировкой по возрастанию id
-        accounts = session.query(Account).order_by(Account.id).all()
-
-        if not accounts:
-            await update.callback_query.edit_message_text(
-                "📭 <b>Аккаунтов нет.</b>",
-                parse_mode="HTML",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")]])
-            )
-            return ConversationHandler.END
+    session = context.db_session
+    cursor, backward = parse_page_callback(update.callback_query.data)
+    page = await fetch_accounts_page(session, cursor, backward)
+    accounts = page.items
 
-        # Настройка ширины колонок
-        ID_WIDTH = 6
-        LOGIN_WIDTH = 20
-        MMR_WIDTH = 6
-        STATUS_WIDTH = 12
-
-        header = (
-            f"{'ID'.ljust(ID_WIDTH)}"
-            f"{'Login'.ljust(LOGIN_WIDTH)}"
-            f"{'MMR'.ljust(MMR_WIDTH)}"
-            f"{'Статус'.ljust(STATUS_WIDTH)}\n"
+    if not accounts:
+        await update.callback_query.edit_message_text(
+            "📭 <b>Аккаунтов нет.</b>",
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")]])
         )
-        header = "<pre>" + header + "</pre>"
-
-        rows = ""
-        for acc in accounts:
-            id_str = str(acc.id).ljust(ID_WIDTH)
-            login = acc.login if acc.login else "(нет)"
-            if len(login) > LOGIN_WIDTH - 3:
-                login = login[:LOGIN_WIDTH - 3] + "..."
-            login_str = login.ljust(LOGIN_WIDTH)
-
-            mmr_str = str(acc.mmr).ljust(MMR_WIDTH)
-            status = acc.status if acc.status else "(нет)"
-            if len(status) > STATUS_WIDTH - 3:
-                status = status[:STATUS_WIDTH - 3] + "..."
-            status_str = status.ljust(STATUS_WIDTH)
-
-            rows += f"{id_str}{login_str}{mmr_str}{status_str}\n"
-
-        text = f"📝 <b>Список аккаунтов для редактирования:</b>\n\n<pre>{header}{rows}</pre>"
-
-        # Кнопки с ID аккаунта по 3 в ряд
-        buttons = []
-        row_buttons = []
-        for acc in accounts:
-            btn = InlineKeyboardButton(
-                f"ID {acc.id}",
-                callback_data=f"edit_acc_{acc.id}"
-            )
-            row_buttons.append(btn)
-            if len(row_buttons) == 3:
-                buttons.append(row_buttons)
-                row_buttons = []
-        if row_buttons:
+        return ConversationHandler.END
+
+    # Настройка ширины колонок
+    ID_WIDTH = 6
+    LOGIN_WIDTH = 20
+    MMR_WIDTH = 6
+    STATUS_WIDTH = 12
+
+    header = (
+        f"{'ID'.ljust(ID_WIDTH)}"
+        f"{'Login'.ljust(LOGIN_WIDTH)}"
+        f"{'MMR'.ljust(MMR_WIDTH)}"
+        f"{'Статус'.ljust(STATUS_WIDTH)}\n"
+    )
+    header = "<pre>" + header + "</pre>"
+
+    rows = ""
+    for acc in accounts:
+        id_str = str(acc.id).ljust(ID_WIDTH)
+        login = acc.login if acc.login else "(нет)"
+        if len(login) > LOGIN_WIDTH - 3:
+            login = login[:LOGIN_WIDTH - 3] + "..."
+        login_str = login.ljust(LOGIN_WIDTH)
+
+        mmr_str = str(acc.mmr).ljust(MMR_WIDTH)
+        status = acc.status if acc.status else "(нет)"
+        if len(status) > STATUS_WIDTH - 3:
+            status = status[:STATUS_WIDTH - 3] + "..."
+        status_str = status.ljust(STATUS_WIDTH)
+
+        rows += f"{id_str}{login_str}{mmr_str}{status_str}\n"
+
+    text = f"📝 <b>Список аккаунтов для редактирования:</b>\n\n<pre>{header}{rows}</pre>"
+
+    # Кнопки с ID аккаунта по 3 в ряд
+    buttons = []
+    row_buttons = []
+    for acc in accounts:
+        btn = InlineKeyboardButton(
+            f"ID {acc.id}",
+            callback_data=f"edit_acc_{acc.id}"
+        )
+        row_buttons.append(btn)
+        if len(row_buttons) == 3:
             buttons.append(row_buttons)
+            row_buttons = []
+    if row_buttons:
+        buttons.append(row_buttons)
 
-        buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")])
+    buttons += page_buttons("admin_edit", page)
+    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="admin_back")])
 
-        await update.callback_query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(buttons),
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    await update.callback_query.edit_message_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(buttons),
+        parse_mode="HTML"
+    )
 
     return ADMIN_EDIT_CHOOSE_ID
 
@@ -1250,42 +1365,40 @@ async def admin_edit_choose_id(update: Update, context: CallbackContext):
     acc_id = int(data.split("_")[-1])
     context.user_data['edit_acc_id'] = acc_id
 
-    session = Session()
-    try:
-        acc = session.query(Account).get(acc_id)
-        if not acc:
-            await query.edit_message_text("❌ Аккаунт не найден.")
-            return ConversationHandler.END
-
-        # Получаем связанную почту (если есть)
-        email_obj = session.query(Email).filter_by(accountfk=acc.id).first()
-        email_info = email_obj.login if email_obj else "(нет)"
+    session = context.db_session
+    acc = await session.get(Account, acc_id, options=[selectinload(Account.emails)])
+    if not acc:
+        await query.edit_message_text("❌ Аккаунт не найден.")
+        return ConversationHandler.END
 
-        # Формируем строку с информацией по аккаунту
-        text = (
-            f"🆔 <b>ID:</b> {acc.id}\n"
-            f"👤 <b>Логин:</b> {acc.login or '(нет)'}\n"
-            f"🔑 <b>Пароль:</b> {acc.password or '(нет)'}\n"
-            f"📈 <b>MMR:</b> {acc.mmr if acc.mmr is not None else '(нет)'}\n"
-            f"🧠 <b>Поведение (Behavior):</b> {acc.behavior if acc.behavior is not None else '(нет)'}\n"
-            f"🎯 <b>Калибровка:</b> {'✅ Да' if getattr(acc, 'calibration', False) else '❌ Нет'}\n"
-            f"📧 <b>Почта (2FA):</b> {email_info}\n"
-        )
+    email_obj = acc.emails[0] if acc.emails else None
+    email_info = email_obj.login if email_obj else "(нет)"
+
+    # Формируем строку с информацией по аккаунту
+    text = (
+        f"🆔 <b>ID:</b> {acc.id}\n"
+        f"👤 <b>Логин:</b> {acc.login or '(нет)'}\n"
+        f"🔑 <b>Пароль:</b> {acc.password or '(нет)'}\n"
+        f"📈 <b>MMR:</b> {acc.mmr if acc.mmr is not None else '(нет)'}\n"
+        f"🧠 <b>Поведение (Behavior):</b> {acc.behavior if acc.behavior is not None else '(нет)'}\n"
+        f"🎯 <b>Калибровка:</b> {'✅ Да' if getattr(acc, 'calibration', False) else '❌ Нет'}\n"
+        f"📧 <b>Почта (2FA):</b> {email_info}\n"
+        f"🔐 <b>Steam Guard secret:</b> {'✅ Задан' if acc.steam_shared_secret else '(нет)'}\n"
+    )
 
-        buttons = [
-            [InlineKeyboardButton("Логин", callback_data="edit_field_login")],
-            [InlineKeyboardButton("Пароль", callback_data="edit_field_password")],
-            [InlineKeyboardButton("MMR", callback_data="edit_field_mmr")],
-            [InlineKeyboardButton("Behavior", callback_data="edit_field_behavior")],
-            [InlineKeyboardButton("Калибровка", callback_data="edit_field_calibration")],
-            [InlineKeyboardButton("Почта (2FA)", callback_data="edit_field_email")],
-            [InlineKeyboardButton("Отмена", callback_data="admin_back")]
-        ]
+    buttons = [
+        [InlineKeyboardButton("Логин", callback_data="edit_field_login")],
+        [InlineKeyboardButton("Пароль", callback_data="edit_field_password")],
+        [InlineKeyboardButton("MMR", callback_data="edit_field_mmr")],
+        [InlineKeyboardButton("Behavior", callback_data="edit_field_behavior")],
+        [InlineKeyboardButton("Калибровка", callback_data="edit_field_calibration")],
+        [InlineKeyboardButton("Почта (2FA)", callback_data="edit_field_email")],
+        [InlineKeyboardButton("Steam Guard secret", callback_data="edit_field_steam_shared_secret")],
+        [InlineKeyboardButton("Отмена", callback_data="admin_back")]
+    ]
 
-        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons), parse_mode="HTML")
-        return ADMIN_EDIT_CHOOSE_FIELD
-    finally:
-        session.close()
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(buttons), parse_mode="HTML")
+    return ADMIN_EDIT_CHOOSE_FIELD
 
 async def admin_edit_choose_field(update: Update, context: CallbackContext):
     query = update.callback_query
@@ -1294,24 +1407,21 @@ async def admin_edit_choose_field(update: Update, context: CallbackContext):
 
     if field == "email":
         acc_id = context.user_data['edit_acc_id']
-        session = Session()
-        try:
-            email = session.query(Email).filter_by(accountfk=acc_id).first()
-            if email:
-                buttons = [
-                    [InlineKeyboardButton("Изменить логин", callback_data="email_edit_login")],
-                    [InlineKeyboardButton("Изменить пароль", callback_data="email_edit_password")],
-                    [InlineKeyboardButton("Отмена", callback_data="admin_back")]
-                ]
-                await query.edit_message_text("Выберите, что изменить в почте:", reply_markup=InlineKeyboardMarkup(buttons))
-            else:
-                buttons = [
-                    [InlineKeyboardButton("Добавить почту", callback_data="email_add_new")],
-                    [InlineKeyboardButton("Отмена", callback_data="admin_back")]
-                ]
-                await query.edit_message_text("Почта не найдена. Добавить новую?", reply_markup=InlineKeyboardMarkup(buttons))
-        finally:
-            session.close()
+        session = context.db_session
+        email = await session.scalar(select(Email).filter_by(accountfk=acc_id).limit(1))
+        if email:
+            buttons = [
+                [InlineKeyboardButton("Изменить логин", callback_data="email_edit_login")],
+                [InlineKeyboardButton("Изменить пароль", callback_data="email_edit_password")],
+                [InlineKeyboardButton("Отмена", callback_data="admin_back")]
+            ]
+            await query.edit_message_text("Выберите, что изменить в почте:", reply_markup=InlineKeyboardMarkup(buttons))
+        else:
+            buttons = [
+                [InlineKeyboardButton("Добавить почту", callback_data="email_add_new")],
+                [InlineKeyboardButton("Отмена", callback_data="admin_back")]
+            ]
+            await query.edit_message_text("Почта не найдена. Добавить новую?", reply_markup=InlineKeyboardMarkup(buttons))
         return ADMIN_EDIT_EMAIL_CHOOSE_FIELD
 
     await query.edit_message_text(f"Введите новое значение для поля {get_field_display_name(field)}:")
@@ -1336,6 +1446,7 @@ def get_field_display_name(field_name: str) -> str:
         "last_name": "Фамилия",
         "is_approved": "Подтверждён",
         "registered_at": "Дата регистрации",
+        "steam_shared_secret": "Steam Guard shared_secret (\"-\" — удалить)",
     }
     return field_map.get(field_name, field_name)
 
@@ -1366,53 +1477,59 @@ async def admin_edit_new_value(update: Update, context: CallbackContext):
     field = context.user_data.get('edit_field')
     email_mode = context.user_data.get('email_edit_field')
 
-    session = Session()
-    try:
-        acc = session.query(Account).filter_by(id=acc_id).first()
-        if not acc:
-            await update.message.reply_text("Аккаунт не найден.", reply_markup=main_menu_keyboard(user_id))
-            return ConversationHandler.END
-
-        if field == "email":
-            email = session.query(Email).filter_by(accountfk=acc_id).first()
-
-            if email_mode == 'new':
-                if ":" not in text:
-                    await update.message.reply_text("Неверный формат. Используйте: `login:password`")
-                    return ADMIN_EDIT_NEW_VALUE
-                login, password = map(str.strip, text.split(":", 1))
-                new_email = Email(login=login, password=password, accountfk=acc_id)
-                session.add(new_email)
-            elif email_mode == 'login':
-                if not email:
-                    await update.message.reply_text("Почта не найдена.")
-                    return ConversationHandler.END
-                email.login = text
-            elif email_mode == 'password':
-                if not email:
-                    await update.message.reply_text("Почта не найдена.")
-                    return ConversationHandler.END
-                email.password = text
+    session = context.db_session
+    acc = await session.get(Account, acc_id, options=[selectinload(Account.emails)])
+    if not acc:
+        await update.message.reply_text("Аккаунт не найден.", reply_markup=main_menu_keyboard(user_id))
+        return ConversationHandler.END
 
-            session.commit()
-            await update.message.reply_text("Почта успешно обновлена.", reply_markup=main_menu_keyboard(user_id))
-            return ConversationHandler.END
+    if field == "email":
+        email = acc.emails[0] if acc.emails else None
 
-        # Обновление обычного поля
-        if field in ("mmr", "behavior"):
-            if not text.isdigit():
-                await update.message.reply_text("Введите числовое значение:")
+        if email_mode == 'new':
+            if ":" not in text:
+                await update.message.reply_text("Неверный формат. Используйте: `login:password`")
                 return ADMIN_EDIT_NEW_VALUE
-            setattr(acc, field, int(text))
-        elif field == "calibration":
-            acc.calibration = text.lower() in ("да", "yes", "true", "1")
+            login, password = map(str.strip, text.split(":", 1))
+            new_email = Email(login=login, password=password, accountfk=acc_id)
+            session.add(new_email)
+        elif email_mode == 'login':
+            if not email:
+                await update.message.reply_text("Почта не найдена.")
+                return ConversationHandler.END
+            email.login = text
+        elif email_mode == 'password':
+            if not email:
+                await update.message.reply_text("Почта не найдена.")
+                return ConversationHandler.END
+            email.password = text
+
+        await session.commit()
+        await update.message.reply_text("Почта успешно обновлена.", reply_markup=main_menu_keyboard(user_id))
+        return ConversationHandler.END
+
+    # Обновление обычного поля
+    if field in ("mmr", "behavior"):
+        if not text.isdigit():
+            await update.message.reply_text("Введите числовое значение:")
+            return ADMIN_EDIT_NEW_VALUE
+        setattr(acc, field, int(text))
+    elif field == "steam_shared_secret":
+        if text == "-":
+            acc.steam_shared_secret = None
+        elif is_valid_shared_secret(text):
+            acc.steam_shared_secret = text
         else:
-            setattr(acc, field, text)
+            await update.message.reply_text("Некорректный shared_secret (ожидается base64 из maFile). Попробуйте снова:")
+            return ADMIN_EDIT_NEW_VALUE
+    elif field == "calibration":
+        acc.calibration = text.lower() in ("да", "yes", "true", "1")
+    else:
+        setattr(acc, field, text)
 
-        session.commit()
-        await update.message.reply_text("Аккаунт успешно обновлён.", reply_markup=main_menu_keyboard(user_id))
-    finally:
-        session.close()
+    await session.commit()
+    inventory.upsert(acc)
+    await update.message.reply_text("Аккаунт успешно обновлён.", reply_markup=main_menu_keyboard(user_id))
 
     return ConversationHandler.END
 
@@ -1442,90 +1559,90 @@ async def admin_delete_cancel(update: Update, context: CallbackContext):
 async def admin_delete_start(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
 
-    is_valid = await check_user_is_approved_and_admin(update)
+    is_valid = await check_user_is_approved_and_admin(update, context)
     if not is_valid:
         return ConversationHandler.END
 
-    session = Session()
-    try:
-        accounts = session.query(Account).order_by(Account.id).all()
-        if not accounts:
-            await update.callback_query.edit_message_text(
-                "📭 <b>Аккаунтов нет.</b>",
-                parse_mode="HTML",
-                reply_markup=main_menu_keyboard(user_id)
-            )
-            return ConversationHandler.END
-
-        # Ширина колонок подогнал под твои поля
-        ID_WIDTH = 6
-        LOGIN_WIDTH = 20
-        BEHAVIOR_WIDTH = 8
-        MMR_WIDTH = 6
-        STATUS_WIDTH = 12
-        RENTED_WIDTH = 8
-
-        header = (
-            f"{'ID'.ljust(ID_WIDTH)}"
-            f"{'Login'.ljust(LOGIN_WIDTH)}"
-            f"{'Behavior'.ljust(BEHAVIOR_WIDTH)}"
-            f"{'MMR'.ljust(MMR_WIDTH)}"
-            f"{'Статус'.ljust(STATUS_WIDTH)}"
-            f"{'Аренда'.ljust(RENTED_WIDTH)}\n"
+    session = context.db_session
+    cursor, backward = parse_page_callback(update.callback_query.data)
+    page = await fetch_accounts_page(session, cursor, backward)
+    accounts = page.items
+    if not accounts:
+        await update.callback_query.edit_message_text(
+            "📭 <b>Аккаунтов нет.</b>",
+            parse_mode="HTML",
+            reply_markup=main_menu_keyboard(user_id)
         )
-        header = "<pre>" + header + "</pre>"
+        return ConversationHandler.END
 
-        rows = ""
-        for acc in accounts:
-            id_str = str(acc.id).ljust(ID_WIDTH)
+    # Ширина колонок подогнал под твои поля
+    ID_WIDTH = 6
+    LOGIN_WIDTH = 20
+    BEHAVIOR_WIDTH = 8
+    MMR_WIDTH = 6
+    STATUS_WIDTH = 12
+    RENTED_WIDTH = 8
+
+    header = (
+        f"{'ID'.ljust(ID_WIDTH)}"
+        f"{'Login'.ljust(LOGIN_WIDTH)}"
+        f"{'Behavior'.ljust(BEHAVIOR_WIDTH)}"
+        f"{'MMR'.ljust(MMR_WIDTH)}"
+        f"{'Статус'.ljust(STATUS_WIDTH)}"
+        f"{'Аренда'.ljust(RENTED_WIDTH)}\n"
+    )
+    header = "<pre>" + header + "</pre>"
 
-            login = acc.login if acc.login else "(нет)"
-            if len(login) > LOGIN_WIDTH - 3:
-                login = login[:LOGIN_WIDTH - 3] + "..."
-            login_str = login.ljust(LOGIN_WIDTH)
+    rows = ""
+    for acc in accounts:
+        id_str = str(acc.id).ljust(ID_WIDTH)
 
-            behavior_str = str(acc.behavior) if acc.behavior is not None else "(нет)"
-            behavior_str = behavior_str.ljust(BEHAVIOR_WIDTH)
+        login = acc.login if acc.login else "(нет)"
+        if len(login) > LOGIN_WIDTH - 3:
+            login = login[:LOGIN_WIDTH - 3] + "..."
+        login_str = login.ljust(LOGIN_WIDTH)
 
-            mmr_str = str(acc.mmr) if acc.mmr is not None else "(нет)"
-            mmr_str = mmr_str.ljust(MMR_WIDTH)
+        behavior_str = str(acc.behavior) if acc.behavior is not None else "(нет)"
+        behavior_str = behavior_str.ljust(BEHAVIOR_WIDTH)
 
-            status = acc.status if acc.status else "(нет)"
-            if len(status) > STATUS_WIDTH - 3:
-                status = status[:STATUS_WIDTH - 3] + "..."
-            status_str = status.ljust(STATUS_WIDTH)
+        mmr_str = str(acc.mmr) if acc.mmr is not None else "(нет)"
+        mmr_str = mmr_str.ljust(MMR_WIDTH)
 
-            rented = "✅" if getattr(acc, "is_rented", False) else "❌"
-            rented_str = rented.ljust(RENTED_WIDTH)
+        status = acc.status if acc.status else "(нет)"
+        if len(status) > STATUS_WIDTH - 3:
+            status = status[:STATUS_WIDTH - 3] + "..."
+        status_str = status.ljust(STATUS_WIDTH)
 
-            rows += f"{id_str}{login_str}{behavior_str}{mmr_str}{status_str}{rented_str}\n"
+        rented = "✅" if getattr(acc, "is_rented", False) else "❌"
+        rented_str = rented.ljust(RENTED_WIDTH)
 
-        text = f"🗑️ <b>Выберите аккаунт для удаления:</b>\n\n<pre>{header}{rows}</pre>"
+        rows += f"{id_str}{login_str}{behavior_str}{mmr_str}{status_str}{rented_str}\n"
 
-        # Кнопки с ID аккаунта по 3 в ряд
-        buttons = []
-        row_buttons = []
-        for acc in accounts:
-            btn = InlineKeyboardButton(
-                f"ID {acc.id}",
-                callback_data=f"delete_acc_{acc.id}"
-            )
-            row_buttons.append(btn)
-            if len(row_buttons) == 3:
-                buttons.append(row_buttons)
-                row_buttons = []
-        if row_buttons:
+    text = f"🗑️ <b>Выберите аккаунт для удаления:</b>\n\n<pre>{header}{rows}</pre>"
+
+    # Кнопки с ID аккаунта по 3 в ряд
+    buttons = []
+    row_buttons = []
+    for acc in accounts:
+        btn = InlineKeyboardButton(
+            f"ID {acc.id}",
+            callback_data=f"delete_acc_{acc.id}"
+        )
+        row_buttons.append(btn)
+        if len(row_buttons) == 3:
             buttons.append(row_buttons)
+            row_buttons = []
+    if row_buttons:
+        buttons.append(row_buttons)
 
-        buttons.append([InlineKeyboardButton("Отмена", callback_data="admin_back")])
+    buttons += page_buttons("admin_delete", page)
+    buttons.append([InlineKeyboardButton("Отмена", callback_data="admin_back")])
 
-        await update.callback_query.edit_message_text(
-            text,
-            reply_markup=InlineKeyboardMarkup(buttons),
-            parse_mode="HTML"
-        )
-    finally:
-        session.close()
+    await update.callback_query.edit_message_text(
+        text,
+        reply_markup=InlineKeyboardMarkup(buttons),
+        parse_mode="HTML"
+    )
 
     return ADMIN_DELETE_CHOOSE_ID
 
@@ -1538,75 +1655,75 @@ async def admin_delete_choose_account(update: Update, context: CallbackContext):
         return ConversationHandler.END
 
     acc_id = int(query.data.split("_")[-1])
-    session = Session()
-
-    try:
-        acc = session.query(Account).filter_by(id=acc_id).first()
-        if not acc:
-            await query.answer("Аккаунт не найден", show_alert=True)
-            return ConversationHandler.END
+    session = context.db_session
 
-        # Удаляем связанные email'ы
-        email = session.query(Email).filter_by(accountfk=acc_id).first()
-        if email:
-            session.delete(email)
+    # Почты удаляются каскадом вместе с аккаунтом
+    acc = await session.get(Account, acc_id, options=[selectinload(Account.emails)])
+    if not acc:
+        await query.answer("Аккаунт не найден", show_alert=True)
+        return ConversationHandler.END
 
-        session.delete(acc)
-        session.commit()
+    await session.delete(acc)
+    await session.commit()
+    rental_expiry.cancel(acc_id)
+    mail_watcher.cancel_account(acc_id)
+    inventory.remove(acc_id)
 
-        await query.edit_message_text(f"Аккаунт ID {acc_id} удалён.", reply_markup=main_menu_keyboard(user_id))
-    finally:
-        session.close()
+    await query.edit_message_text(f"Аккаунт ID {acc_id} удалён.", reply_markup=main_menu_keyboard(user_id))
     return ConversationHandler.END
 
-# --- Автоматический возврат аккаунтов по времени ---
-def auto_return_accounts():
-    session = Session()
-    try:
-        now = datetime.now(timezone.utc)
-        rented = session.query(Account).filter(Account.status == "rented").all()
-        for acc in rented:
-            if acc.rented_at and acc.rent_duration:
-                rented_at = acc.rented_at
-                if rented_at.tzinfo is None:
-                    rented_at = rented_at.replace(tzinfo=timezone.utc)
-
-                end_time = rented_at + timedelta(minutes=acc.rent_duration)
-                if now >= end_time:
-                    logging.info(f"Автоматический возврат аккаунта ID {acc.id}, арендовал User {acc.renter_id}")
-
-                    # Добавляем лог в БД
-                    session.add(AccountLog(
-                        user_id=acc.renter_id,
-                        account_id=acc.id,
-                        action='Возврат аккаунта(Автоматический)',
-                        action_date=datetime.now(timezone.utc)
-                    ))
-
-                    # Освобождаем аккаунт
-                    acc.status = "free"
-                    acc.renter_id = None
-                    acc.rented_at = None
-                    acc.rent_duration = None
-        session.commit()
-    except Exception as e:
-        logging.error(f"Ошибка автоматического возврата аккаунтов: {e}", exc_info=True)
-    finally:
-        session.close()
+async def on_startup(application: Application):
+    await broadcast_jobs.resume(application)
+
+
+async def on_stop(application: Application):
+    # Application.stop() не ждёт задач ожидания кодов — снимаем их сразу после остановки
+    await mail_watcher.stop()
+
+
+async def on_shutdown(application: Application):
+    await broadcast_jobs.stop()
 
 
 # --- Основной запуск ---
 def main():
-    app = Application.builder().token(TOKEN).build()
-    scheduler.add_job(auto_return_accounts, 'interval', minutes=1)
+    upgrade_database()
+    app = (
+        Application.builder().token(TOKEN)
+        # Разные пользователи — параллельно, апдейты одного пользователя — по очереди
+        .application_class(OrderedApplication)
+        .concurrent_updates(UPDATES_IN_FLIGHT)
+        .post_init(on_startup).post_stop(on_stop).post_shutdown(on_shutdown)
+        .build()
+    )
+    register_unit_of_work(app)
+    mail_watcher.start(app)
+    inventory.load()
+    rental_expiry.rebuild()
+    scheduler.add_job(mail_sessions.keepalive, 'interval', seconds=min(IMAP_KEEPALIVE_SECONDS, IMAP_PREWARM_TTL))
     app.add_handler(CommandHandler("start", start))
 
+    # Раньше admin_approve_reject_handler: его шаблон тоже ловит show_all_users и admin_back,
+    # а выйти из поиска по этим кнопкам должен сам диалог
+    user_search_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(admin_user_search_start, pattern="^users_search$")],
+        states={
+            ADMIN_USER_SEARCH: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_user_search_handler)],
+        },
+        fallbacks=[
+            CallbackQueryHandler(admin_user_search_cancel, pattern="^(show_all_users|admin_back)$"),
+        ],
+        allow_reentry=True
+    )
+    app.add_handler(user_search_conv)
+
     app.add_handler(CallbackQueryHandler(
         admin_approve_reject_handler,
-        pattern=r"^(approve_user_\d+|reject_user_\d+|delete_user_\d+|show_pending_users|show_all_users|admin_back)$"
+        pattern=r"^((approve|reject|delete)_user_\d+(_page_[np]_-?\d+_\d+)?|show_pending_users|show_all_users|admin_back)$"
     ))
 
     app.add_handler(CallbackQueryHandler(list_accounts, pattern="^list$"))
+    app.add_handler(CallbackQueryHandler(list_accounts, pattern=page_pattern("list")))
     app.add_handler(CallbackQueryHandler(my, pattern="^my$"))
     app.add_handler(CallbackQueryHandler(whoami, pattern="^whoami$"))
     return_conv = ConversationHandler(
@@ -1627,7 +1744,8 @@ def main():
         ],
         states={
             USER_RENT_SELECT_ACCOUNT: [
-                CallbackQueryHandler(rent_select_account, pattern="^rent_acc_\\d+$")
+                CallbackQueryHandler(rent_select_account, pattern="^rent_acc_\\d+$"),
+                CallbackQueryHandler(rent_start, pattern=page_pattern("rent")),
             ],
             USER_RENT_SELECT_DURATION: [
                 CallbackQueryHandler(rent_select_duration, pattern="^rent_dur_\\d+$")
@@ -1645,6 +1763,9 @@ def main():
         allow_reentry=True
     )
     app.add_handler(rent_conv)
+    app.add_handler(CallbackQueryHandler(cancel_code_wait, pattern="^cancel_code_wait$"))
+    app.add_handler(CallbackQueryHandler(show_mail_health, pattern="^mail_health$"))
+    app.add_handler(CallbackQueryHandler(steam_guard_refresh, pattern="^steam_guard_code$"))
 
     add_acc_conv = ConversationHandler(
         entry_points=[CallbackQueryHandler(admin_add_start, pattern="^admin_add_start$")],
@@ -1669,6 +1790,7 @@ def main():
         states={
             ADMIN_EDIT_CHOOSE_ID: [
                 CallbackQueryHandler(admin_edit_choose_id, pattern="^edit_acc_\\d+$"),
+                CallbackQueryHandler(admin_edit_start, pattern=page_pattern("admin_edit")),
             ],
             ADMIN_EDIT_CHOOSE_FIELD: [
                 CallbackQueryHandler(admin_edit_choose_field, pattern="^edit_field_\\w+$")
@@ -1693,7 +1815,8 @@ def main():
         entry_points=[CallbackQueryHandler(admin_delete_start, pattern="^admin_delete_start$")],
         states={
             ADMIN_DELETE_CHOOSE_ID: [
-                CallbackQueryHandler(admin_delete_choose_account, pattern="^delete_acc_\\d+$")
+                CallbackQueryHandler(admin_delete_choose_account, pattern="^delete_acc_\\d+$"),
+                CallbackQueryHandler(admin_delete_start, pattern=page_pattern("admin_delete")),
             ]
         },
         fallbacks=[
@@ -1704,10 +1827,11 @@ def main():
     )
     app.add_handler(delete_acc_conv)
     app.add_handler(broadcast_conv)
-    app.add_handler(CallbackQueryHandler(show_all_users_handler, pattern="^show_all_users$"))
+    app.add_handler(CallbackQueryHandler(show_all_users_handler, pattern=page_pattern("users_all")))
+    app.add_handler(CallbackQueryHandler(show_pending_users_handler, pattern=page_pattern("users_pending")))
     app.add_handler(CallbackQueryHandler(lambda update, context: update.callback_query.answer(), pattern="^ignore_"))
     print("Бот запущен...")
-    app.run_polling()
+    asyncio.run(WebServer(app).run())
 
 if __name__ == '__main__':
     main()
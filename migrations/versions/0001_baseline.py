@@ -0,0 +1,70 @@
+"""Исходная схема (раньше создавалась через create_all при импорте models.py)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # В уже работающих базах таблицы есть — создаём только недостающие
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "accounts" not in existing:
+        op.create_table(
+            "accounts",
+            sa.Column("id", sa.BigInteger(), primary_key=True),
+            sa.Column("login", sa.String()),
+            sa.Column("password", sa.String()),
+            sa.Column("behavior", sa.Integer()),
+            sa.Column("mmr", sa.Integer()),
+            sa.Column("calibration", sa.Boolean()),
+            sa.Column("status", sa.String()),
+            sa.Column("rented_at", sa.DateTime(), nullable=True),
+            sa.Column("renter_id", sa.Integer(), nullable=True),
+            sa.Column("rent_duration", sa.Integer(), nullable=True),
+        )
+
+    if "emails" not in existing:
+        op.create_table(
+            "emails",
+            sa.Column("id", sa.BigInteger(), primary_key=True, autoincrement=True),
+            sa.Column("login", sa.String(), nullable=True),
+            sa.Column("password", sa.String(), nullable=True),
+            sa.Column("accountfk", sa.BigInteger(), sa.ForeignKey("accounts.id"), nullable=False),
+        )
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("telegram_id", sa.BigInteger(), primary_key=True),
+            sa.Column("username", sa.String(), nullable=True),
+            sa.Column("first_name", sa.String(), nullable=True),
+            sa.Column("last_name", sa.String(), nullable=True),
+            sa.Column("is_approved", sa.Boolean()),
+            sa.Column("registered_at", sa.DateTime()),
+        )
+
+    if "account_logs" not in existing:
+        op.create_table(
+            "account_logs",
+            sa.Column("id", sa.BigInteger(), primary_key=True, autoincrement=True),
+            sa.Column("user_id", sa.BigInteger(), nullable=False),
+            sa.Column("account_id", sa.BigInteger(), nullable=False),
+            sa.Column("action_date", sa.DateTime(timezone=True), nullable=False),
+            sa.Column("action", sa.String(), nullable=False),
+        )
+
+
+def downgrade():
+    op.drop_table("account_logs")
+    op.drop_table("users")
+    op.drop_table("emails")
+    op.drop_table("accounts")
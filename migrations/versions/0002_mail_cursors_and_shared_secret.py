@@ -0,0 +1,35 @@
+"""Курсоры IMAP-ящиков и shared_secret Steam Guard у аккаунтов
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if "mail_cursors" not in inspector.get_table_names():
+        op.create_table(
+            "mail_cursors",
+            sa.Column("email_id", sa.BigInteger(), sa.ForeignKey("emails.id", ondelete="CASCADE"), primary_key=True),
+            sa.Column("uid_validity", sa.BigInteger(), nullable=True),
+            sa.Column("last_uid", sa.BigInteger(), nullable=True),
+            sa.Column("updated_at", sa.DateTime(timezone=True), nullable=False),
+        )
+
+    account_columns = {column["name"] for column in inspector.get_columns("accounts")}
+    if "steam_shared_secret" not in account_columns:
+        op.add_column("accounts", sa.Column("steam_shared_secret", sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("accounts", "steam_shared_secret")
+    op.drop_table("mail_cursors")
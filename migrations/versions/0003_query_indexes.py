@@ -0,0 +1,58 @@
+"""Индексы под реальные запросы бота
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    duplicates = bind.execute(sa.text(
+        "SELECT accountfk FROM emails GROUP BY accountfk HAVING count(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(
+            "У аккаунтов несколько почт, уникальный индекс emails.accountfk создать нельзя. "
+            f"Оставьте по одной почте у аккаунтов: {', '.join(map(str, duplicates))}"
+        )
+
+    # Свободные аккаунты по MMR (выбор аккаунта для аренды)
+    op.create_index("ix_accounts_status_mmr", "accounts", ["status", sa.text("mmr DESC")])
+    # Общий список аккаунтов по MMR
+    op.create_index("ix_accounts_mmr", "accounts", [sa.text("mmr DESC")])
+    # Аренда пользователя и автоматический возврат просматривают только арендованные
+    op.create_index(
+        "ix_accounts_renter_rented", "accounts", ["renter_id"],
+        postgresql_where=sa.text("status = 'rented'")
+    )
+    op.create_index("uq_emails_accountfk", "emails", ["accountfk"], unique=True)
+    op.create_index("ix_account_logs_user_date", "account_logs", ["user_id", sa.text("action_date DESC")])
+    op.create_index("ix_account_logs_account_date", "account_logs", ["account_id", sa.text("action_date DESC")])
+    # Ожидающие подтверждения и получатели рассылки
+    op.create_index(
+        "ix_users_pending", "users", ["registered_at"],
+        postgresql_where=sa.text("NOT is_approved")
+    )
+    op.create_index(
+        "ix_users_approved", "users", ["telegram_id"],
+        postgresql_where=sa.text("is_approved")
+    )
+
+
+def downgrade():
+    op.drop_index("ix_users_approved", table_name="users")
+    op.drop_index("ix_users_pending", table_name="users")
+    op.drop_index("ix_account_logs_account_date", table_name="account_logs")
+    op.drop_index("ix_account_logs_user_date", table_name="account_logs")
+    op.drop_index("uq_emails_accountfk", table_name="emails")
+    op.drop_index("ix_accounts_renter_rented", table_name="accounts")
+    op.drop_index("ix_accounts_mmr", table_name="accounts")
+    op.drop_index("ix_accounts_status_mmr", table_name="accounts")
@@ -0,0 +1,77 @@
+"""Таблица аренд rentals вместо полей аренды в accounts
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "rentals",
+        sa.Column("id", sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column("account_id", sa.BigInteger(), sa.ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("ends_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("ended_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("ended_reason", sa.String(), nullable=True),
+    )
+    op.create_index(
+        "uq_rentals_active_account", "rentals", ["account_id"], unique=True,
+        postgresql_where=sa.text("ended_at IS NULL")
+    )
+    op.create_index(
+        "uq_rentals_active_user", "rentals", ["user_id"], unique=True,
+        postgresql_where=sa.text("ended_at IS NULL")
+    )
+    op.create_index("ix_rentals_ends_at", "rentals", ["ends_at"], postgresql_where=sa.text("ended_at IS NULL"))
+    op.create_index("ix_rentals_user_started", "rentals", ["user_id", sa.text("started_at DESC")])
+
+    # Текущие аренды переносим из accounts (время там хранится без зоны, по UTC).
+    # Если у пользователя несколько арендованных аккаунтов, активной остаётся последняя.
+    op.execute("""
+        INSERT INTO rentals (account_id, user_id, started_at, ends_at)
+        SELECT DISTINCT ON (renter_id)
+               id, renter_id,
+               rented_at AT TIME ZONE 'UTC',
+               (rented_at + rent_duration * interval '1 minute') AT TIME ZONE 'UTC'
+        FROM accounts
+        WHERE status = 'rented' AND renter_id IS NOT NULL
+          AND rented_at IS NOT NULL AND rent_duration IS NOT NULL
+        ORDER BY renter_id, rented_at DESC
+    """)
+    op.execute("""
+        UPDATE accounts SET status = 'free'
+        WHERE status = 'rented'
+          AND NOT EXISTS (SELECT 1 FROM rentals WHERE rentals.account_id = accounts.id)
+    """)
+    op.execute("UPDATE accounts SET renter_id = NULL, rented_at = NULL, rent_duration = NULL")
+    op.drop_index("ix_accounts_renter_rented", table_name="accounts")
+
+
+def downgrade():
+    op.create_index(
+        "ix_accounts_renter_rented", "accounts", ["renter_id"],
+        postgresql_where=sa.text("status = 'rented'")
+    )
+    op.execute("""
+        UPDATE accounts
+        SET renter_id = rentals.user_id,
+            rented_at = rentals.started_at AT TIME ZONE 'UTC',
+            rent_duration = (extract(epoch FROM rentals.ends_at - rentals.started_at) / 60)::int
+        FROM rentals
+        WHERE rentals.account_id = accounts.id AND rentals.ended_at IS NULL
+    """)
+    op.drop_index("ix_rentals_user_started", table_name="rentals")
+    op.drop_index("ix_rentals_ends_at", table_name="rentals")
+    op.drop_index("uq_rentals_active_user", table_name="rentals")
+    op.drop_index("uq_rentals_active_account", table_name="rentals")
+    op.drop_table("rentals")
@@ -0,0 +1,24 @@
+"""Индекс под постраничные списки аккаунтов
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Keyset-страницы: ORDER BY coalesce(mmr, 0) DESC, id с условием по курсору (MMR, ID)
+    op.create_index("ix_accounts_mmr_id", "accounts", [sa.text("coalesce(mmr, 0) DESC"), "id"])
+    op.drop_index("ix_accounts_mmr", table_name="accounts")
+
+
+def downgrade():
+    op.create_index("ix_accounts_mmr", "accounts", [sa.text("mmr DESC")])
+    op.drop_index("ix_accounts_mmr_id", table_name="accounts")
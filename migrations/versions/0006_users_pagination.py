@@ -0,0 +1,38 @@
+"""Индексы под постраничные списки и поиск пользователей
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Курсор страниц — (registered_at, telegram_id); пользователи без даты уходят в конец списка
+    op.execute("UPDATE users SET registered_at = 'epoch' WHERE registered_at IS NULL")
+    op.alter_column("users", "registered_at", nullable=False)
+
+    op.drop_index("ix_users_pending", table_name="users")
+    op.create_index(
+        "ix_users_pending", "users", ["registered_at", "telegram_id"],
+        postgresql_where=sa.text("NOT is_approved")
+    )
+    op.create_index("ix_users_registered", "users", [sa.text("registered_at DESC"), sa.text("telegram_id DESC")])
+    op.create_index("ix_users_username_lower", "users", [sa.text("lower(username) text_pattern_ops")])
+
+
+def downgrade():
+    op.drop_index("ix_users_username_lower", table_name="users")
+    op.drop_index("ix_users_registered", table_name="users")
+    op.drop_index("ix_users_pending", table_name="users")
+    op.create_index(
+        "ix_users_pending", "users", ["registered_at"],
+        postgresql_where=sa.text("NOT is_approved")
+    )
+    op.alter_column("users", "registered_at", nullable=True)
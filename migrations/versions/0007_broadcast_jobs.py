@@ -0,0 +1,64 @@
+"""Рассылки с журналом доставки и флаг заблокировавших бота пользователей
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "users",
+        sa.Column("is_blocked", sa.Boolean(), nullable=False, server_default=sa.text("false"))
+    )
+    op.drop_index("ix_users_approved", table_name="users")
+    op.create_index(
+        "ix_users_recipients", "users", ["telegram_id"],
+        postgresql_where=sa.text("is_approved AND NOT is_blocked")
+    )
+
+    op.create_table(
+        "broadcast_jobs",
+        sa.Column("id", sa.BigInteger(), primary_key=True, autoincrement=True),
+        sa.Column("admin_id", sa.BigInteger(), nullable=False),
+        sa.Column("message_text", sa.String(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("progress_message_id", sa.BigInteger(), nullable=True),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("sent", sa.Integer(), nullable=False),
+        sa.Column("failed", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index(
+        "ix_broadcast_jobs_running", "broadcast_jobs", ["id"],
+        postgresql_where=sa.text("status = 'running'")
+    )
+    op.create_table(
+        "broadcast_deliveries",
+        sa.Column(
+            "job_id", sa.BigInteger(), sa.ForeignKey("broadcast_jobs.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column("user_id", sa.BigInteger(), primary_key=True),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("delivered_at", sa.DateTime(timezone=True), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("broadcast_deliveries")
+    op.drop_index("ix_broadcast_jobs_running", table_name="broadcast_jobs")
+    op.drop_table("broadcast_jobs")
+    op.drop_index("ix_users_recipients", table_name="users")
+    op.create_index(
+        "ix_users_approved", "users", ["telegram_id"],
+        postgresql_where=sa.text("is_approved")
+    )
+    op.drop_column("users", "is_blocked")
@@ -0,0 +1,21 @@
+"""Файлы в рассылках
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("broadcast_jobs", sa.Column("media", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("broadcast_jobs", "media")
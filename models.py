@@ -1,10 +1,30 @@
 from sqlalchemy.orm import declarative_base,relationship
-from sqlalchemy import Column, BigInteger, String, Integer, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, BigInteger, String, Integer, Boolean, DateTime, ForeignKey, Index, JSON, func, text
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime, timezone
-from config import engine
 
 Base = declarative_base()
 
+
+class UTCDateTime(TypeDecorator):
+    """
+    Колонка timestamp без зоны, в которой хранится время UTC.
+    asyncpg не принимает для неё aware-datetime, поэтому зона снимается при записи
+    и возвращается при чтении.
+    """
+    impl = DateTime
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
 class AccountLog(Base):
     __tablename__ = 'account_logs'
     id = Column(BigInteger, primary_key=True, autoincrement=True)
@@ -13,6 +33,11 @@ class AccountLog(Base):
     action_date = Column(DateTime(timezone=True), nullable=False, default=datetime.utcnow)
     action = Column(String, nullable=False, default='taken')
 
+    __table_args__ = (
+        Index('ix_account_logs_user_date', 'user_id', action_date.desc()),
+        Index('ix_account_logs_account_date', 'account_id', action_date.desc()),
+    )
+
 
 
 class Email(Base):
@@ -23,6 +48,20 @@ class Email(Base):
     accountfk = Column(BigInteger, ForeignKey('accounts.id'), nullable=False)
 
     account = relationship("Account", back_populates="emails")
+    cursor = relationship("MailCursor", uselist=False, cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (
+        Index('uq_emails_accountfk', 'accountfk', unique=True),
+    )
+
+
+class MailCursor(Base):
+    # Курсор IMAP-ящика: письма с UID <= last_uid уже просмотрены
+    __tablename__ = 'mail_cursors'
+    email_id = Column(BigInteger, ForeignKey('emails.id', ondelete='CASCADE'), primary_key=True)
+    uid_validity = Column(BigInteger, nullable=True)
+    last_uid = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
 
 
 class User(Base):
@@ -32,7 +71,19 @@ class User(Base):
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     is_approved = Column(Boolean, default=False)
-    registered_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    registered_at = Column(UTCDateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    # Бот заблокирован пользователем (Forbidden при рассылке); сбрасывается при /start
+    is_blocked = Column(Boolean, nullable=False, default=False, server_default=text('false'))
+
+    __table_args__ = (
+        # Постраничные списки пользователей: keyset по (registered_at, telegram_id)
+        Index('ix_users_pending', 'registered_at', 'telegram_id', postgresql_where=text('NOT is_approved')),
+        Index('ix_users_registered', registered_at.desc(), telegram_id.desc()),
+        # Получатели рассылки
+        Index('ix_users_recipients', 'telegram_id', postgresql_where=text('is_approved AND NOT is_blocked')),
+        # Поиск админом по началу username
+        Index('ix_users_username_lower', text('lower(username) text_pattern_ops')),
+    )
 
 
 
@@ -44,10 +95,75 @@ class Account(Base):
     behavior = Column(Integer)
     mmr = Column(Integer)
     calibration = Column(Boolean, default=False)
-    status = Column(String)  # free or rented
-    rented_at = Column(DateTime, nullable=True)
+    status = Column(String)  # free or rented; меняется вместе с записью в rentals
+    # Устаревшие поля аренды: данные перенесены в rentals (миграция 0004), код их не заполняет
+    rented_at = Column(UTCDateTime, nullable=True)
     renter_id = Column(Integer, nullable=True)
     rent_duration = Column(Integer, nullable=True)
+    # shared_secret мобильного аутентификатора Steam: код Steam Guard генерируется локально
+    steam_shared_secret = Column(String, nullable=True)
 
     emails = relationship("Email", back_populates="account", cascade="all, delete-orphan")
-Base.metadata.create_all(engine)
+
+    # Схема и индексы создаются миграциями (migrations/), а не при импорте модуля
+    __table_args__ = (
+        Index('ix_accounts_status_mmr', 'status', mmr.desc()),
+        # Постраничные списки: coalesce(mmr, 0) DESC, id (см. pagination.py)
+        Index('ix_accounts_mmr_id', func.coalesce(mmr, 0).desc(), id),
+    )
+
+
+class Rental(Base):
+    # Аренда аккаунта: активна, пока ended_at пуст
+    __tablename__ = 'rentals'
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    account_id = Column(BigInteger, ForeignKey('accounts.id', ondelete='CASCADE'), nullable=False)
+    user_id = Column(BigInteger, nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ends_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True), nullable=True)
+    ended_reason = Column(String, nullable=True)  # returned, expired, user_deleted
+
+    account = relationship("Account")
+
+    __table_args__ = (
+        # Одна активная аренда на аккаунт и одна на пользователя
+        Index('uq_rentals_active_account', 'account_id', unique=True, postgresql_where=text('ended_at IS NULL')),
+        Index('uq_rentals_active_user', 'user_id', unique=True, postgresql_where=text('ended_at IS NULL')),
+        Index('ix_rentals_ends_at', 'ends_at', postgresql_where=text('ended_at IS NULL')),
+        Index('ix_rentals_user_started', 'user_id', started_at.desc()),
+    )
+
+    @property
+    def duration_minutes(self):
+        return int((self.ends_at - self.started_at).total_seconds() // 60)
+
+
+class BroadcastJob(Base):
+    # Рассылка: сообщение и счётчики; status running, пока не разослана всем
+    __tablename__ = 'broadcast_jobs'
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    admin_id = Column(BigInteger, nullable=False)
+    message_text = Column(String, nullable=False)  # текст или подпись к файлам
+    # Файлы рассылки: [{"type": "photo" | "document", "file_id": ...}]; file_id уже загруженных в Telegram файлов
+    media = Column(JSON, nullable=True)
+    status = Column(String, nullable=False, default='running')  # running, finished
+    progress_message_id = Column(BigInteger, nullable=True)
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_broadcast_jobs_running', 'id', postgresql_where=text("status = 'running'")),
+    )
+
+
+class BroadcastDelivery(Base):
+    # Итог доставки рассылки одному получателю; нет строки — ещё не отправлено
+    __tablename__ = 'broadcast_deliveries'
+    job_id = Column(BigInteger, ForeignKey('broadcast_jobs.id', ondelete='CASCADE'), primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    status = Column(String, nullable=False)  # sent, failed, blocked
+    delivered_at = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
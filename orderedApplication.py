@@ -0,0 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from telegram import Update
+from telegram.ext import Application
+
+from config import MAX_CONCURRENT_UPDATES
+
+
+def update_key(update: object):
+    """Ключ очереди апдейта — (чат, пользователь), как у ConversationHandler; None — без очереди."""
+    if not isinstance(update, Update):
+        return None
+    chat, user = update.effective_chat, update.effective_user
+    if chat is None and user is None:
+        return None
+    return chat.id if chat else None, user.id if user else None
+
+
+class KeyedLocks:
+    """asyncio.Lock на ключ; замок удаляется, когда его никто не держит и не ждёт."""
+
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
+
+
+class OrderedApplication(Application):
+    """
+    Application, обрабатывающий апдейты разных пользователей параллельно.
+    Апдейты одного чата и пользователя идут строго по очереди (замок FIFO на ключ),
+    поэтому состояние ConversationHandler и порядок сообщений сохраняются.
+    Общий лимит MAX_CONCURRENT_UPDATES берётся уже после замка пользователя:
+    ждущие своей очереди апдейты не занимают места тех, кто может выполняться.
+    """
+
+    def __init__(self, max_concurrent_updates=MAX_CONCURRENT_UPDATES, **kwargs):
+        super().__init__(**kwargs)
+        self._update_locks = KeyedLocks()
+        self._processing_sem = asyncio.Semaphore(max_concurrent_updates)
+
+    async def process_update(self, update: object) -> None:
+        key = update_key(update)
+        if key is None:
+            async with self._processing_sem:
+                return await super().process_update(update)
+        async with self._update_locks.hold(key):
+            async with self._processing_sem:
+                await super().process_update(update)
@@ -0,0 +1,176 @@
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from sqlalchemy import func, literal, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from telegram import InlineKeyboardButton
+
+from config import ACCOUNTS_PAGE_SIZE, USERS_PAGE_SIZE
+from models import Account, User
+
+# Страница списка: курсоры — пары чисел, ключи крайних записей; None, если листать в эту сторону некуда
+Page = namedtuple("Page", ["items", "prev_cursor", "next_cursor"])
+
+_PAGE_DATA = re.compile(r"_page_([np])_(-?\d+)_(\d+)$")
+
+
+def sort_key(mmr, account_id):
+    # Общий порядок всех списков аккаунтов: MMR по убыванию (пустой MMR как 0), затем ID
+    return -(mmr or 0), account_id
+
+
+def cursor_of(account):
+    return account.mmr or 0, account.id
+
+
+def user_cursor_of(user):
+    # registered_at в курсоре — микросекунды с начала эпохи, чтобы уместиться в callback_data
+    registered_at = user.registered_at.replace(tzinfo=timezone.utc) if user.registered_at.tzinfo is None \
+        else user.registered_at
+    return int(registered_at.timestamp() * 1_000_000), user.telegram_id
+
+
+def page_pattern(prefix):
+    """Шаблон callback_data кнопок листания списка с данным префиксом."""
+    return rf"^{prefix}_page_[np]_-?\d+_\d+$"
+
+
+def parse_page_callback(data):
+    """
+    Курсор из callback_data вида {prefix}_page_{n|p}_{ключ}_{id}.
+    Возвращает (cursor, backward); для входа в список без листания — (None, False).
+    """
+    match = _PAGE_DATA.search(data or "")
+    if not match:
+        return None, False
+    direction, mmr, account_id = match.groups()
+    return (int(mmr), int(account_id)), direction == "p"
+
+
+def page_callback(cursor, backward=False) -> str:
+    """
+    Суффикс callback_data с курсором страницы: {prefix}{суффикс} разбирает parse_page_callback.
+    Кнопки действий на странице несут его, чтобы после действия показать ту же страницу.
+    """
+    if cursor is None:
+        return ""
+    key, item_id = cursor
+    return f"_page_{'p' if backward else 'n'}_{key}_{item_id}"
+
+
+def page_buttons(prefix, page: Page) -> list:
+    """Строка кнопок «Назад/Вперёд» для клавиатуры; пустой список, если страница одна."""
+    row = []
+    if page.prev_cursor:
+        row.append(InlineKeyboardButton("◀️ Назад", callback_data=prefix + page_callback(page.prev_cursor, True)))
+    if page.next_cursor:
+        row.append(InlineKeyboardButton("Вперёд ▶️", callback_data=prefix + page_callback(page.next_cursor)))
+    return [row] if row else []
+
+
+def make_page(items, cursor, backward, has_more, key=cursor_of):
+    if backward:
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = cursor is not None, has_more
+    return Page(
+        items,
+        key(items[0]) if items and has_prev else None,
+        key(items[-1]) if items and has_next else None,
+    )
+
+
+async def fetch_accounts_page(session: AsyncSession, cursor=None, backward=False,
+                              page_size=ACCOUNTS_PAGE_SIZE, options=()) -> Page:
+    """
+    Страница аккаунтов keyset-запросом ORDER BY mmr DESC, id LIMIT n
+    (индекс ix_accounts_mmr_id): цена запроса не зависит от номера страницы.
+    """
+    mmr = func.coalesce(Account.mmr, 0)
+    query = select(Account).options(*options)
+    if cursor is None:
+        query = query.order_by(mmr.desc(), Account.id)
+    elif not backward:
+        cursor_mmr, cursor_id = cursor
+        query = query.where(mmr <= cursor_mmr, or_(mmr < cursor_mmr, Account.id > cursor_id)) \
+            .order_by(mmr.desc(), Account.id)
+    else:
+        cursor_mmr, cursor_id = cursor
+        query = query.where(mmr >= cursor_mmr, or_(mmr > cursor_mmr, Account.id < cursor_id)) \
+            .order_by(mmr.asc(), Account.id.desc())
+
+    items = list((await session.scalars(query.limit(page_size + 1))).all())
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if backward:
+        items.reverse()
+    if not items and cursor is not None:
+        # Аккаунты страницы успели удалить — показываем начало списка
+        return await fetch_accounts_page(session, page_size=page_size, options=options)
+    return make_page(items, cursor, backward, has_more)
+
+
+async def fetch_users_page(session: AsyncSession, cursor=None, backward=False, pending=False,
+                           page_size=USERS_PAGE_SIZE) -> Page:
+    """
+    Страница пользователей keyset-запросом по (registered_at, telegram_id).
+    Все пользователи — сначала новые (ix_users_registered),
+    ожидающие подтверждения — сначала давно ждущие (ix_users_pending).
+    """
+    key = tuple_(User.registered_at, User.telegram_id)
+    query = select(User)
+    if pending:
+        query = query.where(~User.is_approved)
+    # Новые сверху для общего списка, старые сверху для очереди подтверждения
+    descending = not pending
+    if cursor is not None:
+        registered_at = datetime.fromtimestamp(cursor[0] / 1_000_000, timezone.utc)
+        bound = tuple_(literal(registered_at, User.registered_at.type), literal(cursor[1], User.telegram_id.type))
+        query = query.where(key < bound if descending != backward else key > bound)
+    if descending != backward:
+        query = query.order_by(User.registered_at.desc(), User.telegram_id.desc())
+    else:
+        query = query.order_by(User.registered_at, User.telegram_id)
+
+    items = list((await session.scalars(query.limit(page_size + 1))).all())
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if backward:
+        items.reverse()
+    if not items and cursor is not None:
+        return await fetch_users_page(session, pending=pending, page_size=page_size)
+    return make_page(items, cursor, backward, has_more, key=user_cursor_of)
+
+
+async def search_users(session: AsyncSession, query_text, limit=USERS_PAGE_SIZE) -> list:
+    """
+    Поиск пользователей по Telegram ID (точное совпадение) или началу username без учёта регистра
+    (индекс ix_users_username_lower). Возвращает до limit + 1 записей: лишняя значит «уточните запрос».
+    """
+    query_text = query_text.strip().lstrip("@")
+    if not query_text:
+        return []
+    condition = func.lower(User.username).startswith(query_text.lower(), autoescape=True)
+    if query_text.isdigit() and len(query_text) <= 18:
+        condition = or_(User.telegram_id == int(query_text), condition)
+    return list((await session.scalars(
+        select(User).where(condition).order_by(User.registered_at.desc(), User.telegram_id.desc()).limit(limit + 1)
+    )).all())
+
+
+def slice_page(keys, cursor=None, backward=False, page_size=ACCOUNTS_PAGE_SIZE):
+    """
+    Та же страница для отсортированного по возрастанию списка ключей sort_key.
+    Возвращает (start, end, has_more) — границы среза и есть ли записи дальше по направлению.
+    """
+    if cursor is None:
+        return 0, min(page_size, len(keys)), len(keys) > page_size
+    if backward:
+        end = bisect_left(keys, sort_key(*cursor))
+        start = max(0, end - page_size)
+        return start, end, start > 0
+    start = bisect_right(keys, sort_key(*cursor))
+    end = min(start + page_size, len(keys))
+    return start, end, end < len(keys)
@@ -0,0 +1,83 @@
+import logging
+from datetime import datetime, timezone
+
+from apscheduler.jobstores.base import JobLookupError
+from sqlalchemy import insert, select
+
+from config import Session, scheduler
+from models import AccountLog, Rental
+from inventory import inventory
+from mailWatcher import mail_watcher
+from rentals import end_rentals_statement
+
+AUTO_RETURN_ACTION = 'Возврат аккаунта(Автоматический)'
+
+
+class RentalExpiryScheduler:
+    """
+    Возврат аккаунтов точно по окончании аренды.
+    На каждую аренду — одноразовая задача APScheduler на rentals.ends_at;
+    при запуске бота задачи восстанавливаются из БД. Сам возврат — один
+    UPDATE ... RETURNING по всем истёкшим арендам и пакетная вставка логов.
+    """
+
+    def __init__(self, scheduler=scheduler):
+        self.scheduler = scheduler
+
+    @staticmethod
+    def _job_id(account_id):
+        return f"rental_expiry_{account_id}"
+
+    def schedule(self, account_id, ends_at):
+        self.scheduler.add_job(
+            self.release_expired, 'date', run_date=ends_at, id=self._job_id(account_id),
+            replace_existing=True, misfire_grace_time=None, coalesce=True
+        )
+
+    def cancel(self, account_id):
+        try:
+            self.scheduler.remove_job(self._job_id(account_id))
+        except JobLookupError:
+            pass
+
+    def rebuild(self):
+        """Восстанавливает задачи по активным арендам; просроченные за время простоя освобождает сразу."""
+        now = datetime.now(timezone.utc)
+        with Session() as session:
+            rentals = session.execute(
+                select(Rental.account_id, Rental.ends_at)
+                .where(Rental.ended_at.is_(None), Rental.ends_at > now)
+            ).all()
+        for account_id, ends_at in rentals:
+            self.schedule(account_id, ends_at)
+        self.release_expired()
+        logging.info(f"[RentalExpiry] Восстановлено задач возврата: {len(rentals)}")
+
+    def release_expired(self):
+        """Освобождает все аккаунты, у которых истекла аренда. Возвращает их ID."""
+        now = datetime.now(timezone.utc)
+        try:
+            with Session() as session:
+                released = session.execute(
+                    end_rentals_statement(Rental.ends_at <= now, "expired", ended_at=now)
+                ).all()
+                if released:
+                    session.execute(insert(AccountLog), [
+                        {"user_id": user_id, "account_id": account_id,
+                         "action": AUTO_RETURN_ACTION, "action_date": now}
+                        for account_id, user_id in released
+                    ])
+                session.commit()
+        except Exception as e:
+            logging.error(f"[RentalExpiry] Ошибка автоматического возврата аккаунтов: {e}", exc_info=True)
+            return []
+
+        # Арендатор, ещё ждущий код Steam Guard, его уже не получит
+        mail_watcher.cancel_accounts_threadsafe([account_id for account_id, _ in released])
+        for account_id, user_id in released:
+            inventory.mark_free(account_id)
+            logging.info(f"[RentalExpiry] Автоматический возврат аккаунта ID {account_id}, арендовал User {user_id}")
+        return [account_id for account_id, _ in released]
+
+
+rental_expiry = RentalExpiryScheduler()
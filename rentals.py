@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import exists, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from models import Account, Email, Rental
+
+
+async def claim_account(session: AsyncSession, account_id, user_id, duration):
+    """
+    Атомарно закрепляет свободный аккаунт за пользователем одним запросом:
+    UPDATE accounts ... WHERE status = 'free' RETURNING, INSERT в rentals
+    и почта аккаунта. Из двух одновременных нажатий выигрывает одно — второе
+    после блокировки строки видит status = 'rented' и ничего не получает;
+    вторую активную аренду того же пользователя не пропустит уникальный индекс.
+    Возвращает строку (id, login, password, steam_shared_secret, rental_id,
+    started_at, email_id, email_login, email_password) или None.
+    """
+    started_at = datetime.now(timezone.utc)
+    # UPDATE/INSERT внутри CTE строятся на уровне Core: ORM-вариант можно выполнять только как верхний запрос
+    accounts = Account.__table__
+    rentals = Rental.__table__
+    claimed = (
+        update(accounts)
+        .where(
+            accounts.c.id == account_id,
+            accounts.c.status == "free",
+            ~exists().where(rentals.c.user_id == user_id, rentals.c.ended_at.is_(None)),
+        )
+        .values(status="rented")
+        .returning(accounts.c.id, accounts.c.login, accounts.c.password, accounts.c.steam_shared_secret)
+        .cte("claimed")
+    )
+    rental = (
+        insert(rentals)
+        .from_select(
+            ["account_id", "user_id", "started_at", "ends_at"],
+            select(
+                claimed.c.id,
+                literal(user_id, Rental.user_id.type),
+                literal(started_at, Rental.started_at.type),
+                literal(started_at + timedelta(minutes=duration), Rental.ends_at.type),
+            ),
+        )
+        .returning(rentals.c.id, rentals.c.account_id, rentals.c.started_at, rentals.c.ends_at)
+        .cte("rental")
+    )
+    try:
+        row = (await session.execute(
+            select(
+                claimed,
+                rental.c.id.label("rental_id"),
+                rental.c.started_at,
+                rental.c.ends_at,
+                Email.id.label("email_id"),
+                Email.login.label("email_login"),
+                Email.password.label("email_password"),
+            )
+            .join(rental, rental.c.account_id == claimed.c.id)
+            .outerjoin(Email, Email.accountfk == claimed.c.id)
+        )).first()
+        await session.commit()
+    except IntegrityError:
+        # Параллельная аренда того же пользователя: запрос целиком откатился
+        await session.rollback()
+        return None
+    return row
+
+
+def end_rentals_statement(condition, reason, ended_at=None):
+    """
+    Завершает активные аренды по условию и освобождает их аккаунты одним запросом.
+    Возвращает строки (account_id, user_id).
+    """
+    rentals = Rental.__table__
+    accounts = Account.__table__
+    ended = (
+        update(rentals)
+        .where(rentals.c.ended_at.is_(None), condition)
+        .values(ended_at=ended_at or datetime.now(timezone.utc), ended_reason=reason)
+        .returning(rentals.c.account_id, rentals.c.user_id)
+        .cte("ended")
+    )
+    return (
+        update(accounts)
+        .where(accounts.c.id == ended.c.account_id)
+        .values(status="free")
+        .returning(accounts.c.id, ended.c.user_id)
+    )
+
+
+async def end_rentals(session: AsyncSession, condition, reason):
+    return (await session.execute(end_rentals_statement(condition, reason))).all()
+
+
+async def get_active_rental(session: AsyncSession, user_id) -> Rental | None:
+    return await session.scalar(
+        select(Rental)
+        .options(joinedload(Rental.account))
+        .where(Rental.user_id == user_id, Rental.ended_at.is_(None))
+    )
+
+
+async def has_active_rental(session: AsyncSession, user_id) -> bool:
+    return bool(await session.scalar(
+        select(exists().where(Rental.user_id == user_id, Rental.ended_at.is_(None)))
+    ))
+
+
+async def active_rentals_by_account(session: AsyncSession, account_ids=None) -> dict:
+    query = select(Rental).where(Rental.ended_at.is_(None))
+    if account_ids is not None:
+        query = query.where(Rental.account_id.in_(account_ids))
+    rentals = (await session.scalars(query)).all()
+    return {rental.account_id: rental for rental in rentals}
@@ -0,0 +1,96 @@
+import html
+import re
+
+# Фразы письма Steam о входе с нового устройства (разные локализации шаблона)
+_VERIFICATION_PHRASES = (
+    r"log\s*in from a new device",
+    r"Steam Guard code you need",
+    r"войти с нового устройства",
+    r"код Steam Guard",
+    r"увійти з нового пристрою",
+    r"von einem neuen Gerät",
+    r"Steam-Guard-Code",
+    r"Steam Guard-Code",
+    r"desde un dispositivo nuevo",
+    r"código de Steam Guard",
+    r"depuis un nouvel appareil",
+    r"code Steam Guard",
+    r"de um novo dispositivo",
+    r"código do Steam Guard",
+    r"z nowego urządzenia",
+    r"kod Steam Guard",
+    r"yeni bir cihazdan",
+    r"Steam Guard kodu",
+    r"da un nuovo dispositivo",
+    r"codice di Steam Guard",
+    r"新设备",
+    r"新裝置",
+    r"Steam 令牌",
+)
+_VERIFICATION_RE = re.compile("|".join(_VERIFICATION_PHRASES), re.IGNORECASE)
+
+# Якорь, после которого в письме идёт код: "Steam Guard" есть во всех локализациях, кроме китайской
+_ANCHOR_RE = re.compile(r"Steam\s*Guard|Steam\s*令牌", re.IGNORECASE)
+# Код Steam стоит отдельной строкой после якоря
+_CODE_LINE_RE = re.compile(r"^[ \t]*([A-Z0-9]{5})[ \t]*$", re.MULTILINE)
+# Запасной вариант: код в той же фразе, например "Steam Guard code: F4K9Q"
+_CODE_INLINE_RE = re.compile(r"(?<![A-Za-z0-9])([A-Z0-9]{5})(?![A-Za-z0-9])")
+_ANCHOR_WINDOW = 400
+_STOP_WORDS = frozenset({"STEAM", "GUARD", "VALVE", "DOTA2", "HTTPS"})
+
+_HTML_DROP_RE = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_BREAK_RE = re.compile(r"<\s*(br|/p|/div|/td|/tr|/h\d|/li|/table)\b[^>]*>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_BLANK_LINES_RE = re.compile(r"\n\s*\n+")
+
+
+def html_to_text(markup: str) -> str:
+    text = _HTML_DROP_RE.sub(" ", markup)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    text = _HTML_TAG_RE.sub(" ", text)
+    text = html.unescape(text).replace("\xa0", " ")
+    return _BLANK_LINES_RE.sub("\n\n", text)
+
+
+class SteamCodeExtractor:
+    """
+    Поиск кода Steam Guard в письмах.
+    Все регулярные выражения скомпилированы заранее; поддерживаются
+    локализованные шаблоны и письма, в которых есть только HTML-часть.
+    """
+
+    def is_verification_text(self, text: str) -> bool:
+        return bool(_VERIFICATION_RE.search(text))
+
+    def extract_from_text(self, text: str) -> str | None:
+        if not self.is_verification_text(text):
+            return None
+        for anchor in _ANCHOR_RE.finditer(text):
+            window = text[anchor.end():anchor.end() + _ANCHOR_WINDOW]
+            for pattern in (_CODE_LINE_RE, _CODE_INLINE_RE):
+                for match in pattern.finditer(window):
+                    code = match.group(1)
+                    if code not in _STOP_WORDS:
+                        return code
+        return None
+
+    def extract_from_html(self, markup: str) -> str | None:
+        return self.extract_from_text(html_to_text(markup))
+
+    def extract_from_part(self, payload: str, subtype: str) -> str | None:
+        return self.extract_from_text(self.part_text(payload, subtype))
+
+    @staticmethod
+    def part_text(payload: str, subtype: str) -> str:
+        return html_to_text(payload) if subtype == "html" else payload
+
+    @staticmethod
+    def find_account(text: str, logins) -> str | None:
+        """Логин из logins, упомянутый в письме: Steam обращается к владельцу по имени аккаунта."""
+        for login in logins:
+            if re.search(rf"(?<![A-Za-z0-9_]){re.escape(login)}(?![A-Za-z0-9_])", text, re.IGNORECASE):
+                return login.lower()
+        return None
+
+
+steam_code_extractor = SteamCodeExtractor()
@@ -0,0 +1,48 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+import time
+
+STEAM_GUARD_ALPHABET = "23456789BCDFGHJKMNPQRTVWXY"
+STEAM_GUARD_PERIOD = 30
+
+
+def decode_shared_secret(shared_secret: str) -> bytes | None:
+    """shared_secret из maFile мобильного аутентификатора — base64 от 20 байт."""
+    try:
+        key = base64.b64decode(shared_secret.strip(), validate=True)
+    except (binascii.Error, ValueError, AttributeError):
+        return None
+    return key or None
+
+
+def is_valid_shared_secret(shared_secret: str) -> bool:
+    return decode_shared_secret(shared_secret) is not None
+
+
+def generate_steam_guard_code(shared_secret: str, timestamp: float = None) -> str:
+    """
+    Генерирует 5-символьный код Steam Guard локально, без обращения к сети.
+    Алгоритм — TOTP (HMAC-SHA1, шаг 30 с) с алфавитом Steam.
+    """
+    key = decode_shared_secret(shared_secret)
+    if key is None:
+        raise ValueError("Некорректный shared_secret Steam Guard")
+
+    counter = int((time.time() if timestamp is None else timestamp) // STEAM_GUARD_PERIOD)
+    digest = hmac.new(key, struct.pack(">Q", counter), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack(">I", digest[offset:offset + 4])[0] & 0x7FFFFFFF
+
+    code = []
+    for _ in range(5):
+        value, index = divmod(value, len(STEAM_GUARD_ALPHABET))
+        code.append(STEAM_GUARD_ALPHABET[index])
+    return "".join(code)
+
+
+def seconds_until_next_code(timestamp: float = None) -> int:
+    now = time.time() if timestamp is None else timestamp
+    return STEAM_GUARD_PERIOD - int(now) % STEAM_GUARD_PERIOD
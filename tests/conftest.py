@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+# Тесты с БД работают только с отдельной базой: таблицы в ней пересоздаются
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+    # Пустое значение не даёт подхватить ASYNC_DATABASE_URL рабочей базы из .env
+    os.environ["ASYNC_DATABASE_URL"] = os.getenv("TEST_ASYNC_DATABASE_URL", "")
+else:
+    # Тестам без БД нужен только импорт config: движки создаются, но не подключаются
+    os.environ["DATABASE_URL"] = "postgresql://test@localhost/test"
+    os.environ["ASYNC_DATABASE_URL"] = ""
+os.environ.setdefault("BOT_TOKEN", "0:test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    """Подменяет time.monotonic и asyncio.sleep модуля: время идёт только по sleep и вручную."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += max(seconds, 0)
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
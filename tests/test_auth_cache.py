@@ -0,0 +1,61 @@
+from types import SimpleNamespace
+
+import pytest
+
+import authCache
+from authCache import AuthCache, UserAccess
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(authCache, "time", SimpleNamespace(monotonic=fake_clock.monotonic))
+    return fake_clock
+
+
+def test_hit_and_miss(clock):
+    cache = AuthCache(max_size=10, ttl=60)
+    assert cache.get(1) is None
+    assert cache.put(1, is_approved=1, is_admin=None) == UserAccess(True, False)
+    assert cache.get(1) == UserAccess(True, False)
+    assert (cache.hits, cache.misses, cache.hit_rate) == (1, 1, 0.5)
+
+
+def test_ttl(clock):
+    cache = AuthCache(max_size=10, ttl=60)
+    cache.put(1, True, False)
+    clock.now += 59
+    assert cache.get(1) is not None
+    clock.now += 1
+    assert cache.get(1) is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction(clock):
+    cache = AuthCache(max_size=2, ttl=60)
+    cache.put(1, True, False)
+    cache.put(2, True, False)
+    # Чтение делает запись самой свежей: вытесняется 2, а не 1
+    cache.get(1)
+    cache.put(3, True, False)
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.get(3) is not None
+    assert len(cache) == 2
+
+
+def test_put_refreshes_entry(clock):
+    cache = AuthCache(max_size=10, ttl=60)
+    cache.put(1, False, False)
+    clock.now += 50
+    cache.put(1, True, False)
+    clock.now += 50
+    assert cache.get(1) == UserAccess(True, False)
+
+
+def test_invalidate(clock):
+    cache = AuthCache(max_size=10, ttl=60)
+    cache.put(1, True, True)
+    cache.invalidate(1)
+    cache.invalidate(2)
+    assert cache.get(1) is None
+    assert cache.hit_rate == 0
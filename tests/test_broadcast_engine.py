@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import broadcastEngine
+from broadcastEngine import ChatPacer, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(broadcastEngine, "time", SimpleNamespace(monotonic=fake_clock.monotonic))
+    monkeypatch.setattr(broadcastEngine, "asyncio", SimpleNamespace(sleep=fake_clock.sleep, Lock=asyncio.Lock))
+    return fake_clock
+
+
+def acquire_times(clock, bucket, count):
+    async def run():
+        times = []
+        for _ in range(count):
+            await bucket.acquire()
+            times.append(clock.now - 1000.0)
+        return times
+    return asyncio.run(run())
+
+
+def test_bucket_rate_without_burst(clock):
+    bucket = TokenBucket(rate=10)
+    # Первый токен есть сразу, дальше по одному в 1 / rate секунд
+    assert acquire_times(clock, bucket, 4) == pytest.approx([0, 0.1, 0.2, 0.3])
+
+
+def test_bucket_capacity_allows_burst(clock):
+    bucket = TokenBucket(rate=10, capacity=3)
+    assert acquire_times(clock, bucket, 4) == pytest.approx([0, 0, 0, 0.1])
+
+
+def test_bucket_refills_while_idle(clock):
+    bucket = TokenBucket(rate=10)
+    acquire_times(clock, bucket, 1)
+    clock.now += 5
+    # За паузу накопится не больше capacity токенов
+    assert acquire_times(clock, bucket, 2) == pytest.approx([5, 5.1])
+
+
+def test_bucket_pause(clock):
+    bucket = TokenBucket(rate=10)
+    bucket.pause(3)
+    bucket.pause(1)
+    assert acquire_times(clock, bucket, 2) == pytest.approx([3, 3.1])
+
+
+def test_chat_pacer(clock):
+    pacer = ChatPacer(interval=1.0)
+
+    async def run():
+        await pacer.wait(1)
+        pacer.sent(1)
+        clock.now += 0.25
+        await pacer.wait(2)
+        await pacer.wait(1)
+
+    asyncio.run(run())
+    # Второй чат не ждёт, первый — остаток интервала
+    assert clock.slept == pytest.approx([0.75])
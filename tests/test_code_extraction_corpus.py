@@ -0,0 +1,40 @@
+"""
+Корпус benchmarks/corpus через тот же путь, что и чтение настоящего ящика:
+FirstMailCodeReader._scan_messages над письмами, отданными как FETCH-ответы IMAP.
+"""
+import pytest
+
+from benchmarks.corpusMailbox import CorpusMailbox, load_corpus
+from getCodeFromMail import FirstMailCodeReader
+from mailSessions import MailboxSession
+
+SAMPLES = load_corpus()
+LOGINS = {sample.expected_account for sample in SAMPLES if sample.expected_account}
+
+
+def scan(sample, logins):
+    session = MailboxSession("corpus@test", "test", "corpus", 993)
+    reader = FirstMailCodeReader("corpus@test", "test")
+    codes = reader._scan_messages(CorpusMailbox(SAMPLES), session, [sample.uid], logins, "Steam", None, set())
+    return codes, session
+
+
+def test_corpus_is_not_empty():
+    assert SAMPLES and LOGINS
+
+
+@pytest.mark.parametrize("sample", SAMPLES, ids=[sample.name for sample in SAMPLES])
+def test_code_and_account(sample):
+    codes, session = scan(sample, LOGINS)
+    if sample.expected_code is None:
+        assert codes == {}
+        assert not session.pending_codes
+    else:
+        assert codes == {sample.expected_account: sample.expected_code}
+
+
+@pytest.mark.parametrize("sample", [s for s in SAMPLES if s.expected_code], ids=lambda sample: sample.name)
+def test_code_of_unawaited_account_is_kept(sample):
+    codes, session = scan(sample, {"someone_else"})
+    assert codes == {}
+    assert session.take_pending_code(sample.expected_account) == sample.expected_code
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+
+from inventory import InventoryIndex
+
+ACCOUNTS = [(1, 5000), (2, 3000), (3, 5000), (4, 6100), (5, None), (6, 1500), (7, 4200)]
+
+
+def account(account_id, mmr, status="free"):
+    return SimpleNamespace(id=account_id, mmr=mmr, behavior=5, calibration=True, status=status)
+
+
+@pytest.fixture
+def index():
+    index = InventoryIndex()
+    for account_id, mmr in ACCOUNTS:
+        index.upsert(account(account_id, mmr))
+    return index
+
+
+def ids(page):
+    return [record.id for record in page.items]
+
+
+def test_pages_in_sort_order(index):
+    first = index.page(page_size=3)
+    assert ids(first) == [4, 1, 3]
+    assert first.prev_cursor is None
+    second = index.page(cursor=first.next_cursor, page_size=3)
+    assert ids(second) == [7, 2, 6]
+    last = index.page(cursor=second.next_cursor, page_size=3)
+    assert ids(last) == [5] and last.next_cursor is None
+    assert ids(index.page(cursor=last.prev_cursor, backward=True, page_size=3)) == [7, 2, 6]
+
+
+def test_rent_and_free(index):
+    index.mark_rented(1, user_id=100)
+    assert index.rented_by(100) == 1
+    assert ids(index.page(status="rented")) == [1]
+    assert 1 not in ids(index.page(status="free"))
+
+    index.mark_free(1, mmr=2000)
+    assert index.rented_by(100) is None
+    assert ids(index.page(status="rented")) == []
+    assert ids(index.page(status="free")) == [4, 3, 7, 2, 1, 6, 5]
+
+
+def test_upsert_keeps_renter(index):
+    index.mark_rented(2, user_id=100)
+    index.upsert(account(2, 7000, status="rented"))
+    assert index.rented_by(100) == 2
+    assert ids(index.page(page_size=1)) == [2]
+
+
+def test_remove(index):
+    index.mark_rented(4, user_id=100)
+    index.remove(4)
+    index.remove(999)
+    assert index.rented_by(100) is None
+    assert 4 not in ids(index.page())
+
+
+def test_empty_page_falls_back_to_start(index):
+    cursor = index.page(status="free", page_size=6).next_cursor
+    index.mark_rented(5, user_id=100)
+    # Последняя запись страницы сменила статус — показываем начало списка
+    page = index.page(status="free", cursor=cursor, page_size=6)
+    assert ids(page) == [4, 1, 3, 7, 2, 6]
+    assert page.prev_cursor is None
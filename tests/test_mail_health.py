@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import pytest
+
+import mailHealth
+from mailHealth import CircuitBreaker, PollSchedule
+
+
+@pytest.fixture
+def clock(monkeypatch, fake_clock):
+    monkeypatch.setattr(mailHealth, "time", SimpleNamespace(monotonic=fake_clock.monotonic))
+    return fake_clock
+
+
+def open_breaker(clock):
+    breaker = CircuitBreaker("imap.test", failure_threshold=3, reset_timeout=60)
+    for _ in range(3):
+        assert breaker.allow_request()
+        breaker.record_failure(1.0, OSError("timeout"))
+    return breaker
+
+
+def test_opens_after_threshold(clock):
+    breaker = CircuitBreaker("imap.test", failure_threshold=3, reset_timeout=60)
+    breaker.record_failure(1.0, OSError("timeout"))
+    breaker.record_failure(1.0, OSError("timeout"))
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure(1.0, OSError("timeout"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.is_open()
+    assert not breaker.allow_request()
+    assert breaker.rejected == 1
+    assert breaker.last_error == "OSError: timeout"
+
+
+def test_success_resets_failure_count(clock):
+    breaker = CircuitBreaker("imap.test", failure_threshold=2, reset_timeout=60)
+    breaker.record_failure(1.0, OSError("timeout"))
+    breaker.record_success(0.5)
+    breaker.record_failure(1.0, OSError("timeout"))
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.average_latency == pytest.approx(2.5 / 3)
+
+
+def test_single_probe_when_half_open(clock):
+    breaker = open_breaker(clock)
+    clock.now += 60
+    assert not breaker.is_open()
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.is_probing()
+    # Пока проба не завершилась, остальные запросы отклоняются
+    assert not breaker.allow_request()
+    assert not breaker.allow_request()
+
+
+def test_probe_success_closes(clock):
+    breaker = open_breaker(clock)
+    clock.now += 60
+    assert breaker.allow_request()
+    breaker.record_success(0.2)
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert not breaker.is_probing()
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+
+
+def test_probe_failure_reopens(clock):
+    breaker = open_breaker(clock)
+    clock.now += 60
+    assert breaker.allow_request()
+    breaker.record_failure(1.0, OSError("timeout"))
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow_request()
+    clock.now += 60
+    assert breaker.allow_request()
+
+
+def test_stale_probe_gives_way(clock):
+    breaker = open_breaker(clock)
+    clock.now += 60
+    assert breaker.allow_request()
+    # Задачу пробы отменили, результата не будет
+    clock.now += 59
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+
+
+def test_fast_delays_first():
+    schedule = PollSchedule(fast_delays=(2, 3, 5), jitter=0)
+    assert [schedule.next_delay(attempt) for attempt in range(3)] == [2, 3, 5]
+
+
+def test_backoff_grows_to_max():
+    schedule = PollSchedule(fast_delays=(2,), base_delay=5, factor=2, max_delay=30, jitter=0)
+    assert [schedule.next_delay(attempt) for attempt in range(1, 6)] == [10, 20, 30, 30, 30]
+
+
+def test_jitter_bounds():
+    schedule = PollSchedule(fast_delays=(), base_delay=10, factor=1, max_delay=30, jitter=0.25)
+    delays = [schedule.next_delay(0) for _ in range(200)]
+    assert all(7.5 <= delay <= 12.5 for delay in delays)
+    assert len(set(delays)) > 1
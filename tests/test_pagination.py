@@ -0,0 +1,97 @@
+import re
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from pagination import Page, make_page, page_buttons, page_callback, page_pattern, parse_page_callback, slice_page, \
+    sort_key, user_cursor_of
+
+# 7 аккаунтов: (mmr, id), двое с одинаковым MMR и один без MMR
+ACCOUNTS = [(5000, 3), (5000, 1), (4200, 7), (3000, 2), (None, 5), (6100, 4), (1500, 6)]
+KEYS = sorted(sort_key(mmr, account_id) for mmr, account_id in ACCOUNTS)
+
+
+def ids(start, end):
+    return [account_id for _, account_id in KEYS[start:end]]
+
+
+def test_sort_order():
+    assert ids(0, len(KEYS)) == [4, 1, 3, 7, 2, 6, 5]
+
+
+def test_first_page():
+    assert slice_page(KEYS, page_size=3) == (0, 3, True)
+    assert slice_page(KEYS, page_size=10) == (0, 7, False)
+
+
+def test_forward_and_back():
+    start, end, has_more = slice_page(KEYS, cursor=(5000, 3), page_size=3)
+    assert ids(start, end) == [7, 2, 6] and has_more
+    start, end, has_more = slice_page(KEYS, cursor=(1500, 6), page_size=3)
+    assert ids(start, end) == [5] and not has_more
+    start, end, has_more = slice_page(KEYS, cursor=(4200, 7), backward=True, page_size=3)
+    assert ids(start, end) == [4, 1, 3] and not has_more
+    start, end, has_more = slice_page(KEYS, cursor=(0, 5), backward=True, page_size=3)
+    assert ids(start, end) == [7, 2, 6] and has_more
+
+
+def test_cursor_of_deleted_record():
+    # Записи курсора уже нет — страница начинается со следующей по порядку
+    start, end, _ = slice_page(KEYS, cursor=(5000, 2), page_size=2)
+    assert ids(start, end) == [3, 7]
+
+
+def item(mmr, account_id):
+    return SimpleNamespace(mmr=mmr, id=account_id)
+
+
+def test_make_page_cursors():
+    items = [item(5000, 3), item(4200, 7)]
+    assert make_page(items, None, False, True) == Page(items, None, (4200, 7))
+    assert make_page(items, (5000, 1), False, False) == Page(items, (5000, 3), None)
+    assert make_page(items, (3000, 2), True, False) == Page(items, None, (4200, 7))
+    assert make_page([], None, False, False) == Page([], None, None)
+
+
+def test_page_callback_round_trip():
+    page = Page([], (5000, 3), (0, 5))
+    [row] = page_buttons("list", page)
+    back, forward = (button.callback_data for button in row)
+    assert back == "list_page_p_5000_3"
+    assert forward == "list_page_n_0_5"
+    assert parse_page_callback(back) == ((5000, 3), True)
+    assert parse_page_callback(forward) == ((0, 5), False)
+
+
+def test_no_buttons_for_single_page():
+    assert page_buttons("list", Page([], None, None)) == []
+
+
+@pytest.mark.parametrize("data", ["list", "", None, "list_page_x_1_2"])
+def test_parse_without_cursor(data):
+    assert parse_page_callback(data) == (None, False)
+
+
+def test_page_pattern():
+    assert re.match(page_pattern("users"), "users_page_p_-5_42")
+    assert not re.match(page_pattern("users"), "list_page_p_5_42")
+
+
+def test_user_cursor_of():
+    aware = datetime(2026, 10, 17, 12, 0, 0, 123456, tzinfo=timezone.utc)
+    naive = aware.replace(tzinfo=None)
+    expected = (int(aware.timestamp()) * 1_000_000 + 123456, 42)
+    assert user_cursor_of(SimpleNamespace(registered_at=aware, telegram_id=42)) == expected
+    assert user_cursor_of(SimpleNamespace(registered_at=naive, telegram_id=42)) == expected
+    # Курсор пользователя проходит через тот же формат callback_data
+    [row] = page_buttons("users", Page([], expected, None))
+    assert parse_page_callback(row[0].callback_data) == (expected, True)
+
+
+def test_action_callback_keeps_page():
+    # Кнопка действия на странице несёт её курсор: после действия показываем ту же страницу
+    assert page_callback(None) == ""
+    data = "approve_user_42" + page_callback((1_700_000_000_000_000, 7), backward=True)
+    assert parse_page_callback(data) == ((1_700_000_000_000_000, 7), True)
+    assert len(data) <= 64
@@ -0,0 +1,106 @@
+"""
+Число SQL-запросов на апдейт не зависит от числа аккаунтов: почты и аренды
+загружаются пачкой, а не запросом на каждый аккаунт (N+1).
+Нужна пустая база PostgreSQL в TEST_DATABASE_URL, иначе тесты пропускаются.
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+if not TEST_DATABASE_URL:
+    pytest.skip("TEST_DATABASE_URL не задан", allow_module_level=True)
+
+from config import ADMIN_IDS, AsyncSessionLocal, async_engine
+from models import Account, Base, Email, Rental, User
+from authCache import auth_cache
+from unitOfWork import close_update_session, open_update_session, statement_count
+import main
+
+ADMIN_ID = 1
+MANY_ACCOUNTS = 20
+TABLES = [User.__table__, Account.__table__, Email.__table__, Rental.__table__]
+
+
+class FakeCallbackQuery:
+    def __init__(self, data):
+        self.data = data
+        self.message = SimpleNamespace(text="", reply_markup=None)
+        self.text = None
+
+    async def answer(self, *args, **kwargs):
+        pass
+
+    async def edit_message_text(self, text, **kwargs):
+        self.text = text
+
+
+def make_update(data):
+    return SimpleNamespace(
+        update_id=1,
+        effective_user=SimpleNamespace(id=ADMIN_ID),
+        message=None,
+        callback_query=FakeCallbackQuery(data),
+    )
+
+
+async def add_accounts(start, count):
+    """Аккаунты с почтой и активной арендой; первый арендован админом."""
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as session:
+        for account_id in range(start, start + count):
+            session.add(Account(id=account_id, login=f"acc{account_id}", password="pass", mmr=account_id * 100,
+                                behavior=5, calibration=True, status="rented"))
+            session.add(Email(id=account_id, login=f"acc{account_id}@mail.test", password="pass", accountfk=account_id))
+            session.add(Rental(id=account_id, account_id=account_id, user_id=ADMIN_ID if account_id == 1 else 1000 + account_id,
+                               started_at=now, ends_at=now + timedelta(hours=1)))
+        await session.commit()
+
+
+async def count_statements(handler, data):
+    """Выполняет хендлер как апдейт бота и возвращает число SQL-запросов за апдейт."""
+    auth_cache.invalidate(ADMIN_ID)
+    update = make_update(data)
+    context = SimpleNamespace()
+    await open_update_session(update, context)
+    await handler(update, context)
+    count = statement_count()
+    await close_update_session(update, context)
+    assert update.callback_query.text
+    return count
+
+
+async def statement_counts(handler, data):
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all, tables=TABLES)
+        await conn.run_sync(Base.metadata.create_all, tables=TABLES)
+    try:
+        async with AsyncSessionLocal() as session:
+            session.add(User(telegram_id=ADMIN_ID, is_approved=True))
+            await session.commit()
+        await add_accounts(1, 1)
+        one = await count_statements(handler, data)
+        await add_accounts(2, MANY_ACCOUNTS - 1)
+        many = await count_statements(handler, data)
+        return one, many
+    finally:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all, tables=TABLES)
+        await async_engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def admin():
+    ADMIN_IDS.add(ADMIN_ID)
+    yield
+    ADMIN_IDS.discard(ADMIN_ID)
+    auth_cache.invalidate(ADMIN_ID)
+
+
+def test_list_accounts_statement_count_does_not_grow():
+    one, many = asyncio.run(statement_counts(main.list_accounts, "list"))
+    assert one == many
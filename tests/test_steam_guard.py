@@ -0,0 +1,32 @@
+import base64
+
+import pytest
+
+from steamGuard import generate_steam_guard_code, is_valid_shared_secret, seconds_until_next_code
+
+# Ключ и значения HOTP для счётчиков 0, 1, 2 — тестовые векторы RFC 4226 (приложение D):
+# 1284755224, 1094287082, 137359152 в алфавите Steam
+RFC4226_SECRET = base64.b64encode(b"12345678901234567890").decode()
+
+
+@pytest.mark.parametrize("timestamp, code", [(0, "GG5F5"), (30, "PV9M4"), (60, "B26KJ"), (89.9, "B26KJ")])
+def test_known_vector(timestamp, code):
+    assert generate_steam_guard_code(RFC4226_SECRET, timestamp) == code
+
+
+def test_code_alphabet():
+    code = generate_steam_guard_code(RFC4226_SECRET)
+    assert len(code) == 5
+    assert set(code) <= set("23456789BCDFGHJKMNPQRTVWXY")
+
+
+@pytest.mark.parametrize("secret", ["", "not base64!", "   ", None])
+def test_invalid_secret(secret):
+    assert not is_valid_shared_secret(secret)
+    with pytest.raises(ValueError):
+        generate_steam_guard_code(secret, 0)
+
+
+def test_seconds_until_next_code():
+    assert seconds_until_next_code(60) == 30
+    assert seconds_until_next_code(89.5) == 1
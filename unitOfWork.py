@@ -0,0 +1,82 @@
+import logging
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from telegram import Update
+from telegram.ext import Application, CallbackContext, TypeHandler
+
+from config import AsyncSessionLocal, async_engine, DB_STATEMENTS_WARN_THRESHOLD
+from models import User
+
+# Группа, в которой сессия закрывается: после всех хендлеров бота
+UNIT_OF_WORK_CLOSE_GROUP = 100
+
+# error handler получает новый context, поэтому сессию апдейта ищем здесь
+_update_session = ContextVar("update_session", default=None)
+# Число SQL-запросов текущего апдейта: растёт с числом строк — значит, в хендлере N+1
+_statement_count = ContextVar("statement_count", default=None)
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _statement_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def statement_count() -> int:
+    counter = _statement_count.get()
+    return counter[0] if counter is not None else 0
+
+
+async def open_update_session(update: object, context: CallbackContext):
+    """
+    Одна сессия БД на апдейт: открывается до хендлеров, хендлеры берут context.db_session.
+    Соединение из пула занимается только при первом запросе, поэтому апдейты,
+    обслуженные из кэша прав, к БД не обращаются.
+    """
+    session = AsyncSessionLocal()
+    _update_session.set(session)
+    _statement_count.set([0])
+    context.db_session = session
+    context.db_user = None
+
+
+async def load_db_user(update: Update, context: CallbackContext) -> User | None:
+    """Текущий пользователь, загружается не больше одного раза за апдейт."""
+    if context.db_user is None and update.effective_user:
+        context.db_user = await context.db_session.get(User, update.effective_user.id)
+    return context.db_user
+
+
+async def close_update_session(update: object, context: CallbackContext):
+    """Фиксирует то, что хендлер не закоммитил сам, и возвращает соединение в пул."""
+    session = getattr(context, "db_session", None)
+    if session is None:
+        return
+    try:
+        await session.commit()
+    finally:
+        await session.close()
+        context.db_session = None
+        _update_session.set(None)
+
+    count = statement_count()
+    update_id = getattr(update, "update_id", None)
+    if count > DB_STATEMENTS_WARN_THRESHOLD:
+        logging.warning(f"[UnitOfWork] Апдейт {update_id}: {count} SQL-запросов")
+    else:
+        logging.debug(f"[UnitOfWork] Апдейт {update_id}: {count} SQL-запросов")
+
+
+async def rollback_update_session(update: object, context: CallbackContext):
+    session = _update_session.get()
+    if session is not None:
+        await session.rollback()
+    logging.error(f"Ошибка при обработке апдейта: {context.error}", exc_info=context.error)
+
+
+def register_unit_of_work(application: Application):
+    application.add_handler(TypeHandler(Update, open_update_session), group=-1)
+    application.add_handler(TypeHandler(Update, close_update_session), group=UNIT_OF_WORK_CLOSE_GROUP)
+    application.add_error_handler(rollback_update_session)
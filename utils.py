@@ -1,10 +1,12 @@
 import telegram
 from telegram.ext import CallbackContext
 
-from config import ADMIN_IDS, Session
+from config import ADMIN_IDS
 from datetime import timezone, timedelta
 import logging
 from models import User
+from authCache import auth_cache, UserAccess
+from unitOfWork import load_db_user
 from telegram import (
     Update, ReplyKeyboardRemove, InlineKeyboardButton,InlineKeyboardMarkup
 )
@@ -29,12 +31,6 @@ def format_datetime(dt):
     except Exception as e:
         return f"Неверная дата: {e}"
 
-def get_all_user_ids():
-    with Session() as session:
-        users = session.query(User).filter(User.is_approved == True).all()
-        return [u.telegram_id for u in users]
-
-
 async def show_registration_error(update: Update, message: str):
     try:
         if update.callback_query:
@@ -81,7 +77,8 @@ def main_menu_keyboard(user_id):
             [InlineKeyboardButton("🗑  Удалить аккаунт", callback_data="admin_delete_start"),
              InlineKeyboardButton("📋  Все пользователи", callback_data="show_all_users")],
 
-            [InlineKeyboardButton("🆕  Новые пользователи", callback_data="show")],
+            [InlineKeyboardButton("🆕  Новые пользователи", callback_data="show_pending_users"),
+             InlineKeyboardButton("📊  Состояние почты", callback_data="mail_health")],
             [InlineKeyboardButton("📢  Рассылка", callback_data="admin_broadcast_start")]
         ]
 
@@ -103,17 +100,27 @@ async def show_main_menu(update: Update, context: CallbackContext):
         reply_markup=main_menu_keyboard(user_id)
     )
 
-async def check_user_is_approved_and_admin(update: Update):
+async def get_user_access(update: Update, context: CallbackContext) -> UserAccess | None:
+    """Права пользователя из кэша; в БД идём только при промахе. None — пользователь не зарегистрирован."""
+    user_id = update.effective_user.id
+    access = auth_cache.get(user_id)
+    if access is None:
+        user_obj = await load_db_user(update, context)
+        if not user_obj:
+            return None
+        access = auth_cache.put(user_id, user_obj.is_approved, is_admin(user_id))
+    return access
+
+
+async def check_user_is_approved_and_admin(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    session = Session()
-    user_obj = session.query(User).filter_by(telegram_id=user_id).first()
-    session.close()
+    access = await get_user_access(update, context)
 
-    if not user_obj:
+    if not access:
         await show_registration_error(update, "❌ Вы не зарегистрированы.")
         return False
 
-    if not user_obj.is_approved:
+    if not access.is_approved:
         await show_registration_error(update, "⏳ Ваш аккаунт ещё не подтверждён админом.")
         return False
 
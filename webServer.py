@@ -0,0 +1,95 @@
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from config import BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, PORT
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebServer:
+    """
+    HTTP-сервер процесса бота на aiohttp: /health для проверок хостинга
+    и, в режиме webhook, приём обновлений от Telegram на WEBHOOK_PATH.
+    Обновления после проверки секрета кладутся в очередь Application —
+    дальше их обрабатывают те же хендлеры, что и при long polling.
+    Бот работает в одном экземпляре: состояние ожиданий кода, индекс аккаунтов
+    и кэш прав живут в памяти процесса, а webhook у бота Telegram один.
+    """
+
+    def __init__(self, application: Application):
+        self.application = application
+        self.web_app = web.Application()
+        self.web_app.router.add_get("/", self.health)
+        self.web_app.router.add_get("/health", self.health)
+        if BOT_MODE == "webhook":
+            self.web_app.router.add_post(WEBHOOK_PATH, self.webhook)
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    async def webhook(self, request: web.Request) -> web.Response:
+        secret = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(secret, WEBHOOK_SECRET):
+            logging.warning(f"[WebServer] Запрос на webhook с неверным секретом от {request.remote}")
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logging.warning(f"[WebServer] Некорректное обновление на webhook: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def run(self):
+        """Запускает бота (webhook или long polling) и HTTP-сервер; работает до SIGINT/SIGTERM."""
+        application = self.application
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+        runner = web.AppRunner(self.web_app)
+        await runner.setup()
+        webhook_set = False
+        try:
+            await application.start()
+            # Порт открываем до set_webhook: Telegram начинает слать обновления сразу
+            await web.TCPSite(runner, "0.0.0.0", PORT).start()
+            if BOT_MODE == "webhook":
+                await application.bot.set_webhook(
+                    WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET,
+                    allowed_updates=Update.ALL_TYPES,
+                )
+                webhook_set = True
+            else:
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            logging.info(f"[WebServer] Бот запущен в режиме {BOT_MODE}, HTTP-порт {PORT}")
+
+            await stop_event.wait()
+        finally:
+            if webhook_set:
+                # Без webhook Telegram копит обновления до следующего запуска, а не шлёт их на закрытый порт
+                try:
+                    await application.bot.delete_webhook()
+                except Exception as e:
+                    logging.warning(f"[WebServer] Не удалось снять webhook: {e}")
+            await runner.cleanup()
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)